@@ -1,15 +1,181 @@
-import sys
+import argparse
+import atexit
+import os
+import signal
+import socket
+import tempfile
+import threading
 
-from departure_server.query_strategy import RejseplanenQueryStrategy
+from departure_server.async_server import AsyncServer
+from departure_server.cache import CachingQueryStrategy
+from departure_server.metrics import REGISTRY, SamplingProfiler
+from departure_server.prefetch import PrefetchScheduler
+from departure_server.prefork import Supervisor
+from departure_server.query_strategy import QueryStrategy, RejseplanenQueryStrategy
+from departure_server.rate_limit import TokenBucket
+from departure_server.recording import RecordingQueryStrategy, ReplayQueryStrategy
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker
+from departure_server.registry import StationRegistry
+from departure_server.rest import RESTHandler
+from departure_server.shared_cache import SharedCacheQueryStrategy
+from departure_server.single_flight import SingleFlightQueryStrategy
+from departure_server.spatial import SpatialIndex
+from departure_server.station import StationLibrary
+from departure_server.tiles import TileCache
 import departure_server.request_handler
 
 __author__ = 'budde'
 
 import http.server
 
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog='departure_server')
+    parser.add_argument('base_url', nargs='?', help='The base URL of the Rejseplanen API. Not used with --replay')
+    parser.add_argument('--mode', choices=['async', 'threaded', 'sync'], default='async',
+                        help='Serve on an asyncio event loop, with a thread per request, or one request at a time')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pool-size', type=int, default=8,
+                        help='Maximum number of persistent connections to the Rejseplanen API')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='Seconds before a call to the Rejseplanen API times out')
+    parser.add_argument('--deadline', type=float, default=5,
+                        help='Seconds before a call to the Rejseplanen API is abandoned and a fallback is served')
+    parser.add_argument('--upstream-rate', type=float, default=20,
+                        help='Maximum calls per second to the Rejseplanen API')
+    parser.add_argument('--breaker-failures', type=int, default=5,
+                        help='Consecutive failed or slow calls opening the circuit to the Rejseplanen API')
+    parser.add_argument('--breaker-latency', type=float,
+                        help='Seconds after which a successful call counts as a failure')
+    parser.add_argument('--breaker-reset', type=float, default=30,
+                        help='Seconds the circuit stays open before a trial call')
+    parser.add_argument('--cache-ttl', type=float, default=30,
+                        help='Seconds a departure board is served from the cache')
+    parser.add_argument('--cache-stale-ttl', type=float, default=120,
+                        help='Seconds after the TTL a stale board is served while refreshing')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Maximum number of cached departure boards')
+    parser.add_argument('--prefetch-top', type=int, default=20,
+                        help='Number of the most requested departure boards prefetched in the background, 0 disables')
+    parser.add_argument('--prefetch-budget', type=float, default=2,
+                        help='Maximum upstream calls per second spent on prefetching')
+    parser.add_argument('--profiler', action='store_true',
+                        help='Serve sampling profiles of the server on /debug/profile?seconds={seconds}')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of pre-forked worker processes sharing the listening socket, 0 serves in-process')
+    parser.add_argument('--shared-cache',
+                        help='An SQLite file caching upstream responses across processes. '
+                             'Defaults to a temporary file with --workers')
+    parser.add_argument('--station-registry',
+                        help='An SQLite file remembering the stations seen, and their changing ids, across restarts')
+    parser.add_argument('--record', metavar='ARCHIVE',
+                        help='Record the responses of the Rejseplanen API, and their timing, to a compressed archive')
+    parser.add_argument('--replay', metavar='ARCHIVE',
+                        help='Serve the responses of a recorded archive instead of querying the Rejseplanen API')
+    parser.add_argument('--replay-speed', type=float, default=1,
+                        help='How many times faster than recorded the archive is replayed')
+    parser.add_argument('--nearby-tile-size', type=int, default=1000,
+                        help='The size in micro-degrees of the smallest tiles of the grid nearby stations are fetched '
+                             'and cached by, 0 queries the exact circle of every request')
+    parser.add_argument('--stop-dump', help='A LocationList XML file with all stops used for finding nearby stops')
+    arguments = parser.parse_args()
+    if (arguments.base_url is None) == (arguments.replay is None):
+        parser.error('either a base URL or --replay is required')
+    if arguments.record is not None and (arguments.replay is not None or arguments.workers > 0):
+        parser.error('--record can\'t be used with --replay or --workers')
+    return arguments
+
+
+def build(arguments: argparse.Namespace) -> (QueryStrategy, StationLibrary, SamplingProfiler):
+    """
+    Builds the strategy, library, and profiler of a server process
+    """
+    if arguments.replay is not None:
+        upstream = ReplayQueryStrategy(arguments.replay, arguments.replay_speed)
+    elif arguments.record is not None:
+        upstream = RecordingQueryStrategy(arguments.base_url, arguments.record, arguments.pool_size, arguments.timeout)
+        atexit.register(upstream.close)
+    else:
+        upstream = RejseplanenQueryStrategy(arguments.base_url, arguments.pool_size, arguments.timeout)
+    resilient = ResilientQueryStrategy(upstream,
+                                       rate_limit=TokenBucket(arguments.upstream_rate),
+                                       deadline=arguments.deadline,
+                                       latency_threshold=arguments.breaker_latency,
+                                       breaker=CircuitBreaker(arguments.breaker_failures, arguments.breaker_reset))
+    single_flight = SingleFlightQueryStrategy(resilient)
+    shared = single_flight
+    if arguments.shared_cache is not None:
+        shared = SharedCacheQueryStrategy(single_flight, arguments.shared_cache, ttl=arguments.cache_ttl)
+        REGISTRY.add_collector('shared_cache', shared.stats)
+    strategy = cache = CachingQueryStrategy(shared,
+                                            ttl=arguments.cache_ttl,
+                                            stale_ttl=arguments.cache_stale_ttl,
+                                            max_size=arguments.cache_size)
+    if arguments.prefetch_top > 0:
+        strategy = PrefetchScheduler(strategy, top=arguments.prefetch_top,
+                                     budget=TokenBucket(arguments.prefetch_budget))
+        strategy.start()
+        REGISTRY.add_collector('prefetch', strategy.stats)
+    REGISTRY.add_collector('upstream', lambda: {'connections_opened': upstream.pool.connections_opened,
+                                                'requests': upstream.pool.requests})
+    REGISTRY.add_collector('resilience', resilient.stats)
+    REGISTRY.add_collector('single_flight', single_flight.stats)
+    REGISTRY.add_collector('cache', cache.stats)
+    profiler = SamplingProfiler() if arguments.profiler else None
+    registry = None
+    if arguments.station_registry is not None:
+        registry = StationRegistry(arguments.station_registry)
+        REGISTRY.add_collector('station_registry', registry.stats)
+    tiles = None
+    if arguments.nearby_tile_size > 0:
+        tiles = TileCache(arguments.nearby_tile_size)
+        REGISTRY.add_collector('nearby_tiles', tiles.stats)
+    library = StationLibrary(strategy, SpatialIndex(), registry, tiles)
+    if arguments.stop_dump is not None:
+        library.load_stops(arguments.stop_dump)
+    return strategy, library, profiler
+
+
+def serve(arguments: argparse.Namespace, sock: socket.socket=None):
+    """
+    Serves on the address of the arguments, or on an already listening socket
+    """
+    (strategy, library, profiler) = build(arguments)
+    if arguments.mode == 'async':
+        server = AsyncServer(RESTHandler(strategy, library), profiler=profiler)
+        if sock is None:
+            server.serve_forever(arguments.host, arguments.port)
+        else:
+            server.serve_forever(sock=sock)
+        return
+    server_class = departure_server.request_handler.ThreadedHTTPServer if arguments.mode == 'threaded' \
+        else http.server.HTTPServer
+    handler = departure_server.request_handler.setup_handler(strategy, library, profiler=profiler)
+    if sock is None:
+        server = server_class((arguments.host, arguments.port), handler)
+    else:
+        server = server_class(sock.getsockname(), handler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+    # shutdown waits for serve_forever to return, so it can't be called by the handler itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
 if __name__ == "__main__":
-    base_url = sys.argv[1]
-    server = http.server.HTTPServer(('localhost', 8000),
-                                    departure_server.request_handler.setup_handler(
-                                        RejseplanenQueryStrategy(base_url)))
-    server.serve_forever()
+    arguments = parse_arguments()
+    if arguments.workers > 0:
+        temporary = arguments.shared_cache is None
+        if temporary:
+            arguments.shared_cache = os.path.join(tempfile.gettempdir(), 'departure_server-%d.sqlite' % os.getpid())
+        Supervisor(arguments.workers, lambda sock: serve(arguments, sock)).run(arguments.host, arguments.port)
+        if temporary:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(arguments.shared_cache + suffix):
+                    os.remove(arguments.shared_cache + suffix)
+    else:
+        serve(arguments)
@@ -0,0 +1,282 @@
+import asyncio
+import os
+import posixpath
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from urllib.parse import urlparse, unquote, parse_qs
+
+from departure_server.http_cache import ResponseCache, STATIC_MAX_AGE
+from departure_server.live import LiveDepartures
+from departure_server.metrics import REGISTRY, REQUEST_SECONDS, Registry, SamplingProfiler, stage, \
+    CONTENT_TYPE as METRICS_CONTENT_TYPE
+from departure_server.request_handler import parse_api_path, content_type
+from departure_server.rest import RESTHandler, NoSuchFunctionException, BadRequestException, degraded_result
+from departure_server.serialization import encode_result
+
+__author__ = 'budde'
+
+_encode_stage = stage('encode')
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int):
+        self.status = status
+
+
+class AsyncServer:
+    """
+    A HTTP/1.1 server running on an asyncio event loop.
+    API calls are handled by a REST handler on a thread pool, such that upstream queries never block the loop,
+    while static files are served from a directory. Connections are kept alive between requests.
+    """
+    def __init__(self, rest_handler: RESTHandler, directory: str=None, max_workers: int=32,
+                 keep_alive_timeout: float=15, max_header_size: int=65536, response_cache: ResponseCache=None,
+                 registry: Registry=None, profiler: SamplingProfiler=None):
+        """
+        :param rest_handler: The handler of API calls
+        :param directory: The directory of static files. Defaults to the working directory
+        :param max_workers: The maximum number of concurrent API calls
+        :param keep_alive_timeout: Seconds an idle connection is kept open
+        :param max_header_size: The maximum size of the request line and headers in bytes
+        :param response_cache: The cache of API responses. Defaults to a new cache
+        :param registry: The metrics served on /metrics. Defaults to the registry of the server
+        :param profiler: The profiler run by /debug/profile?seconds={seconds}. Defaults to none, i.e. no profiling
+        """
+        self.rest_handler = rest_handler
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        self.directory = os.path.abspath(directory if directory is not None else os.getcwd())
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_header_size = max_header_size
+        self.registry = registry if registry is not None else REGISTRY
+        self.profiler = profiler
+        self.active_requests = 0
+
+    async def start(self, host: str=None, port: int=None, backlog: int=1024,
+                    sock: socket.socket=None) -> asyncio.AbstractServer:
+        """
+        Starts listening on the given address, or accepting on an already listening socket
+        :return: The asyncio server
+        """
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=backlog,
+                                          limit=self.max_header_size, sock=sock)
+
+    def serve_forever(self, host: str=None, port: int=None, sock: socket.socket=None, drain_timeout: float=10):
+        """
+        Serves until SIGTERM is received, if running in the main thread, or forever.
+        On SIGTERM no more connections are accepted, and requests being handled have `drain_timeout` seconds to finish.
+        """
+        async def serve():
+            server = await self.start(host, port, sock=sock)
+            stopped = asyncio.Event()
+            if threading.current_thread() is threading.main_thread():
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+            async with server:
+                await stopped.wait()
+            deadline = time.monotonic() + drain_timeout
+            while self.active_requests and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+
+        try:
+            asyncio.run(serve())
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handles requests on a connection until it is closed
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, keep_alive=False)
+                    break
+                self.active_requests += 1
+                try:
+                    keep_alive = await self.handle_request(head, writer)
+                finally:
+                    self.active_requests -= 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, head: bytes, writer: asyncio.StreamWriter) -> bool:
+        """
+        Handles a single request
+        :param head: The request line and headers
+        :return: Whether the connection should be kept alive
+        """
+        lines = head.decode('iso-8859-1').split('\r\n')
+        try:
+            (method, target, version) = lines[0].split(' ')
+        except ValueError:
+            await self.send(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+            return False
+        request_headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                (key, value) = line.split(':', 1)
+                request_headers[key.strip().lower()] = value.strip()
+        connection = request_headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+        if method not in ('GET', 'HEAD'):
+            await self.send(writer, HTTPStatus.NOT_IMPLEMENTED, keep_alive=keep_alive)
+            return keep_alive
+
+        started_at = time.perf_counter()
+        try:
+            if target[0:5] == "/api/":
+                (status, body, headers) = await self.api_response(target, request_headers)
+                if isinstance(body, LiveDepartures):
+                    await self.send_live(writer, body)
+                    return False
+                route = self.rest_handler.route(parse_api_path(target)[0])
+            elif target == "/metrics":
+                (status, body, headers) = (HTTPStatus.OK, self.registry.expose(),
+                                           [('Content-Type', METRICS_CONTENT_TYPE), ('Cache-Control', 'no-cache')])
+                route = None
+            elif target[0:15] == "/debug/profile?" and self.profiler is not None:
+                (status, body, headers) = await self.profile(target)
+                route = None
+            else:
+                (status, body, headers) = await self.static_file(target, request_headers)
+                route = 'static'
+            if route is not None:
+                REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started_at)
+        except HTTPError as e:
+            await self.send(writer, e.status, keep_alive=keep_alive)
+            return keep_alive
+
+        await self.send(writer, status, body, headers, keep_alive, method == 'HEAD')
+        return keep_alive
+
+    async def api_response(self, target: str, request_headers: dict) -> (int, bytes, list):
+        response = self.response_cache.lookup(target)
+        if response is None:
+            result = await self.api_result(target)
+            if isinstance(result, LiveDepartures):
+                return HTTPStatus.OK, result, []
+            with _encode_stage.time():
+                body = encode_result(result)
+            response = self.response_cache.store(target, body, degraded_result(result))
+        headers = self.response_cache.headers(response)
+        if response.matches(request_headers.get('if-none-match')):
+            return HTTPStatus.NOT_MODIFIED, b'', headers
+        return HTTPStatus.OK, response.body, headers
+
+    async def api_result(self, target: str):
+        (name, query) = parse_api_path(target)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, self.rest_handler.handle, name, query)
+        except (NoSuchFunctionException, BadRequestException):
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        except Exception:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    async def profile(self, target: str) -> (int, bytes, list):
+        """
+        Runs the profiler for the number of seconds of the query
+        :return: The collapsed stacks
+        """
+        try:
+            seconds = float(parse_qs(urlparse(target).query)['seconds'][0])
+        except (KeyError, ValueError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self.executor, self.profiler.profile, seconds)
+        except RuntimeError:
+            raise HTTPError(HTTPStatus.CONFLICT)
+        return HTTPStatus.OK, body, [('Content-Type', 'text/plain; charset=utf-8'), ('Cache-Control', 'no-cache')]
+
+    @staticmethod
+    async def send_live(writer: asyncio.StreamWriter, live: LiveDepartures):
+        """
+        Streams the changes of the departures of a station as server-sent events until the client disconnects
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        unsubscribe = live.subscribe(lambda data: loop.call_soon_threadsafe(events.put_nowait, data))
+        try:
+            writer.write(bytes("HTTP/1.1 200 OK\r\n"
+                               "Date: %s\r\n"
+                               "Content-Type: text/event-stream\r\n"
+                               "Cache-Control: no-cache\r\n"
+                               "Connection: close\r\n\r\n" % formatdate(usegmt=True), 'iso-8859-1'))
+            while True:
+                try:
+                    writer.write(live.event(await asyncio.wait_for(events.get(), live.heartbeat_interval)))
+                except asyncio.TimeoutError:
+                    writer.write(live.heartbeat())
+                await writer.drain()
+        finally:
+            unsubscribe()
+
+    async def static_file(self, target: str, request_headers: dict) -> (int, bytes, list):
+        path = self.translate_path(target)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        modified = int(os.path.getmtime(path))
+        headers = [('Content-Type', content_type(path)),
+                   ('Last-Modified', formatdate(modified, usegmt=True)),
+                   ('Cache-Control', 'public, max-age=%d' % STATIC_MAX_AGE)]
+        if _not_modified_since(request_headers.get('if-modified-since'), modified):
+            return HTTPStatus.NOT_MODIFIED, b'', headers
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self.executor, _read_file, path)
+        except OSError:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        return HTTPStatus.OK, body, headers
+
+    def translate_path(self, target: str) -> str:
+        """
+        Translates a request target to a path within the static directory
+        """
+        path = posixpath.normpath(unquote(urlparse(target).path))
+        parts = [part for part in path.split('/') if part and part not in (os.curdir, os.pardir)]
+        return os.path.join(self.directory, *parts)
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, status: int, body: bytes=None, headers: list=None,
+                   keep_alive: bool=True, head_only: bool=False):
+        status = HTTPStatus(status)
+        if body is None:
+            body = bytes(status.phrase, 'UTF-8') if status != HTTPStatus.OK else b''
+        lines = ["HTTP/1.1 %d %s" % (status.value, status.phrase),
+                 "Date: %s" % formatdate(usegmt=True),
+                 "Connection: %s" % ('keep-alive' if keep_alive else 'close')]
+        if status != HTTPStatus.NOT_MODIFIED:
+            lines.append("Content-Length: %d" % len(body))
+        lines.extend("%s: %s" % header for header in (headers or []))
+        writer.write(bytes("\r\n".join(lines) + "\r\n\r\n", 'iso-8859-1') + (b'' if head_only else body))
+        await writer.drain()
+
+
+def _not_modified_since(if_modified_since: str, modified: int) -> bool:
+    if if_modified_since is None:
+        return False
+    try:
+        return modified <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
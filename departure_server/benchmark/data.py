@@ -0,0 +1,66 @@
+import random
+from xml.sax.saxutils import quoteattr
+
+__author__ = 'budde'
+
+_types = ['BUS', 'EXB', 'S', 'TOG', 'REG', 'IC', 'LYN', 'M']
+_directions = ['Nykøbing F St.', 'Helsingør St.', 'Hässleholm C og Kalmar C', 'Ny Ellebjerg St.', 'Aarhus H',
+               'Lufthavnen St. (Metro)', 'Vanløse St. (Metro)', 'Hundige St.', 'Østerport St.', 'Odense St.']
+
+
+def departure_board(size: int, seed: int=0, cancelled_ratio: float=0.05) -> bytes:
+    """
+    Generates a DepartureBoard in the format of Rejseplanen
+    :param size: The number of departures
+    :param seed: The seed of the random generator
+    :param cancelled_ratio: The ratio of cancelled departures
+    :return: The UTF-8 encoded XML
+    """
+    generator = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<DepartureBoard>']
+    for i in range(size):
+        minutes = 10 * 60 + i * 15 // max(size // 20, 1)
+        time = "%02d:%02d" % (minutes // 60 % 24, minutes % 60)
+        delay = minutes + generator.choice([0, 0, 0, 1, 2, 5])
+        departure_type = generator.choice(_types)
+        attributes = [('name', "%s %d" % (departure_type, generator.randint(1, 999))),
+                      ('type', departure_type),
+                      ('stop', 'København H'),
+                      ('time', time),
+                      ('date', '07.07.15')]
+        if delay != minutes:
+            attributes += [('rtTime', "%02d:%02d" % (delay // 60 % 24, delay % 60)), ('rtDate', '07.07.15')]
+        attributes += [('messages', '0'), ('track', str(generator.randint(1, 12)))]
+        if generator.random() < cancelled_ratio:
+            attributes.append(('cancelled', 'true'))
+        attributes += [('finalStop', generator.choice(_directions)), ('direction', generator.choice(_directions))]
+        lines.append('<Departure %s>' % ' '.join('%s=%s' % (key, quoteattr(value)) for (key, value) in attributes))
+        lines.append('<JourneyDetailRef ref="http://xmlopen.rejseplanen.dk/bin/rest.exe/journeyDetail?ref=%d" />'
+                     % generator.randint(100000, 999999))
+        lines.append('</Departure>')
+    lines.append('</DepartureBoard>')
+    return bytes('\n'.join(lines), 'UTF-8')
+
+
+_streets = ['Vestergade', 'Østergade', 'Nørregade', 'Søndergade', 'Skolevej', 'Kirkevej', 'Stationsvej', 'Møllevej',
+            'Industrivej', 'Bygaden', 'Hovedgaden', 'Skovvej', 'Strandvejen', 'Parkvej', 'Engvej']
+_towns = ['Aarhus', 'Odense', 'Aalborg', 'Esbjerg', 'Randers', 'Kolding', 'Horsens', 'Vejle', 'Roskilde', 'Herning',
+          'Silkeborg', 'Næstved', 'Fredericia', 'Viborg', 'Køge', 'Holstebro', 'Taastrup', 'Slagelse', 'Hillerød']
+
+
+def stop_locations(count: int, seed: int=0) -> bytes:
+    """
+    Generates a LocationList of StopLocations spread over Denmark, in the format of Rejseplanen
+    :param count: The number of stops
+    :param seed: The seed of the random generator
+    :return: The UTF-8 encoded XML
+    """
+    generator = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<LocationList>']
+    for i in range(count):
+        name = "%s %d (%s Kommune)" % (generator.choice(_streets), generator.randint(1, 200), generator.choice(_towns))
+        lines.append('<StopLocation name=%s x="%d" y="%d" id="%d" />'
+                     % (quoteattr(name), generator.randint(8000000, 12700000), generator.randint(54600000, 57700000),
+                        i + 1))
+    lines.append('</LocationList>')
+    return bytes('\n'.join(lines), 'UTF-8')
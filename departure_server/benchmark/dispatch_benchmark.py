@@ -0,0 +1,69 @@
+import timeit
+
+from departure_server.rest import Handler, NoSuchFunctionException
+
+__author__ = 'budde'
+
+
+class LegacyHandler:
+    """
+    The recursive dispatch of handlers before the compiled route table, kept for comparison
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.functions = {}
+        self.handlers = {}
+
+    def add_function(self, name: str, function):
+        self.functions[name] = function
+
+    def add_handler(self, name: str):
+        if name in self.handlers:
+            return self.handlers[name]
+        self.handlers[name] = handler = LegacyHandler(name)
+        self.add_function(name, lambda nme, inp: LegacyHandler._recursive_handle(handler, nme, inp))
+        return handler
+
+    @staticmethod
+    def _recursive_handle(handler, name: list, inp: dict):
+        handler.name = name[0]
+        return handler.handle(name[1:], inp)
+
+    def handle(self, name: list, handler_input: dict=None):
+        if len(name) == 0:
+            raise NoSuchFunctionException("")
+        handler_input = {} if handler_input is None else handler_input
+        function_name = name[0] if name[0] in self.functions else "*"
+        if function_name not in self.functions:
+            raise NoSuchFunctionException(name[0])
+        return (self.functions[function_name])(name, handler_input)
+
+
+def setup(handler):
+    """
+    Adds the routes of v1.0 of the API, as RESTHandler does, with functions doing nothing
+    """
+    stations = handler.add_handler('1.0').add_handler('Stations')
+    stations.add_function('findNearby', lambda name, inp: None)
+    departures = stations.add_handler('departures')
+    station = departures.add_handler('*')
+    station.add_function('', lambda name, inp: None)
+    station.add_function('live', lambda name, inp: None)
+    departures.add_function('', lambda name, inp: None)
+    return handler
+
+
+def main():
+    paths = [['1.0', 'Stations', 'findNearby'], ['1.0', 'Stations', 'departures', '8600626', ''],
+             ['1.0', 'Stations', 'departures', '8600626', 'live'], ['1.0', 'Stations', 'departures', '']]
+    handlers = [('recursive', setup(LegacyHandler())), ('compiled', setup(Handler()))]
+    print("%-40s %10s %12s" % ('path', 'dispatch', 'ns/call'))
+    for path in paths:
+        for (label, handler) in handlers:
+            number = 100000
+            seconds = min(timeit.repeat(lambda: handler.handle(path, {}), number=number, repeat=15))
+            print("%-40s %10s %12.1f" % ('/'.join(path), label, seconds / number * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import http.client
+import http.server
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+from xml.etree import ElementTree
+
+from departure_server.async_server import AsyncServer
+from departure_server.benchmark.data import departure_board, stop_locations
+from departure_server.http_cache import ResponseCache
+from departure_server.query_strategy import QueryStrategy, DelegatingQueryStrategy, StubQueryStrategy
+from departure_server.recording import ReplayQueryStrategy, read_archive
+from departure_server.rest import RESTHandler
+from departure_server.station import StationLibrary
+import departure_server.request_handler
+
+__author__ = 'budde'
+
+_static_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'www')
+
+
+class LatencyQueryStrategy(DelegatingQueryStrategy):
+    """
+    Delays every query by an artificial upstream latency
+    """
+    def __init__(self, strategy: QueryStrategy, latency: float):
+        super().__init__(strategy)
+        self.latency = latency
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        time.sleep(self.latency)
+        return super().find_nearby(x, y, max_radius, max_number)
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        time.sleep(self.latency)
+        return super().departure_time(stop_id, use_bus, use_tog, use_metro)
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    :param values: A sorted list of values
+    :param p: The percentile, between 0 and 100
+    :return: The nearest-rank percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, math.ceil(p * len(values) / 100) - 1))]
+
+
+def rss() -> dict:
+    """
+    :return: The current and peak resident set size of this process in bytes
+    """
+    result = {'rss': None, 'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    result['rss'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    result['peak_rss'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return result
+
+
+def serve(arguments: argparse.Namespace, connection):
+    """
+    Runs the server against the stub upstream. The port is sent on the connection and, when anything is received,
+    the memory usage is sent back.
+    """
+    if arguments.replay is not None:
+        strategy = ReplayQueryStrategy(arguments.replay, arguments.replay_speed)
+    else:
+        strategy = LatencyQueryStrategy(
+            StubQueryStrategy(ElementTree.fromstring(stop_locations(arguments.nearby_size)),
+                              ElementTree.fromstring(departure_board(arguments.board_size))),
+            arguments.latency)
+    library = StationLibrary(strategy)
+    response_cache = ResponseCache() if arguments.response_cache else ResponseCache(max_ages={})
+
+    def report_memory(port: int):
+        connection.send(port)
+        connection.recv()
+        connection.send(rss())
+
+    if arguments.mode == 'async':
+        server = AsyncServer(RESTHandler(strategy, library), _static_directory, response_cache=response_cache)
+
+        async def run():
+            listener = await server.start('localhost', 0)
+            port = listener.sockets[0].getsockname()[1]
+            threading.Thread(target=report_memory, args=(port,), daemon=True).start()
+            async with listener:
+                await listener.serve_forever()
+
+        asyncio.run(run())
+    else:
+        os.chdir(_static_directory)
+        handler = departure_server.request_handler.setup_handler(strategy, library)
+        handler.__RESPONSE_CACHE__ = response_cache
+        handler.log_message = lambda *args: None
+        server_class = departure_server.request_handler.ThreadedHTTPServer if arguments.mode == 'threaded' \
+            else http.server.HTTPServer
+        server = server_class(('localhost', 0), handler)
+        threading.Thread(target=report_memory, args=(server.server_address[1],), daemon=True).start()
+        server.serve_forever()
+
+
+def request_target(kind: str, generator: random.Random, arguments: argparse.Namespace) -> str:
+    if kind == 'findNearby':
+        return '/api/1.0/Stations/findNearby?lat=%d&long=%d&radius=%d' % (
+            generator.randint(54500000, 57700000), generator.randint(8000000, 12700000), arguments.radius)
+    if kind == 'departures':
+        return '/api/1.0/Stations/departures/%d/' % generator.randint(1, arguments.stations)
+    return '/index.html'
+
+
+def replay_targets(path: str) -> list:
+    """
+    Recreates the API requests which caused the upstream requests of a recorded archive. Upstream requests of later
+    boards, made when paging, are left out.
+    :param path: The path of the archive
+    :return: A list of (kind, target) tuples in the order of the recording
+    """
+    targets = []
+    for (_, _, address, _) in sorted(read_archive(path), key=lambda record: record[0]):
+        parts = urlsplit(address)
+        query = {key: values[0] for (key, values) in parse_qs(parts.query).items()}
+        if parts.path == 'stopsNearby':
+            targets.append(('findNearby', '/api/1.0/Stations/findNearby?lat=%s&long=%s&radius=%s' % (
+                query['coordX'], query['coordY'], query['maxRadius'])))
+        elif parts.path == 'departureBoard' and 'date' not in query:
+            targets.append(('departures', '/api/1.0/Stations/departures/%s/' % query['id']))
+    return targets
+
+
+def drive(port: int, arguments: argparse.Namespace, seed: int, deadline: float, results: list, targets: list=None):
+    """
+    Sends requests on one keep-alive connection until the deadline, recording (kind, latency, status) tuples
+    :param targets: A list of (kind, target) tuples requested in turn, starting at the seed, instead of random requests
+    """
+    generator = random.Random(seed)
+    kinds = ['findNearby', 'departures', 'static']
+    weights = [arguments.nearby_weight, arguments.departures_weight, arguments.static_weight]
+    connection = http.client.HTTPConnection('localhost', port, timeout=30)
+    position = seed
+    while time.perf_counter() < deadline:
+        if targets:
+            (kind, target) = targets[position % len(targets)]
+            position += arguments.concurrency
+        else:
+            kind = generator.choices(kinds, weights)[0]
+            target = request_target(kind, generator, arguments)
+        started_at = time.perf_counter()
+        try:
+            connection.request('GET', target)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            status = None
+        results.append((kind, time.perf_counter() - started_at, status))
+    connection.close()
+
+
+def load(port: int, arguments: argparse.Namespace, seconds: float, seed: int, targets: list=None) -> tuple:
+    """
+    Drives the load from concurrent clients
+    :param seed: The seed of the requests of the first client, later clients use the following seeds
+    :param targets: The requests of the clients, see drive
+    :return: A tuple with the results of all clients and the seconds elapsed
+    """
+    results = [[] for _ in range(arguments.concurrency)]
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=drive,
+                                args=(port, arguments, seed + i, started_at + seconds, results[i], targets))
+               for i in range(arguments.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [result for client_results in results for result in client_results], time.perf_counter() - started_at
+
+
+def summarize(results: list, seconds: float) -> dict:
+    latencies = sorted(latency for (_, latency, _) in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for (_, _, status) in results if status is None or status >= 400),
+        'rps': len(results) / seconds,
+        'p50_ms': _milliseconds(percentile(latencies, 50)),
+        'p95_ms': _milliseconds(percentile(latencies, 95)),
+        'p99_ms': _milliseconds(percentile(latencies, 99)),
+        'max_ms': _milliseconds(latencies[-1] if latencies else None)
+    }
+
+
+def _milliseconds(seconds: float) -> float:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run(arguments: argparse.Namespace) -> dict:
+    """
+    Starts the server in a child process, drives the load for the duration, and measures the server
+    :return: The report
+    """
+    targets = replay_targets(arguments.replay) if arguments.replay is not None else None
+    (parent, child) = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(arguments, child), daemon=True)
+    server.start()
+    try:
+        port = parent.recv()
+        load(port, arguments, arguments.warmup, -arguments.concurrency, targets)
+        (results, seconds) = load(port, arguments, arguments.duration, 0, targets)
+        parent.send(None)
+        memory = parent.recv()
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'config': {key: value for (key, value) in vars(arguments).items() if key != 'output'},
+        'seconds': round(seconds, 3),
+        'total': summarize(results, seconds),
+        'by_kind': {kind: summarize([r for r in results if r[0] == kind], seconds)
+                    for kind in ('findNearby', 'departures', 'static')},
+        'server_memory': memory
+    }
+
+
+def parse_arguments(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='departure_server.benchmark.load_test',
+                                     description='Load tests the server against a stub upstream')
+    parser.add_argument('--mode', choices=['async', 'threaded', 'sync'], default='async')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=1, help='Seconds of load before measuring')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of artificial upstream latency')
+    parser.add_argument('--board-size', type=int, default=20, help='Departures of every departure board')
+    parser.add_argument('--nearby-size', type=int, default=50, help='Stops of every findNearby response')
+    parser.add_argument('--stations', type=int, default=1000, help='Number of distinct station ids requested')
+    parser.add_argument('--radius', type=int, default=1000, help='Radius of findNearby requests')
+    parser.add_argument('--nearby-weight', type=float, default=1)
+    parser.add_argument('--departures-weight', type=float, default=3)
+    parser.add_argument('--static-weight', type=float, default=1)
+    parser.add_argument('--replay', metavar='ARCHIVE',
+                        help='Replay the upstream responses of an archive recorded by the server with --record, '
+                             'and request what caused them in the recorded order')
+    parser.add_argument('--replay-speed', type=float, default=1,
+                        help='How many times faster than recorded the upstream is replayed')
+    parser.add_argument('--no-response-cache', dest='response_cache', action='store_false',
+                        help='Disable the cache of API responses')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of standard output')
+    return parser.parse_args(args)
+
+
+def main():
+    arguments = parse_arguments()
+    report = run(arguments)
+    if arguments.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
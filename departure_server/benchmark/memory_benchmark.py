@@ -0,0 +1,83 @@
+import gc
+import sys
+import tracemalloc
+from xml.etree import ElementTree
+
+from departure_server.benchmark.data import stop_locations, departure_board
+from departure_server.departure_parser import parse_datetime
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.station import StationLibrary, Station, Position, Departure
+
+__author__ = 'budde'
+
+
+class LegacyPosition:
+    def __init__(self, lat: int, long: int):
+        self.lat = lat
+        self.long = long
+
+
+class LegacyStation:
+    def __init__(self, library, station_id: int, name: str, pos):
+        self.library = library
+        self.query_strategy = library.query_strategy
+        self.id = station_id
+        self.name = name
+        self.pos = pos
+
+
+class LegacyDeparture:
+    def __init__(self, station, name: str, departure_type: str, date, direction: str=""):
+        self.station = station
+        self.name = name
+        self.departure_type = departure_type
+        self.date = date
+        self.direction = direction
+
+
+def stations(station_class, position_class, library, element: ElementTree.Element) -> list:
+    return [station_class(library, int(e.attrib['id']), e.attrib['name'],
+                          position_class(int(e.attrib['y']), int(e.attrib['x'])))
+            for e in element]
+
+
+def departures(departure_class, station, boards: list) -> list:
+    return [departure_class(station, e.attrib['name'], e.attrib['type'],
+                            parse_datetime(e.attrib['date'], e.attrib['time']), e.attrib.get('direction', ''))
+            for board in boards for e in board]
+
+
+def allocated(function) -> (object, int):
+    """
+    :return: The result of the function and the number of bytes it retains
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    (size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main(stop_count: int, board_count: int):
+    library = StationLibrary(StubQueryStrategy())
+    # Every board is parsed separately, as when fetched upstream, so repeated strings are distinct objects
+    stop_data = stop_locations(stop_count)
+    boards = [ElementTree.fromstring(departure_board(20, seed)) for seed in range(board_count)]
+    station = library.station_from_id(8600626)
+    print("%12s %10s %14s %12s" % ('model', 'objects', 'MiB', 'bytes/obj'))
+    for (label, station_class, position_class, departure_class) in [
+            ('legacy', LegacyStation, LegacyPosition, LegacyDeparture), ('compact', Station, Position, Departure)]:
+        (result, size) = allocated(lambda: stations(station_class, position_class, library,
+                                                    ElementTree.fromstring(stop_data)))
+        print("%12s %10d %14.2f %12.1f" % (label + ' stops', len(result), size / 2 ** 20, size / len(result)))
+        del result
+        parse_datetime.cache_clear()
+        (result, size) = allocated(lambda: departures(departure_class, station, boards))
+        print("%12s %10d %14.2f %12.1f" % (label + ' deps', len(result), size / 2 ** 20, size / len(result)))
+        del result
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
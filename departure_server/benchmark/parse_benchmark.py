@@ -0,0 +1,67 @@
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+from xml.etree import ElementTree
+
+from departure_server.benchmark.data import departure_board
+from departure_server.departure_parser import departures_from_element, parse_datetime
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.station import StationLibrary, Departure
+
+__author__ = 'budde'
+
+
+def legacy_departures(station, data: bytes) -> list:
+    """
+    The parsing of departure boards before the element path, kept for comparison
+    """
+    def departure_from_xml(element):
+        if 'cancelled' in element.attrib and element.attrib['cancelled'] != 'false':
+            return None
+
+        (hour, minute) = element.attrib['rtTime' if 'rtTime' in element.attrib else 'time'].split(':')
+        (d, m, y) = element.attrib['rtDate' if 'rtDate' in element.attrib else 'date'].split('.')
+        direction = element.attrib['direction'] if 'direction' in element.attrib else ''
+
+        return Departure(station, element.attrib['name'], element.attrib['type'],
+                         datetime(int(y) + 2000, int(m), int(d), int(hour), int(minute)), direction)
+
+    element = ElementTree.fromstring(data)
+    return list(sorted(filter(lambda v: v is not None, map(departure_from_xml, list(element))), key=lambda d: d.date))
+
+
+def element_departures(station, data: bytes) -> list:
+    departures = departures_from_element(station, ElementTree.fromstring(data))
+    departures.sort(key=lambda d: d.date)
+    return departures
+
+
+def measure(function, station, data: bytes, number: int) -> (float, int):
+    """
+    :return: The best time per board in seconds and the peak memory allocated while parsing a board in bytes
+    """
+    parse_datetime.cache_clear()
+    seconds = min(timeit.repeat(lambda: function(station, data), number=number, repeat=5)) / number
+    tracemalloc.start()
+    function(station, data)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(sizes: list):
+    station = StationLibrary(StubQueryStrategy()).station_from_id(8600626)
+    paths = [('legacy', legacy_departures), ('element', element_departures)]
+    print("%8s %10s %14s %14s" % ('size', 'path', 'us/board', 'peak KiB'))
+    for size in sizes:
+        data = departure_board(size)
+        assert legacy_departures(station, data) == element_departures(station, data)
+        number = max(10000 // size, 5)
+        for (name, function) in paths:
+            (seconds, peak) = measure(function, station, data, number)
+            print("%8d %10s %14.1f %14.1f" % (size, name, seconds * 1000000, peak / 1024))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [20, 200, 2000])
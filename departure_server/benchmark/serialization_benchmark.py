@@ -0,0 +1,75 @@
+import http.client
+import json
+import sys
+import threading
+import time
+import timeit
+from xml.etree import ElementTree
+
+from departure_server.benchmark.data import stop_locations
+from departure_server.http_cache import ResponseCache
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.request_handler import setup_handler, ThreadedHTTPServer
+from departure_server.serialization import ModelEncoder, encode_result
+from departure_server.station import StationLibrary, Position
+
+__author__ = 'budde'
+
+
+def legacy_encode_result(result) -> bytes:
+    return bytes(json.dumps(result, cls=ModelEncoder), 'UTF-8')
+
+
+def requests_per_second(handler_class, path: str, count: int) -> float:
+    """
+    Serves the handler on a local port and measures sequential requests per second
+    """
+    server = ThreadedHTTPServer(('localhost', 0), handler_class)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            connection = http.client.HTTPConnection('localhost', server.server_address[1])
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+        return count / (time.perf_counter() - start)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(count: int):
+    query_strategy = StubQueryStrategy(nearby=ElementTree.fromstring(stop_locations(50)))
+    handler = setup_handler(query_strategy)
+    # Nothing is stored, so every request of both handlers encodes its response
+    handler.__RESPONSE_CACHE__ = ResponseCache(max_ages={})
+
+    class LegacyHandler(handler):
+        def send_result(self, result):
+            formatted_result = json.dumps(result, cls=ModelEncoder)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(bytes(formatted_result, 'UTF-8'))
+
+    class QuietHandler(handler):
+        def log_message(self, *args):
+            pass
+
+    class QuietLegacyHandler(LegacyHandler):
+        def log_message(self, *args):
+            pass
+
+    stations = StationLibrary(query_strategy).find_nearby(Position(0, 0))
+    assert legacy_encode_result(stations) == encode_result(stations)
+    path = '/api/1.0/Stations/findNearby?lat=0&long=0&radius=100'
+    print("%10s %14s %14s" % ('encoder', 'us/encode', 'requests/s'))
+    for (name, encode, handler_class) in [('legacy', legacy_encode_result, QuietLegacyHandler),
+                                          ('fast', encode_result, QuietHandler)]:
+        seconds = min(timeit.repeat(lambda: encode(stations), number=1000, repeat=5)) / 1000
+        print("%10s %14.1f %14.1f" % (name, seconds * 1000000, requests_per_second(handler_class, path, count)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,105 @@
+import random
+import sys
+import time
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import QueryStrategy
+from departure_server.spatial import SpatialIndex, distance, meters_to_micro_degrees
+from departure_server.station import StationLibrary, Position
+from departure_server.tiles import TileCache
+
+__author__ = 'budde'
+
+
+class NearbyQueryStrategy(QueryStrategy):
+    """
+    Answers find_nearby from a list of stops, as the upstream would, and counts the calls
+    """
+    def __init__(self, stops: list):
+        """
+        :param stops: A list of (id, name, latitude, longitude) tuples
+        """
+        self.stops = stops
+        self.calls = 0
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        self.calls += 1
+        found = sorted((distance(x, y, lat, long), stop_id, name, lat, long)
+                       for (stop_id, name, lat, long) in self.stops)
+        element = ElementTree.Element('LocationList')
+        for (d, stop_id, name, lat, long) in found[:max_number]:
+            if d > max_radius:
+                break
+            ElementTree.SubElement(element, 'StopLocation', name=name, x=str(long), y=str(lat), id=str(stop_id))
+        return element
+
+
+def clustered_stops(towns: int, per_town: int, spread: float, seed: int=0) -> list:
+    """
+    Generates stops in towns spread over Denmark
+    :param spread: The standard deviation in meters of the distance of stops from the center of their town
+    :return: A list of (id, name, latitude, longitude) tuples
+    """
+    generator = random.Random(seed)
+    stops = []
+    for town in range(towns):
+        (lat, long) = (generator.randint(54600000, 57700000), generator.randint(8000000, 12700000))
+        (lat_delta, long_delta) = meters_to_micro_degrees(spread, lat)
+        for i in range(per_town):
+            stops.append((len(stops) + 1, 'Stop %d in town %d' % (i, town),
+                          int(generator.gauss(lat, lat_delta)), int(generator.gauss(long, long_delta))))
+    return stops
+
+
+def trace(stops: list, count: int, spread: float, radii: list, seed: int=0) -> list:
+    """
+    Generates queries of users standing near stops
+    :param spread: The standard deviation in meters of the distance of users from the stop
+    :return: A list of (position, radius) tuples
+    """
+    generator = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        (_, _, lat, long) = generator.choice(stops)
+        (lat_delta, long_delta) = meters_to_micro_degrees(spread, lat)
+        queries.append((Position(int(generator.gauss(lat, lat_delta)), int(generator.gauss(long, long_delta))),
+                        generator.choice(radii)))
+    return queries
+
+
+def run(library: StationLibrary, queries: list) -> (list, int, float):
+    """
+    :return: A tuple with the ids of the stations found by each query, the number of queries answered without an
+             upstream call, and the seconds elapsed
+    """
+    upstream = library.query_strategy
+    results = []
+    hits = 0
+    started_at = time.perf_counter()
+    for (position, radius) in queries:
+        calls = upstream.calls
+        results.append([station.id for station in library.find_nearby(position, radius)])
+        hits += upstream.calls == calls
+    return results, hits, time.perf_counter() - started_at
+
+
+def main(query_count: int):
+    stops = clustered_stops(20, 200, 1500)
+    queries = trace(stops, query_count, 100, [200, 500, 1000])
+    configurations = [('exact', lambda: {}),
+                      ('index', lambda: {'index': SpatialIndex()}),
+                      ('tiles', lambda: {'tiles': TileCache()}),
+                      ('index+tiles', lambda: {'index': SpatialIndex(), 'tiles': TileCache()})]
+    expected = None
+    print("%12s %10s %10s %10s %10s %12s" % ('library', 'queries', 'upstream', 'hit rate', 'mismatch', 'ms/query'))
+    for (label, options) in configurations:
+        upstream = NearbyQueryStrategy(stops)
+        (results, hits, seconds) = run(StationLibrary(upstream, **options()), queries)
+        expected = results if expected is None else expected
+        mismatches = sum(1 for (result, exact) in zip(results, expected) if result != exact)
+        print("%12s %10d %10d %10.3f %10d %12.3f" % (label, len(queries), upstream.calls, hits / len(queries),
+                                                     mismatches, seconds / len(queries) * 1000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import QueryStrategy, DelegatingQueryStrategy
+from departure_server.resilience import degraded
+
+__author__ = 'budde'
+
+
+def _run_in_thread(function):
+    threading.Thread(target=function, daemon=True).start()
+
+
+class _CacheEntry:
+    def __init__(self, value: ElementTree.Element, fetched_at: float, prefetched: bool=False):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.refreshing = False
+        self.prefetched = prefetched
+        self.used = False
+
+
+class CachingQueryStrategy(DelegatingQueryStrategy):
+    """
+    Caches departure boards of a wrapped strategy.
+    Entries younger than the TTL are served directly. Entries which are older, but still within the
+    stale period, are served while a single background refresh fetches a new board.
+    The cache is a bounded LRU, i.e. the least recently used board is dropped when the cache is full.
+    Degraded boards are served, but never cached.
+    """
+    def __init__(self, strategy: QueryStrategy, ttl: float=30, stale_ttl: float=120, max_size: int=1024,
+                 clock=time.monotonic, run_in_background=_run_in_thread):
+        """
+        :param strategy: The strategy to cache
+        :param ttl: Seconds a board is considered fresh
+        :param stale_ttl: Seconds after the TTL a stale board may be served while refreshing
+        :param max_size: The maximum number of boards kept
+        :param clock: A function returning the current (monotonic) time in seconds
+        :param run_in_background: A function taking a function which should be run in the background
+        """
+        super().__init__(strategy)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.run_in_background = run_in_background
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.prefetches_used = 0
+        self.prefetches_wasted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        key = (stop_id, bool(use_bus), bool(use_tog), bool(use_metro))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = self.clock() - entry.fetched_at
+                if age <= self.ttl:
+                    self.hits += 1
+                    self._use(entry)
+                    return entry.value
+                if age <= self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._use(entry)
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        self.run_in_background(lambda: self._refresh(key))
+                    return entry.value
+            self.misses += 1
+        return self._fetch(key)
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary of the counters of the cache
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'evictions': self.evictions,
+                'prefetches': self.prefetches,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetches_used': self.prefetches_used,
+                'prefetches_wasted': self.prefetches_wasted,
+                'size': len(self._entries)
+            }
+
+    def age(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True):
+        """
+        :return: The seconds since the board was fetched or None if it isn't cached
+        """
+        with self._lock:
+            entry = self._entries.get((stop_id, bool(use_bus), bool(use_tog), bool(use_metro)))
+            return None if entry is None else self.clock() - entry.fetched_at
+
+    def prefetch(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True):
+        """
+        Fetches a board ahead of requests. Requests served by the board are counted as prefetch hits.
+        Degraded boards aren't stored.
+        """
+        key = (stop_id, bool(use_bus), bool(use_tog), bool(use_metro))
+        if not self._store(key, self.strategy.departure_time(*key), prefetched=True):
+            return
+        with self._lock:
+            self.prefetches += 1
+
+    def _fetch(self, key: tuple) -> ElementTree.Element:
+        value = self.strategy.departure_time(*key)
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key: tuple):
+        try:
+            refreshed = not degraded(self._fetch(key))
+        except Exception:
+            refreshed = False
+        with self._lock:
+            if refreshed:
+                self.refreshes += 1
+                return
+            self.refresh_errors += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    def _use(self, entry: _CacheEntry):
+        if entry.prefetched:
+            self.prefetch_hits += 1
+            if not entry.used:
+                self.prefetches_used += 1
+        entry.used = True
+
+    def _store(self, key: tuple, value: ElementTree.Element, prefetched: bool=False) -> bool:
+        """
+        Stores a board unless it is degraded, which is served but never cached
+        :return: True if the board was stored
+        """
+        if degraded(value):
+            return False
+        with self._lock:
+            self._discard(self._entries.get(key))
+            self._entries[key] = _CacheEntry(value, self.clock(), prefetched)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._discard(self._entries.popitem(last=False)[1])
+                self.evictions += 1
+        return True
+
+    def _discard(self, entry: _CacheEntry):
+        if entry is not None and entry.prefetched and not entry.used:
+            self.prefetches_wasted += 1
@@ -0,0 +1,99 @@
+import gzip
+import http.client
+import queue
+import threading
+from urllib.parse import urlsplit
+
+__author__ = 'budde'
+
+
+class UpstreamError(Exception):
+    def __init__(self, status: int, reason: str=''):
+        super().__init__("Upstream responded %d %s" % (status, reason))
+        self.status = status
+
+
+class ConnectionPool:
+    """
+    A pool of persistent HTTP connections to a single host.
+    At most `size` requests are in flight at once, each on its own keep-alive connection, and idle connections are
+    reused by later requests. Responses may be gzip encoded.
+    """
+    def __init__(self, base_url: str, size: int=8, timeout: float=10):
+        """
+        :param base_url: The base URL of all requests, e.g. http://xmlopen.rejseplanen.dk/bin/rest.exe
+        :param size: The maximum number of connections
+        :param timeout: Seconds before a request, or waiting for a free connection, times out
+        """
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+        self.connections_opened = 0
+        self.requests = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def get(self, address: str) -> bytes:
+        """
+        Requests an address relative to the base URL
+        :param address: The address, e.g. departureBoard?id=1
+        :return: The (decompressed) body of the response
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("No free connection to %s within %s seconds" % (self.host, self.timeout))
+        try:
+            connection = self._idle_connection()
+            if connection is not None:
+                try:
+                    return self._request(connection, address)
+                except (http.client.HTTPException, ConnectionError):
+                    # The upstream may have closed the idle connection, retry on a new one
+                    connection.close()
+            return self._request(self._new_connection(), address)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        connection = self._idle_connection()
+        while connection is not None:
+            connection.close()
+            connection = self._idle_connection()
+
+    def _request(self, connection: http.client.HTTPConnection, address: str) -> bytes:
+        try:
+            connection.request('GET', "%s/%s" % (self.path, address), headers={'Accept-Encoding': 'gzip'})
+            response = connection.getresponse()
+            body = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        with self._lock:
+            self.requests += 1
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        if response.status != 200:
+            raise UpstreamError(response.status, response.reason)
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _idle_connection(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        with self._lock:
+            self.connections_opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
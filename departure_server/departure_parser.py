@@ -0,0 +1,49 @@
+from datetime import datetime
+from functools import lru_cache
+from xml.etree import ElementTree
+
+__author__ = 'budde'
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(date: str, time: str) -> datetime:
+    """
+    Parses the date and time format of Rejseplanen. Boards share few distinct dates and times,
+    so parsed values are cached.
+    :param date: A date on the form dd.mm.yy
+    :param time: A time on the form hh:mm
+    :return: The datetime
+    """
+    return datetime(2000 + int(date[6:8]), int(date[3:5]), int(date[0:2]), int(time[0:2]), int(time[3:5]))
+
+
+def _departure(departure_class, station, attributes: dict):
+    """
+    Creates a departure from the attributes of a Departure element
+    :return: A departure or None if it is cancelled
+    """
+    get = attributes.get
+    cancelled = get('cancelled')
+    if cancelled is not None and cancelled != 'false':
+        return None
+    return departure_class(station, attributes['name'], attributes['type'],
+                           parse_datetime(get('rtDate') or attributes['date'], get('rtTime') or attributes['time']),
+                           get('direction', ''))
+
+
+def departures_from_element(station, element: ElementTree.Element) -> list:
+    """
+    Creates the departures of a parsed DepartureBoard
+    :type station: departure_server.station.Station
+    :param element: The DepartureBoard element
+    :return: A list of departures, cancelled departures excluded, in board order
+    :rtype: list[departure_server.station.Departure]
+    """
+    from departure_server.station import Departure
+    departures = []
+    for child in element:
+        departure = _departure(Departure, station, child.attrib)
+        if departure is not None:
+            departures.append(departure)
+    return departures
+
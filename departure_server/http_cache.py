@@ -0,0 +1,125 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+__author__ = 'budde'
+
+# Seconds API responses are fresh, by the name of their function
+API_MAX_AGES = {'departures': 15, 'findNearby': 300}
+
+# Seconds static files are fresh
+STATIC_MAX_AGE = 86400
+
+
+def etag(body: bytes) -> str:
+    """
+    Computes a strong entity tag of a body
+    :param body: The body
+    :return: The quoted entity tag
+    """
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """
+    Decides whether an If-None-Match header matches an entity tag
+    :param if_none_match: The value of the header or None
+    :param tag: The quoted entity tag
+    :return: True if the tag matches
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(candidate.strip().replace('W/', '', 1) == tag for candidate in if_none_match.split(','))
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, max_age: int, created_at: float):
+        self.body = body
+        self.etag = etag(body)
+        self.max_age = max_age
+        self.created_at = created_at
+
+    def headers(self, now: float) -> list:
+        """
+        :param now: The current time
+        :return: The Cache-Control and ETag headers of the response, the max-age being the remaining freshness
+        """
+        remaining = math.ceil(self.max_age - (now - self.created_at))
+        cache_control = 'max-age=%d' % remaining if remaining > 0 else 'no-cache'
+        return [('Cache-Control', cache_control), ('ETag', self.etag)]
+
+    def matches(self, if_none_match: str) -> bool:
+        return etag_matches(if_none_match, self.etag)
+
+
+class ResponseCache:
+    """
+    Remembers the encoded API responses for as long as they are fresh.
+    Fresh responses are served without calling the API or encoding the result again, and conditional requests
+    matching their ETag are answered with 304.
+    """
+    def __init__(self, max_ages: dict=None, max_size: int=4096, clock=time.monotonic):
+        """
+        :param max_ages: Seconds responses are fresh, by the name of their function. Defaults to API_MAX_AGES
+        :param max_size: The maximum number of responses kept
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        self.max_ages = max_ages if max_ages is not None else API_MAX_AGES
+        self.max_size = max_size
+        self.clock = clock
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def max_age(self, target: str) -> int:
+        """
+        Decides the max-age of a response from the last function name of the target with a configured max-age
+        :param target: The request target
+        :return: The max-age in seconds
+        """
+        for name in reversed(urlparse(target).path.split('/')):
+            if name in self.max_ages:
+                return self.max_ages[name]
+        return 0
+
+    def lookup(self, target: str):
+        """
+        :param target: The request target
+        :return: The fresh response of the target or None
+        :rtype: CachedResponse
+        """
+        with self._lock:
+            response = self._responses.get(target)
+            if response is None:
+                return None
+            if self.clock() - response.created_at >= response.max_age:
+                del self._responses[target]
+                return None
+            self._responses.move_to_end(target)
+            return response
+
+    def store(self, target: str, body: bytes, degraded: bool=False) -> CachedResponse:
+        """
+        Stores the response of a target, if it may be cached
+        :param target: The request target
+        :param body: The encoded response
+        :param degraded: Whether the response stands in for results the upstream failed to deliver. Such responses
+                         are never stored and are sent with no-cache
+        :return: The response
+        """
+        response = CachedResponse(body, 0 if degraded else self.max_age(target), self.clock())
+        if response.max_age <= 0:
+            return response
+        with self._lock:
+            self._responses[target] = response
+            self._responses.move_to_end(target)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+        return response
+
+    def headers(self, response: CachedResponse) -> list:
+        return response.headers(self.clock())
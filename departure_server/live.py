@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from departure_server.departure_parser import parse_datetime
+from departure_server.resilience import degraded
+from departure_server.serialization import encode_result
+from departure_server.station import StationLibrary, Station, Departure
+
+__author__ = 'budde'
+
+
+def board_from_element(station: Station, element: ElementTree.Element) -> OrderedDict:
+    """
+    Keys the departures of a DepartureBoard by their scheduled name, type, direction, date, and time,
+    which stays the same when the real-time date and time change. Repeated keys are numbered by occurrence.
+    :param station: The station of the board
+    :param element: The DepartureBoard element
+    :return: An ordered dictionary of (departure, cancelled) tuples
+    """
+    board = OrderedDict()
+    for child in element:
+        attributes = child.attrib
+        get = attributes.get
+        key = (attributes['name'], attributes['type'], get('direction', ''), attributes['date'], attributes['time'], 0)
+        while key in board:
+            key = key[:-1] + (key[-1] + 1,)
+        departure = Departure(station, attributes['name'], attributes['type'],
+                              parse_datetime(get('rtDate') or attributes['date'], get('rtTime') or attributes['time']),
+                              get('direction', ''))
+        board[key] = (departure, get('cancelled', 'false') != 'false')
+    return board
+
+
+def board_diff(previous: OrderedDict, current: OrderedDict) -> dict:
+    """
+    Computes the changes between two boards
+    :return: A dictionary with the lists of new, changed (real-time date), cancelled, and removed departures
+    """
+    diff = {'new': [], 'changed': [], 'cancelled': [], 'removed': []}
+    for (key, (departure, cancelled)) in current.items():
+        (previous_departure, previous_cancelled) = previous.get(key, (None, True))
+        if cancelled:
+            if not previous_cancelled:
+                diff['cancelled'].append(departure)
+        elif previous_departure is None or previous_cancelled:
+            diff['new'].append(departure)
+        elif previous_departure.date != departure.date:
+            diff['changed'].append(departure)
+    for (key, (departure, cancelled)) in previous.items():
+        if not cancelled and key not in current:
+            diff['removed'].append(departure)
+    return diff
+
+
+class _BoardPoller:
+    """
+    Polls the board of a station for as long as it has subscribers and publishes the changes to them
+    """
+    def __init__(self, hub, station_id: int):
+        """
+        :type hub: DepartureHub
+        """
+        self.hub = hub
+        self.station_id = station_id
+        self.subscribers = []
+        self.board = None
+        self.polls = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        station = self.hub.library.station_from_id(self.station_id)
+        while not self.stopped.is_set():
+            try:
+                element = self.hub.library.query_strategy.departure_time(station.id)
+                board = None if degraded(element) else board_from_element(station, element)
+            except Exception:
+                board = None
+            self.polls += 1
+            if board is not None:
+                self.publish(board)
+            self.stopped.wait(self.hub.interval)
+
+    def publish(self, board: OrderedDict):
+        """
+        Publishes the changes of a board. A subscriber whose callback raises is unsubscribed, such that it can't
+        stop the others, or the poller, from receiving later changes.
+        """
+        with self.hub.lock:
+            diff = board_diff(self.board if self.board is not None else OrderedDict(), board)
+            self.board = board
+            if not any(diff.values()):
+                return
+            event = encode_result(diff)
+            failed = []
+            for callback in self.subscribers:
+                try:
+                    callback(event)
+                except Exception:
+                    failed.append(callback)
+            for callback in failed:
+                self.hub._remove(self, callback)
+
+
+class DepartureHub:
+    """
+    Pushes changes of departure boards to subscribers.
+    Each watched station is polled by one thread, regardless of the number of subscribers.
+    """
+    def __init__(self, library: StationLibrary, interval: float=15):
+        """
+        :param library: The library of the stations
+        :param interval: Seconds between polls of a board
+        """
+        self.library = library
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._pollers = {}
+
+    def subscribe(self, station_id: int, callback):
+        """
+        Subscribes to the changes of the departures of a station.
+        The callback is called with the JSON encoded changes, as a dictionary with the lists of new, changed,
+        cancelled, and removed departures. The first call contains all departures as new.
+        The callback is called from the polling thread and shouldn't block.
+        :param station_id: The id of the station
+        :param callback: A function taking the encoded changes as bytes
+        :return: A function cancelling the subscription
+        """
+        with self.lock:
+            poller = self._pollers.get(station_id)
+            if poller is None:
+                self._pollers[station_id] = poller = _BoardPoller(self, station_id)
+                poller.thread.start()
+            poller.subscribers.append(callback)
+            if poller.board is not None:
+                try:
+                    callback(encode_result(board_diff(OrderedDict(), poller.board)))
+                except Exception:
+                    self._remove(poller, callback)
+                    raise
+
+        def unsubscribe():
+            with self.lock:
+                self._remove(poller, callback)
+
+        return unsubscribe
+
+    def _remove(self, poller: _BoardPoller, callback):
+        """
+        Removes a subscriber, and stops the poller when it was the last. The lock must be held.
+        """
+        if callback not in poller.subscribers:
+            return
+        poller.subscribers.remove(callback)
+        if not poller.subscribers:
+            poller.stopped.set()
+            del self._pollers[poller.station_id]
+
+    def watched(self) -> dict:
+        """
+        :return: The number of subscribers by station id
+        """
+        with self.lock:
+            return {station_id: len(poller.subscribers) for (station_id, poller) in self._pollers.items()}
+
+
+class LiveDepartures:
+    """
+    The result of subscribing to the live departures of a station. Servers stream it as server-sent events.
+    """
+    heartbeat_interval = 15
+
+    def __init__(self, hub: DepartureHub, station_id: int):
+        self.hub = hub
+        self.station_id = station_id
+
+    def subscribe(self, callback):
+        """
+        :see: DepartureHub.subscribe
+        """
+        return self.hub.subscribe(self.station_id, callback)
+
+    @staticmethod
+    def event(data: bytes) -> bytes:
+        """
+        :param data: The JSON encoded changes
+        :return: The server-sent event
+        """
+        return b'event: departures\ndata: ' + data + b'\n\n'
+
+    @staticmethod
+    def heartbeat() -> bytes:
+        """
+        :return: A comment keeping the connection open
+        """
+        return b': keep-alive\n\n'
@@ -0,0 +1,211 @@
+import collections
+import sys
+import threading
+import time
+
+__author__ = 'budde'
+
+# Upper bounds in seconds of the buckets of histograms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started_at')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.started_at)
+
+
+class Histogram:
+    """
+    Counts observations in cumulative buckets, and keeps their count and sum
+    """
+    def __init__(self, buckets: tuple=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self) -> _Timer:
+        """
+        :return: A context manager observing the seconds spent within it
+        """
+        return _Timer(self)
+
+    def snapshot(self) -> tuple:
+        """
+        :return: A tuple with the list of (bound, cumulative count) pairs, the count, and the sum
+        """
+        with self._lock:
+            counts = list(self.counts)
+            (count, total) = (self.count, self.sum)
+        cumulative = []
+        running = 0
+        for (bound, bucket_count) in zip(self.buckets, counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        cumulative.append((float('inf'), count))
+        return cumulative, count, total
+
+
+class HistogramFamily:
+    """
+    Histograms of one metric, by the value of a label
+    """
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: str) -> Histogram:
+        """
+        :param value: The value of the label
+        :return: The histogram of the value
+        """
+        histogram = self._histograms.get(value)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(value, Histogram(self.buckets))
+        return histogram
+
+    def expose(self) -> list:
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s histogram' % self.name]
+        for (value, histogram) in sorted(self._histograms.items()):
+            (buckets, count, total) = histogram.snapshot()
+            label = '%s="%s"' % (self.label, _escape(value))
+            for (bound, bucket_count) in buckets:
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, _format_value(bound), bucket_count))
+            lines.append('%s_sum{%s} %s' % (self.name, label, _format_value(total)))
+            lines.append('%s_count{%s} %d' % (self.name, label, count))
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed by the server. Besides histograms, the numeric values of the dictionaries returned by
+    collectors, such as the stats methods of the query strategies, are exposed as gauges.
+    """
+    def __init__(self, prefix: str='departure_server'):
+        self.prefix = prefix
+        self._families = []
+        self._collectors = []
+
+    def histogram(self, name: str, help_text: str, label: str, buckets: tuple=DEFAULT_BUCKETS) -> HistogramFamily:
+        family = HistogramFamily('%s_%s' % (self.prefix, name), help_text, label, buckets)
+        self._families.append(family)
+        return family
+
+    def add_collector(self, name: str, collector):
+        """
+        :param name: The name of the collector, prefixing the names of its gauges
+        :param collector: A function returning a dictionary of values
+        """
+        self._collectors.append((name, collector))
+
+    def expose(self) -> bytes:
+        """
+        :return: The metrics in the text exposition format
+        """
+        lines = []
+        for family in self._families:
+            lines.extend(family.expose())
+        for (name, collector) in self._collectors:
+            for (key, value) in sorted(collector().items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = '%s_%s_%s' % (self.prefix, name, key)
+                lines.append('# TYPE %s gauge' % metric)
+                lines.append('%s %s' % (metric, _format_value(value)))
+        return bytes('\n'.join(lines) + '\n', 'UTF-8')
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('stage_seconds', 'Seconds spent in each stage of handling a request', 'stage')
+
+REQUEST_SECONDS = REGISTRY.histogram('request_seconds', 'Seconds spent handling requests by route', 'route')
+
+
+def stage(name: str) -> Histogram:
+    """
+    :param name: The stage, e.g. upstream, parse, model, or encode
+    :return: The histogram of the stage
+    """
+    return STAGE_SECONDS.labels(name)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads at an interval and counts them.
+    The counts are reported in the collapsed format of flame graph tools.
+    """
+    def __init__(self, interval: float=0.005, max_seconds: float=60):
+        """
+        :param interval: Seconds between samples
+        :param max_seconds: The maximum number of seconds of a profile
+        """
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float) -> bytes:
+        """
+        Samples for a number of seconds. Only one profile runs at a time.
+        :param seconds: The duration, at most max_seconds
+        :return: The collapsed stacks, one "frame;frame;frame count" line per stack, the most frequent first
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(min(seconds, self.max_seconds))
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float) -> bytes:
+        stacks = collections.Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for (thread_id, frame) in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append('%s (%s:%d)' % (code.co_name, code.co_filename.rsplit('/', 1)[-1], code.co_firstlineno))
+                    frame = frame.f_back
+                stacks[';'.join(reversed(names))] += 1
+            time.sleep(self.interval)
+        return bytes(''.join('%s %d\n' % (stack, count) for (stack, count) in stacks.most_common()), 'UTF-8')
@@ -0,0 +1,145 @@
+import math
+import threading
+import time
+from xml.etree import ElementTree
+
+from departure_server.cache import CachingQueryStrategy
+from departure_server.query_strategy import DelegatingQueryStrategy
+from departure_server.rate_limit import TokenBucket
+
+__author__ = 'budde'
+
+
+class PrefetchScheduler(DelegatingQueryStrategy):
+    """
+    Keeps the departure boards of the most requested stations fetched ahead of requests.
+    The request rate of each board is tracked as an exponentially decaying score. On every tick the top boards
+    are refetched when they are older than their interval, the expected seconds between their requests, bounded by
+    the minimum and maximum interval. By default the hottest boards are refreshed four times per TTL, and the
+    coolest just before they would be dropped from the stale period of the cache. Every prefetch spends a token of
+    the upstream budget and prefetches are skipped when the budget is spent. All other boards are fetched lazily by
+    the cache.
+    """
+    def __init__(self, cache: CachingQueryStrategy, top: int=20, budget: TokenBucket=None, half_life: float=300,
+                 min_score: float=2, min_interval: float=None, max_interval: float=None, tick_interval: float=1,
+                 clock=time.monotonic):
+        """
+        :param cache: The cache the boards are prefetched into
+        :param top: The number of boards kept prefetched
+        :param budget: The bucket of upstream calls available to prefetching. Defaults to no limit
+        :param half_life: Seconds before the score of a request is halved
+        :param min_score: The minimum decayed number of requests of a board before it is prefetched
+        :param min_interval: The minimum seconds between prefetches of a board. Defaults to 25% of the cache TTL
+        :param max_interval: The maximum seconds between prefetches of a board. Defaults to the cache TTL plus its
+                             stale period
+        :param tick_interval: Seconds between ticks of the background thread
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        super().__init__(cache)
+        self.cache = cache
+        self.top = top
+        self.budget = budget
+        self.decay = math.log(2) / half_life
+        self.min_score = min_score
+        self.min_interval = min_interval if min_interval is not None else cache.ttl / 4
+        self.max_interval = max_interval if max_interval is not None else cache.ttl + cache.stale_ttl
+        self.tick_interval = tick_interval
+        self.clock = clock
+        self.requests = 0
+        self.prefetch_errors = 0
+        self.budget_skipped = 0
+        self._scores = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        key = (stop_id, bool(use_bus), bool(use_tog), bool(use_metro))
+        now = self.clock()
+        with self._lock:
+            self.requests += 1
+            (score, updated_at) = self._scores.get(key, (0, now))
+            self._scores[key] = (self._decayed(score, now - updated_at) + 1, now)
+        return self.cache.departure_time(*key)
+
+    def hottest(self) -> list:
+        """
+        :return: The keys of the top boards with their request rate per second, the hottest first
+        """
+        now = self.clock()
+        with self._lock:
+            scores = [(key, self._decayed(score, now - updated_at))
+                      for (key, (score, updated_at)) in self._scores.items()]
+        rates = [(key, score * self.decay) for (key, score) in scores if score >= self.min_score]
+        rates.sort(key=lambda rate: rate[1], reverse=True)
+        return rates[:self.top]
+
+    def interval(self, rate: float) -> float:
+        """
+        :param rate: Requests per second of a board
+        :return: Seconds between prefetches of the board
+        """
+        return min(self.max_interval, max(self.min_interval, 1 / rate if rate > 0 else math.inf))
+
+    def tick(self):
+        """
+        Prefetches the top boards which are due and forgets boards which are no longer requested
+        """
+        for (key, rate) in self.hottest():
+            age = self.cache.age(*key)
+            if age is not None and age < self.interval(rate):
+                continue
+            if self.budget is not None and not self.budget.try_acquire():
+                with self._lock:
+                    self.budget_skipped += 1
+                continue
+            try:
+                self.cache.prefetch(*key)
+            except Exception:
+                with self._lock:
+                    self.prefetch_errors += 1
+        self._prune()
+
+    def start(self):
+        """
+        Starts ticking in a background thread
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self) -> dict:
+        """
+        The upstream calls saved are the prefetched boards which were requested, i.e. the calls moved out of
+        requests. The prefetches wasted are boards replaced or evicted before being requested.
+        :return: A dictionary of the counters of the scheduler
+        """
+        cache = self.cache.stats()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'tracked': len(self._scores),
+                'prefetches': cache['prefetches'],
+                'prefetch_errors': self.prefetch_errors,
+                'prefetch_hits': cache['prefetch_hits'],
+                'prefetch_hit_ratio': cache['prefetch_hits'] / self.requests if self.requests else 0,
+                'upstream_calls_saved': cache['prefetches_used'],
+                'prefetches_wasted': cache['prefetches_wasted'],
+                'budget_skipped': self.budget_skipped
+            }
+
+    def _run(self):
+        while not self._stopped.wait(self.tick_interval):
+            self.tick()
+
+    def _decayed(self, score: float, elapsed: float) -> float:
+        return score * math.exp(-self.decay * elapsed)
+
+    def _prune(self):
+        now = self.clock()
+        with self._lock:
+            for (key, (score, updated_at)) in list(self._scores.items()):
+                if self._decayed(score, now - updated_at) < 0.01:
+                    del self._scores[key]
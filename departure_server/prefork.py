@@ -0,0 +1,124 @@
+import os
+import signal
+import socket
+import sys
+import time
+
+__author__ = 'budde'
+
+
+_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class _Stop(Exception):
+    pass
+
+
+class Supervisor:
+    """
+    Runs a number of worker processes accepting connections on one shared listening socket.
+    Workers which exit are restarted, at most once per `restart_delay` seconds each, so a worker crashing at start
+    doesn't fork continuously. On SIGTERM or SIGINT the workers are terminated and given `grace_period` seconds to
+    finish before they are killed. Only available where os.fork is.
+    """
+    def __init__(self, workers: int, serve, grace_period: float=10, restart_delay: float=1):
+        """
+        :param workers: The number of worker processes
+        :param serve: A function serving a listening socket, called in each worker. Workers receive SIGTERM when
+                      stopped, which terminates them unless the function handles it by returning gracefully
+        :param grace_period: Seconds workers have to exit after being terminated
+        :param restart_delay: The minimum seconds between starts of a worker
+        """
+        self.workers = workers
+        self.serve = serve
+        self.grace_period = grace_period
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._children = {}
+        self._stopping = False
+
+    def run(self, host: str, port: int, backlog: int=1024):
+        """
+        Listens on the address and supervises the workers until terminated
+        """
+        listener = socket.create_server((host, port), backlog=backlog)
+        previous_handlers = {signum: signal.signal(signum, self._stop) for signum in _SIGNALS}
+        try:
+            for slot in range(self.workers):
+                self._spawn(slot, listener)
+            self._supervise(listener)
+        except _Stop:
+            pass
+        finally:
+            self._stopping = True
+            self._shutdown()
+            listener.close()
+            for (signum, handler) in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _spawn(self, slot: int, listener: socket.socket):
+        # Signals are blocked until the worker is recorded, such that a stop never leaves it running
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SIGNALS)
+        try:
+            pid = os.fork()
+        except OSError:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+            raise
+        if pid != 0:
+            self._children[pid] = (slot, time.monotonic())
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+            return
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+            self.serve(listener)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            code = 1
+            sys.excepthook(*sys.exc_info())
+        finally:
+            os._exit(code)
+
+    def _supervise(self, listener: socket.socket):
+        while True:
+            try:
+                (pid, status) = os.wait()
+            except ChildProcessError:
+                return
+            if pid not in self._children:
+                continue
+            (slot, started_at) = self._children.pop(pid)
+            delay = self.restart_delay - (time.monotonic() - started_at)
+            if delay > 0:
+                time.sleep(delay)
+            self.restarts += 1
+            self._spawn(slot, listener)
+
+    def _stop(self, signum, frame):
+        if not self._stopping:
+            self._stopping = True
+            raise _Stop()
+
+    def _shutdown(self):
+        for pid in self._children:
+            _signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.grace_period
+        while self._children and time.monotonic() < deadline:
+            for pid in list(self._children):
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    del self._children[pid]
+            time.sleep(0.05)
+        for pid in self._children:
+            _signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._children.clear()
+
+
+def _signal(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
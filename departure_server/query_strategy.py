@@ -1,8 +1,14 @@
-from urllib import request, parse
+from datetime import datetime
 from xml.etree import ElementTree
 
+from departure_server.connection_pool import ConnectionPool
+from departure_server.metrics import stage
+
 __author__ = 'budde'
 
+_upstream_stage = stage('upstream')
+_parse_stage = stage('parse')
+
 _nearby = """<?xml version="1.0" encoding="UTF-8"?>
 <LocationList xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://xmlopen.rejseplanen.dk/xml/rest/hafasRestStopsNearby.xsd">
 <StopLocation name="København H" x="12565796" y="55673063" id="8600626" distance="1" />
@@ -36,6 +42,32 @@ class QueryStrategy:
     def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
         raise NotImplemented
 
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        """
+        Queries the departure board starting at a given (scheduled) time instead of now
+        """
+        raise NotImplementedError
+
+
+class DelegatingQueryStrategy(QueryStrategy):
+    """
+    A query strategy forwarding every query to a wrapped strategy.
+    Extend this class in order to add behaviour around an existing strategy.
+    """
+    def __init__(self, strategy: QueryStrategy):
+        self.strategy = strategy
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        return self.strategy.find_nearby(x, y, max_radius, max_number)
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        return self.strategy.departure_time(stop_id, use_bus, use_tog, use_metro)
+
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        return self.strategy.departure_time_after(stop_id, after, use_bus, use_tog, use_metro)
+
 
 class StubQueryStrategy(QueryStrategy):
     def __init__(self, nearby: ElementTree.Element=None, departure: ElementTree.Element=None):
@@ -51,10 +83,23 @@ class StubQueryStrategy(QueryStrategy):
         self.called.append(('departure_time', [stop_id, use_bus, use_tog, use_metro]))
         return self.departure
 
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        self.called.append(('departure_time_after', [stop_id, after, use_bus, use_tog, use_metro]))
+        return self.departure
+
 
 class RejseplanenQueryStrategy(QueryStrategy):
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, pool_size: int=8, timeout: float=10, pool=None):
+        """
+        :param base_url: The base URL of the Rejseplanen API
+        :param pool_size: The maximum number of (persistent) connections to the API
+        :param timeout: Seconds before a call to the API times out
+        :param pool: An object getting the body of addresses relative to the base URL, used instead of a new
+                     ConnectionPool, e.g. for recording or replaying the responses of the API
+        """
         self.base_url = base_url
+        self.pool = pool if pool is not None else ConnectionPool(base_url, pool_size, timeout)
 
     def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
         return self._read_url(
@@ -64,7 +109,14 @@ class RejseplanenQueryStrategy(QueryStrategy):
         return self._read_url(
             "departureBoard?useBus=%d&useTog=%d&useMetro=%d&id=%d" % (use_bus, use_tog, use_metro, stop_id))
 
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        return self._read_url(
+            "departureBoard?useBus=%d&useTog=%d&useMetro=%d&id=%d&date=%s&time=%s"
+            % (use_bus, use_tog, use_metro, stop_id, after.strftime('%d.%m.%y'), after.strftime('%H:%M')))
+
     def _read_url(self, address: str) -> ElementTree.Element:
-        url = "%s/%s" % (self.base_url, address)
-        data = request.urlopen(url).read()
-        return ElementTree.fromstring(data)
+        with _upstream_stage.time():
+            body = self.pool.get(address)
+        with _parse_stage.time():
+            return ElementTree.fromstring(body)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+__author__ = 'budde'
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Tokens are added at a constant rate up to the capacity of the bucket.
+    """
+    def __init__(self, rate: float, capacity: float=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: Tokens added per second
+        :param capacity: The maximum number of tokens. Defaults to the rate, i.e. bursts of one second
+        :param clock: A function returning the current (monotonic) time in seconds
+        :param sleep: A function sleeping for a number of seconds
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float=1) -> bool:
+        """
+        Takes tokens if available
+        :return: True if the tokens were taken
+        """
+        return self._take(tokens) == 0
+
+    def acquire(self, timeout: float=None, tokens: float=1) -> bool:
+        """
+        Takes tokens, waiting for them to become available
+        :param timeout: The maximum number of seconds to wait or None to wait forever
+        :return: True if the tokens were taken before the timeout
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            wait = self._take(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < wait:
+                    return False
+            self.sleep(wait)
+
+    def _take(self, tokens: float) -> float:
+        """
+        :return: 0 if the tokens were taken, else the seconds until they are available
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
@@ -0,0 +1,181 @@
+import bisect
+import gzip
+import json
+import threading
+import time
+import zlib
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import RejseplanenQueryStrategy
+from departure_server.resilience import degraded_element
+
+__author__ = 'budde'
+
+
+class NotRecorded(LookupError):
+    def __init__(self, address: str):
+        super().__init__("No response to %s was recorded" % address)
+        self.address = address
+
+
+def read_archive(path: str) -> list:
+    """
+    Reads an archive written by a RecordingPool. The records written before the end of an archive which wasn't closed,
+    e.g. because the recording process was killed, are read.
+    :param path: The path of the archive
+    :return: A list of (offset, duration, address, body) tuples in the order the requests finished
+    """
+    records = []
+    with gzip.open(path, 'rt', encoding='UTF-8', errors='surrogateescape') as file:
+        try:
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                record = json.loads(line)
+                records.append((record['t'], record['d'], record['a'],
+                                record['b'].encode('UTF-8', 'surrogateescape')))
+        except EOFError:
+            pass
+    return records
+
+
+class RecordingPool:
+    """
+    Wraps a connection pool, recording every successful response to a gzip compressed archive of JSON lines.
+    Each record has the address, the body, the offset in seconds from the start of the recording at which the request
+    was sent, and the duration of the request. The archive is flushed at most every `flush_interval` seconds, and is
+    complete once closed.
+    """
+    def __init__(self, pool, path: str, flush_interval: float=1, clock=time.monotonic):
+        """
+        :param pool: The wrapped pool, e.g. a ConnectionPool
+        :param path: The path of the archive, replaced if it exists
+        :param flush_interval: The minimum seconds between flushes of the archive
+        :param clock: A function returning the current time in seconds
+        """
+        self.pool = pool
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.recorded = 0
+        # Bodies which aren't UTF-8 are kept byte for byte as escaped surrogates
+        self._file = gzip.open(path, 'wt', encoding='UTF-8', errors='surrogateescape')
+        self._started_at = self._flushed_at = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def connections_opened(self) -> int:
+        return self.pool.connections_opened
+
+    @property
+    def requests(self) -> int:
+        return self.pool.requests
+
+    def get(self, address: str) -> bytes:
+        started_at = self.clock()
+        body = self.pool.get(address)
+        finished_at = self.clock()
+        line = json.dumps({'t': round(started_at - self._started_at, 6), 'd': round(finished_at - started_at, 6),
+                           'a': address, 'b': body.decode('UTF-8', 'surrogateescape')}, ensure_ascii=False)
+        with self._lock:
+            if self._file.closed:
+                return body
+            self._file.write(line + '\n')
+            self.recorded += 1
+            if finished_at - self._flushed_at >= self.flush_interval:
+                self._file.flush()
+                self._file.buffer.flush(zlib.Z_SYNC_FLUSH)
+                self._flushed_at = finished_at
+        return body
+
+    def close(self):
+        """
+        Completes the archive and closes the wrapped pool
+        """
+        with self._lock:
+            self._file.close()
+        self.pool.close()
+
+
+class ReplayPool:
+    """
+    Serves the responses of an archive written by a RecordingPool, at the original or a scaled speed.
+    The time of the replay starts when the pool is created and runs `speed` times as fast as the recording. An address
+    is answered by its latest response recorded at or before the time of the replay, or its first response if none
+    was, after the duration of the recorded request divided by `speed`. Thus a replay also reproduces how the
+    departure boards changed during the recording.
+    """
+    def __init__(self, path: str, speed: float=1, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param path: The path of the archive
+        :param speed: How many times faster than recorded the archive is replayed
+        :param clock: A function returning the current time in seconds
+        :param sleep: A function sleeping for a number of seconds
+        """
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.connections_opened = 0
+        self.requests = 0
+        self.missing = 0
+        self._responses = {}
+        for (offset, duration, address, body) in sorted(read_archive(path), key=lambda record: record[0]):
+            self._responses.setdefault(address, ([], []))
+            self._responses[address][0].append(offset)
+            self._responses[address][1].append((duration, body))
+        self._started_at = clock()
+        self._lock = threading.Lock()
+
+    def get(self, address: str) -> bytes:
+        responses = self._responses.get(address)
+        with self._lock:
+            self.requests += 1
+            if responses is None:
+                self.missing += 1
+        if responses is None:
+            raise NotRecorded(address)
+        (offsets, recorded) = responses
+        now = (self.clock() - self._started_at) * self.speed
+        (duration, body) = recorded[max(0, bisect.bisect_right(offsets, now) - 1)]
+        self.sleep(duration / self.speed)
+        return body
+
+    def addresses(self) -> list:
+        """
+        :return: The addresses recorded, in the order they were first requested
+        """
+        return sorted(self._responses, key=lambda address: self._responses[address][0][0])
+
+    def close(self):
+        pass
+
+
+class RecordingQueryStrategy(RejseplanenQueryStrategy):
+    """
+    Queries the Rejseplanen API and records the raw responses, see RecordingPool
+    """
+    def __init__(self, base_url: str, path: str, pool_size: int=8, timeout: float=10):
+        super().__init__(base_url, pool_size, timeout)
+        self.pool = RecordingPool(self.pool, path)
+
+    def close(self):
+        self.pool.close()
+
+
+class ReplayQueryStrategy(RejseplanenQueryStrategy):
+    """
+    Answers queries from the responses recorded by a RecordingQueryStrategy without any network access, see
+    ReplayPool. Responses are parsed as when querying the API. Queries which weren't recorded, e.g. the later boards
+    of a page, whose dates differ from the recording, are answered by empty, degraded elements as if the upstream had
+    failed, but without counting as failures of the upstream.
+    """
+    TAGS = {'stopsNearby': 'LocationList', 'departureBoard': 'DepartureBoard'}
+
+    def __init__(self, path: str, speed: float=1):
+        super().__init__(None, pool=ReplayPool(path, speed))
+
+    def _read_url(self, address: str) -> ElementTree.Element:
+        try:
+            return super()._read_url(address)
+        except NotRecorded:
+            return degraded_element(self.TAGS[address.split('?', 1)[0]])
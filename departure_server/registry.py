@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+import time
+
+__author__ = 'budde'
+
+
+class StationRegistry:
+    """
+    Remembers the stations seen across restarts in an SQLite database on disk.
+    The ids of Rejseplanen aren't stable, so a station is identified by its name and position, and every id seen for
+    it is kept. The id seen most recently is the current id of the station, and an id seen for another station is
+    moved to that station. The registry is loaded into memory when created and only changes are written, so it is
+    read without touching the disk. Processes sharing the file see the changes of each other when they are restarted.
+    """
+    def __init__(self, path: str, clock=time.time):
+        """
+        :param path: The path of the database, created if missing
+        :param clock: A function returning the current (wall clock) time in seconds
+        """
+        self.path = path
+        self.clock = clock
+        self.reconciled = 0
+        self.writes = 0
+        self.errors = 0
+        self._ids = {}
+        self._current = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        connection = self._connection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS ids (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                               'lat INTEGER NOT NULL, long INTEGER NOT NULL, seen_at REAL NOT NULL)')
+        for row in connection.execute('SELECT id, name, lat, long FROM ids ORDER BY seen_at, id'):
+            identity = (row[1], row[2], row[3])
+            self._ids[row[0]] = identity
+            self._current[identity] = row[0]
+
+    def get(self, station_id: int):
+        """
+        :param station_id: A current or past id of a station
+        :return: A tuple with the current id, name, latitude, and longitude of the station, or None if unknown
+        """
+        identity = self._ids.get(station_id)
+        if identity is None:
+            return None
+        return (self._current.get(identity, station_id),) + identity
+
+    def record(self, stations: list):
+        """
+        Reconciles the ids of stations as seen upstream, and stores the changes
+        :param stations: A list of (id, name, latitude, longitude) tuples
+        :return:
+        """
+        changes = []
+        with self._lock:
+            for (station_id, name, lat, long) in stations:
+                identity = (name, lat, long)
+                previous = self._ids.get(station_id)
+                current = self._current.get(identity)
+                if previous == identity and current == station_id:
+                    continue
+                if previous is not None and previous != identity and self._current.get(previous) == station_id:
+                    del self._current[previous]
+                if current is not None and current != station_id:
+                    self.reconciled += 1
+                self._ids[station_id] = identity
+                self._current[identity] = station_id
+                changes.append((station_id, name, lat, long))
+            if not changes:
+                return
+            self.writes += len(changes)
+        now = self.clock()
+        try:
+            connection = self._connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO ids (id, name, lat, long, seen_at) '
+                                       'VALUES (?, ?, ?, ?, ?)', [change + (now,) for change in changes])
+        except sqlite3.Error:
+            # The stations are still known in memory, they are only lost at restart
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary with the number of stations and ids known, and the counters of this process
+        """
+        with self._lock:
+            return {'stations': len(self._current), 'ids': len(self._ids), 'reconciled': self.reconciled,
+                    'writes': self.writes, 'errors': self.errors}
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return: The connection of the current thread. Connections are never shared between threads or processes.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
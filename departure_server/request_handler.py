@@ -1,48 +1,74 @@
-import json
+import mimetypes
+import queue
+import time
 from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qs
 
+from departure_server.http_cache import ResponseCache, CachedResponse, STATIC_MAX_AGE
+from departure_server.live import LiveDepartures
+from departure_server.metrics import REGISTRY, REQUEST_SECONDS, Registry, SamplingProfiler, stage, \
+    CONTENT_TYPE as METRICS_CONTENT_TYPE
 from departure_server.query_strategy import QueryStrategy
-from departure_server.station import Station, Position, Departure
-from departure_server.rest import RESTHandler, NoSuchFunctionException
+from departure_server.serialization import encode_result
+from departure_server.station import StationLibrary
+from departure_server.rest import RESTHandler, NoSuchFunctionException, BadRequestException, degraded_result
 
 __author__ = 'budde'
 
+_encode_stage = stage('encode')
+
 import http.server
 
 
-def setup_handler(strategy: QueryStrategy):
+class ThreadedHTTPServer(ThreadingMixIn, http.server.HTTPServer):
+    """
+    A HTTP server handling each request in a new thread
+    """
+    daemon_threads = True
+
+
+def setup_handler(strategy: QueryStrategy, library: StationLibrary=None, registry: Registry=None,
+                  profiler: SamplingProfiler=None):
     handler = CustomRequestHandler
-    handler.__REST_HANDLER__ = RESTHandler(strategy)
+    handler.__REST_HANDLER__ = RESTHandler(strategy, library)
+    handler.__RESPONSE_CACHE__ = ResponseCache()
+    handler.__METRICS__ = registry if registry is not None else REGISTRY
+    handler.__PROFILER__ = profiler
     return handler
 
 
-class ModelEncoder(json.JSONEncoder):
-    def default(self, o):
-        """
-        Converts instances of the model to JSON
-        :param o: An object
-        :return: Serializable objects
-        """
-        if isinstance(o, Station):
-            return {'id': o.id, 'name': o.name, 'pos': self.default(o.pos)}
+def parse_api_path(path: str) -> (list, dict):
+    """
+    Splits the path of an API call into the function name and the input of the function
+    :param path: The request path, e.g. /api/1.0/Stations/findNearby?lat=1&long=2
+    :return: A tuple with the list of names and the dictionary of query parameters
+    """
+    parsed_path = urlparse(path)
+    name = parsed_path.path[1:].split("/")[1:]
+    query = parse_qs(parsed_path.query)
+    for key in query:
+        query[key] = query[key][0]
+    return name, query
 
-        if isinstance(o, Position):
-            return {'long': o.long, 'lat': o.lat}
 
-        if isinstance(o, Departure):
-            return {
-                'name': o.name,
-                'date': o.date.timestamp(),
-                'departure_type': o.departure_type,
-                'direction': o.direction
-            }
+def content_type(path: str) -> str:
+    """
+    Decides the MIME type of a static file, with the correct type for dart scripts
+    :param path: The path of the file
+    :return: The MIME type
+    """
+    if path[-5:] == ".dart":
+        return "application/dart"
 
-        return super().default(o)
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
 
 
 class CustomRequestHandler(http.server.SimpleHTTPRequestHandler):
     __REST_HANDLER__ = None
+    __RESPONSE_CACHE__ = None
+    __METRICS__ = None
+    __PROFILER__ = None
+    status_code = None
 
     def list_directory(self, path):
         """
@@ -58,11 +84,34 @@ class CustomRequestHandler(http.server.SimpleHTTPRequestHandler):
         regular server call (handled by the parent class)
         :return:
         """
+        started_at = time.perf_counter()
         if self.path[0:5] == "/api/":
             self.send_api()
             return
+        if self.path == "/metrics":
+            self.send_body(200, self.__METRICS__.expose(),
+                           [('Content-Type', METRICS_CONTENT_TYPE), ('Cache-Control', 'no-cache')])
+            return
+        if self.path[0:15] == "/debug/profile?" and self.__PROFILER__ is not None:
+            self.send_profile()
+            return
 
         super().do_GET()
+        REQUEST_SECONDS.labels('static').observe(time.perf_counter() - started_at)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        """
+        Adds long-lived caching to successful responses of static files
+        :return:
+        """
+        if self.status_code in (200, 304) and self.path[0:5] != "/api/" and self.path != "/metrics" \
+                and self.path[0:7] != "/debug/":
+            self.send_header('Cache-Control', 'public, max-age=%d' % STATIC_MAX_AGE)
+        super().end_headers()
 
     def guess_type(self, path):
         """
@@ -78,28 +127,110 @@ class CustomRequestHandler(http.server.SimpleHTTPRequestHandler):
     def send_api(self):
         """
         Will handle the query as a API call.
-        If the function is not found, an error 400 will be sent.
+        If the function is not found, or its parameters are invalid, an error 400 will be sent.
         Else JSON encoded result will be sent
         :return:
         """
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path[1:].split("/")[1:]
-        query = parse_qs(parsed_path.query)
-        for key in query:
-            query[key] = query[key][0]
-        try:
-            self.send_result(self.__REST_HANDLER__.handle(path, query))
-
-        except NoSuchFunctionException:
-            self.send_error(400, "Bad request")
+        started_at = time.perf_counter()
+        (path, query) = parse_api_path(self.path)
+        response = self.__RESPONSE_CACHE__.lookup(self.path)
+        if response is not None:
+            self.send_cached_response(response)
+        else:
+            try:
+                result = self.__REST_HANDLER__.handle(path, query)
+                if isinstance(result, LiveDepartures):
+                    if not isinstance(self.server, ThreadingMixIn):
+                        # A stream would occupy the only thread of the server until the client leaves
+                        self.send_error(501, "Live departures require --mode threaded or async")
+                        return
+                    self.send_live(result)
+                    return
+                self.send_result(result)
+
+            except (NoSuchFunctionException, BadRequestException):
+                self.send_error(400, "Bad request")
+                return
+        REQUEST_SECONDS.labels(self.__REST_HANDLER__.route(path)).observe(time.perf_counter() - started_at)
 
     def send_result(self, result):
         """
-        Sends the provided results with status code 200
+        Sends the provided results with status code 200. Degraded results are sent with no-cache and aren't stored
         :param result: string
         :return: void
         """
-        formatted_result = json.dumps(result, cls=ModelEncoder)
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(bytes(formatted_result, 'UTF-8'))
+        with _encode_stage.time():
+            body = encode_result(result)
+        self.send_cached_response(self.__RESPONSE_CACHE__.store(self.path, body, degraded_result(result)))
+
+    def send_profile(self):
+        """
+        Runs the profiler for the number of seconds of the query and sends the collapsed stacks
+        :return: void
+        """
+        try:
+            seconds = float(parse_qs(urlparse(self.path).query)['seconds'][0])
+        except (KeyError, ValueError):
+            self.send_error(400, "Bad request")
+            return
+        try:
+            body = self.__PROFILER__.profile(seconds)
+        except RuntimeError:
+            self.send_error(409, "A profile is already running")
+            return
+        self.send_body(200, body, [('Content-Type', 'text/plain; charset=utf-8'), ('Cache-Control', 'no-cache')])
+
+    def send_live(self, live: LiveDepartures):
+        """
+        Streams the changes of the departures of a station as server-sent events until the client disconnects.
+        This occupies the thread of the request, so it is only done by threaded servers.
+        :param live: The live departures
+        :return: void
+        """
+        events = queue.Queue()
+        unsubscribe = live.subscribe(events.put)
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            while True:
+                try:
+                    self.wfile.write(live.event(events.get(timeout=live.heartbeat_interval)))
+                except queue.Empty:
+                    self.wfile.write(live.heartbeat())
+        except OSError:
+            pass
+        finally:
+            unsubscribe()
+
+    def send_cached_response(self, response: CachedResponse):
+        """
+        Sends a response with caching headers, or 304 if the request is conditional and matches the response
+        :param response: The response
+        :return: void
+        """
+        headers = self.__RESPONSE_CACHE__.headers(response)
+        if response.matches(self.headers.get('If-None-Match')):
+            self.send_body(304, b'', headers)
+        else:
+            self.send_body(200, response.body, headers)
+
+    def send_body(self, code: int, body: bytes, headers: list=None):
+        """
+        Sends a response with a Content-Length header. The status line, headers, and body are sent in one write.
+        :param code: The status code
+        :param body: The body
+        :param headers: A list of additional (name, value) headers
+        :return: void
+        """
+        self.send_response(code)
+        for (name, value) in headers or []:
+            self.send_header(name, value)
+        if code != 304:
+            self.send_header('Content-Length', str(len(body)))
+        # end_headers would flush the buffered headers in a write of their own
+        self._headers_buffer.append(b"\r\n")
+        self._headers_buffer.append(body)
+        self.flush_headers()
@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import QueryStrategy, DelegatingQueryStrategy
+from departure_server.rate_limit import TokenBucket
+
+__author__ = 'budde'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def degraded(element: ElementTree.Element) -> bool:
+    """
+    :param element: An element returned by a query strategy
+    :return: True if the element is an empty stand-in for a result the upstream failed to deliver
+    """
+    return element.get('degraded') == 'true'
+
+
+def degraded_element(tag: str) -> ElementTree.Element:
+    """
+    :param tag: The tag of the element the upstream failed to deliver
+    :return: An empty, degraded element
+    """
+    return ElementTree.Element(tag, {'degraded': 'true'})
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of calls. After `failure_threshold` failures the circuit opens and calls are
+    refused for `reset_timeout` seconds, after which a single trial call is allowed (half-open).
+    The circuit closes when the trial succeeds and opens again when it fails.
+    """
+    def __init__(self, failure_threshold: int=5, reset_timeout: float=30, clock=time.monotonic):
+        """
+        :param failure_threshold: Consecutive failures opening the circuit
+        :param reset_timeout: Seconds the circuit stays open before a trial call
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        :return: True if a call may be made, in which case success or failure must be reported
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def abandon(self):
+        """
+        Reports that an allowed call wasn't made. A trial call is allowed again.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = self.clock()
+
+
+class ResilientQueryStrategy(DelegatingQueryStrategy):
+    """
+    Protects the server against a slow or failing upstream.
+    Calls are rate limited by a token bucket and abandoned after a deadline. Errors, deadlines, and calls slower than
+    the latency threshold count as failures of a circuit breaker. Whenever a call fails, is refused by the open
+    circuit, or can't get a token in time, the last result of the same query is returned, or an empty, degraded
+    element if there is none. Thus requests are answered quickly instead of with an error.
+    """
+    def __init__(self, strategy: QueryStrategy, rate_limit: TokenBucket=None, deadline: float=5,
+                 latency_threshold: float=None, breaker: CircuitBreaker=None, max_workers: int=16,
+                 max_fallbacks: int=1024, clock=time.monotonic):
+        """
+        :param strategy: The wrapped strategy
+        :param rate_limit: The bucket of upstream calls. Defaults to no limit
+        :param deadline: Seconds before a call is abandoned
+        :param latency_threshold: Seconds after which a successful call still counts as a failure. Defaults to never
+        :param breaker: The circuit breaker. Defaults to a CircuitBreaker with the default settings
+        :param max_workers: The maximum number of calls in flight
+        :param max_fallbacks: The maximum number of results kept as fallbacks
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        super().__init__(strategy)
+        self.rate_limit = rate_limit
+        self.deadline = deadline
+        self.latency_threshold = latency_threshold
+        self.breaker = breaker if breaker is not None else CircuitBreaker(clock=clock)
+        self.max_fallbacks = max_fallbacks
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='upstream')
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.fallbacks = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        return self._call(('find_nearby', x, y, max_radius, max_number), 'LocationList',
+                          lambda: self.strategy.find_nearby(x, y, max_radius, max_number))
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        return self._call(('departure_time', stop_id, bool(use_bus), bool(use_tog), bool(use_metro)), 'DepartureBoard',
+                          lambda: self.strategy.departure_time(stop_id, use_bus, use_tog, use_metro))
+
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        return self._call(('departure_time_after', stop_id, after, bool(use_bus), bool(use_tog), bool(use_metro)),
+                          'DepartureBoard',
+                          lambda: self.strategy.departure_time_after(stop_id, after, use_bus, use_tog, use_metro))
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary of the counters and the state of the circuit
+        """
+        with self._lock:
+            return {
+                'state': self.breaker.state,
+                'opened': self.breaker.opened,
+                'calls': self.calls,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'rate_limited': self.rate_limited,
+                'fallbacks': self.fallbacks
+            }
+
+    def _call(self, key: tuple, tag: str, function) -> ElementTree.Element:
+        started_at = self.clock()
+        if not self.breaker.allow():
+            return self._fallback(key, tag, 'rejected')
+        if self.rate_limit is not None and not self.rate_limit.acquire(timeout=self.deadline):
+            self.breaker.abandon()
+            return self._fallback(key, tag, 'rate_limited')
+        with self._lock:
+            self.calls += 1
+        future = self.executor.submit(function)
+        try:
+            value = future.result(max(0, self.deadline - (self.clock() - started_at)))
+        except FutureTimeoutError:
+            self.breaker.failure()
+            return self._fallback(key, tag, 'timeouts')
+        except Exception:
+            self.breaker.failure()
+            return self._fallback(key, tag, 'failures')
+        if self.latency_threshold is not None and self.clock() - started_at > self.latency_threshold:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        with self._lock:
+            self._results[key] = value
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_fallbacks:
+                self._results.popitem(last=False)
+        return value
+
+    def _fallback(self, key: tuple, tag: str, counter: str) -> ElementTree.Element:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.fallbacks += 1
+            value = self._results.get(key)
+        return value if value is not None else degraded_element(tag)
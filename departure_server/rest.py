@@ -1,5 +1,12 @@
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from departure_server.live import DepartureHub, LiveDepartures
 from departure_server.query_strategy import QueryStrategy
-from departure_server.station import StationLibrary, Position
+from departure_server.station import StationLibrary, Position, Degraded
 
 __author__ = 'budde'
 
@@ -9,11 +16,99 @@ class NoSuchFunctionException(Exception):
         self.key = key
 
 
+class BadRequestException(Exception):
+    def __init__(self, parameter: str):
+        super().__init__("Invalid parameter %s" % parameter)
+        self.parameter = parameter
+
+
+def _parameter(inp: dict, name: str, parse):
+    """
+    Parses a parameter of the input
+    :param inp: The input
+    :param name: The name of the parameter
+    :param parse: A function parsing the value of the parameter
+    :return: The parsed value
+    """
+    try:
+        return parse(inp[name])
+    except (KeyError, ValueError, OverflowError, OSError):
+        raise BadRequestException(name)
+
+
+def _station_id(inp: dict) -> int:
+    """
+    :param inp: The input of a function of a station, with the id matched by the wildcard handler
+    :return: The id of the station
+    """
+    try:
+        return int(inp['*'][-1])
+    except ValueError:
+        raise BadRequestException('id')
+
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromtimestamp(float(value))
+
+
+def degraded_result(result) -> bool:
+    """
+    :param result: The result of an API function
+    :return: True if the result, or a list within it, is missing results the upstream failed to deliver
+    """
+    if isinstance(result, Degraded):
+        return True
+    if isinstance(result, dict):
+        return any(degraded_result(value) for value in result.values())
+    return False
+
+
+def _with_captured(handler_input: dict, captured: list) -> dict:
+    if captured is None:
+        return handler_input
+    handler_input = dict(handler_input)
+    handler_input['*'] = captured
+    return handler_input
+
+
+def _format_cursor(date: datetime, skip: int, board_start: datetime) -> str:
+    """
+    Formats the cursor of a page starting at the departures at a date, after skipping some of these.
+    The board start is the scheduled time of the board the stream restarts at, empty for the current board.
+    """
+    return '%d:%d:%s' % (date.timestamp(), skip, '' if board_start is None else '%d' % board_start.timestamp())
+
+
+def _parse_cursor(cursor: str) -> tuple:
+    (date, skip, board_start) = cursor.split(':')
+    if int(skip) < 0:
+        raise ValueError("Negative skip %s" % skip)
+    return (datetime.fromtimestamp(int(date)), int(skip),
+            datetime.fromtimestamp(int(board_start)) if board_start else None)
+
+
+class _Route:
+    """
+    A compiled node of the route table. Nodes are never changed after they are compiled.
+    The entries map names to the child nodes and to the (function, route) tuples of the functions, where the route
+    names the function as Handler.route does. The entry of the wildcard name is also kept as the wildcard.
+    """
+    __slots__ = ('entries', 'wildcard', 'index')
+
+    def __init__(self, entries: dict, index: tuple):
+        self.entries = entries
+        self.wildcard = entries.get("*")
+        self.index = index
+
+
 class Handler:
     def __init__(self, name=None):
         self.name = name
         self.functions = {}
         self.handlers = {}
+        self._parent = None
+        self._table = None
+        self._lock = threading.Lock()
 
     def add_function(self, name: str, function):
         """
@@ -23,11 +118,11 @@ class Handler:
         :return:
         """
         self.functions[name] = function
+        self._invalidate()
 
     def add_handler(self, name: str):
         """
-        If a handler hasn't been added, a new handler is created. A function is also
-        added in order to mimic a recursive call to handle.
+        If a handler hasn't been added, a new handler is created.
         If a handler has previously been addend, that instance is returned.
         :param name: The name for the handler
         :return: A handler
@@ -35,38 +130,108 @@ class Handler:
         if name in self.handlers:
             return self.handlers[name]
         self.handlers[name] = handler = Handler(name)
-        self.add_function(name, lambda nme, inp: Handler._recursive_handle(handler, nme, inp))
+        handler._parent = self
+        self._invalidate()
         return handler
 
-    @staticmethod
-    def _recursive_handle(handler, name: list, inp: dict):
-        """
-        :type handler: Handler
-        """
-        handler.name = name[0]
-        return handler.handle(name[1:], inp)
-
     def handle(self, name: list, handler_input: dict=None):
         """
         Resolves the right name and calls the appropriate function.
+        Names are resolved in a route table compiled from the added functions and handlers, with one lookup per name,
+        such that concurrent calls share no mutable state.
+        A function is called with the names from its own name and onwards. The names matched by wildcard handlers
+        are passed in the input as a list with the key "*".
+        An empty name, or a name ending with an empty name (a trailing slash), calls the function added with the name
+        "", if any.
         If no function is found an NoSuchFunctionException will be thrown
         :param name: A list of names
         :param handler_input: The input passed to the *last* function
         :return:
         """
-        if len(name) == 0:
-            raise NoSuchFunctionException("")
         handler_input = {} if handler_input is None else handler_input
-        function_name = name[0] if name[0] in self.functions else "*"
-        if function_name not in self.functions:
-            raise NoSuchFunctionException(name[0])
-        return (self.functions[function_name])(name, handler_input)
+        (target, i, captured) = self._resolve(name)
+        return target[0](name[i:], _with_captured(handler_input, captured))
+
+    def route(self, name: list) -> str:
+        """
+        Names the route a call is resolved to, as in handle. Names matched by wildcards are replaced by *, and the names
+        after those of the function are left out, so calls of the same function share the route.
+        If no function is found an NoSuchFunctionException will be thrown
+        :param name: A list of names
+        :return: The route, e.g. 1.0/Stations/departures/*/
+        """
+        return self._resolve(name)[0][1]
+
+    def _resolve(self, name: list) -> tuple:
+        """
+        :return: A tuple with the (function, route) tuple, the position of the names the function is called with, and
+                 the names captured by wildcards or None
+        """
+        route = self._table if self._table is not None else self.compile()
+        captured = None
+        last = len(name) - 1
+        for (i, segment) in enumerate(name):
+            if i == last and segment == "":
+                break
+            entry = route.entries.get(segment)
+            if entry is None:
+                entry = route.wildcard
+                if entry is None:
+                    raise NoSuchFunctionException(segment)
+                if type(entry) is _Route:
+                    if captured is None:
+                        captured = [segment]
+                    else:
+                        captured.append(segment)
+            if type(entry) is not _Route:
+                return entry, i, captured
+            route = entry
+        if route.index is None:
+            raise NoSuchFunctionException("")
+        return route.index, len(name), captured
+
+    def compile(self) -> _Route:
+        """
+        Compiles the route table of the handler. Changes to the handler, or its handlers, recompiles the table.
+        :return: The root of the route table
+        """
+        with self._lock:
+            if self._table is None:
+                self._table = self._compile("")
+            return self._table
+
+    def _compile(self, prefix: str) -> _Route:
+        """
+        :param prefix: The route of the handler, ending with a slash unless empty
+        """
+        entries = {name: handler._compile(prefix + name + "/") for (name, handler) in self.handlers.items()}
+        entries.update((name, (function, prefix + name)) for (name, function) in self.functions.items() if name != "")
+        index = self.functions.get("")
+        return _Route(entries, None if index is None else (index, prefix))
+
+    def _invalidate(self):
+        handler = self
+        while handler is not None:
+            handler._table = None
+            handler = handler._parent
 
 
 class RESTHandler(Handler):
-    def __init__(self, query_strategy: QueryStrategy):
+    MAX_BATCH_SIZE = 50
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 200
+    MAX_BOARDS_PER_PAGE = 10
+
+    def __init__(self, query_strategy: QueryStrategy, library: StationLibrary=None, max_workers: int=8):
+        """
+        :param query_strategy: The strategy used for querying stations and departures
+        :param library: The station library. Defaults to a new library using the query strategy
+        :param max_workers: The maximum number of departure boards fetched in parallel for a batch
+        """
         super().__init__(None)
-        self.library = StationLibrary(query_strategy)
+        self.library = library if library is not None else StationLibrary(query_strategy)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.hub = DepartureHub(self.library)
         self.setup_v1_0()
 
     def setup_v1_0(self):
@@ -78,8 +243,81 @@ class RESTHandler(Handler):
         site_library_handler = handler.add_handler('Stations')
         site_library_handler.add_function('findNearby',
                                           lambda name, inp: self.library.find_nearby(
-                                              Position(int(inp['lat']), int(inp['long'])),
-                                              int(inp['radius'])))
-        site_library_handler \
-            .add_handler('departures') \
-            .add_function('*', lambda name, inp: self.library.station_from_id(int(name[0])).departures())
+                                              Position(_parameter(inp, 'lat', int), _parameter(inp, 'long', int)),
+                                              _parameter(inp, 'radius', int)))
+        departures_handler = site_library_handler.add_handler('departures')
+        station_handler = departures_handler.add_handler('*')
+        station_handler.add_function('', lambda name, inp: self.departures(_station_id(inp), inp))
+        station_handler.add_function('live', lambda name, inp: LiveDepartures(self.hub, _station_id(inp)))
+        departures_handler.add_function('', lambda name, inp: self.batch_departures(inp.get('ids', '')))
+
+    def departures(self, station_id: int, inp: dict):
+        """
+        Lists the departures of a station. Without any of the parameters limit, cursor, from, and until, the
+        departures of the current board are returned as a list. Otherwise a page of the departures of successive
+        boards is returned as a dictionary with the departures and the cursor of the next page, which is None at the
+        end. Only the departures of the page are created.
+        :param station_id: The id of the station
+        :param inp: The input, with the optional parameters: limit, the maximum number of departures (at most
+                    MAX_PAGE_SIZE), cursor, the cursor of a previous page, and from and until, the timestamps between
+                    which the departures leave
+        :return: A list of departures or a page
+        :raises BadRequestException: If a parameter is invalid
+        """
+        station = self.library.station_from_id(station_id)
+        if not any(parameter in inp for parameter in ('limit', 'cursor', 'from', 'until')):
+            return station.departures()
+        limit = max(1, min(self.MAX_PAGE_SIZE, _parameter(inp, 'limit', int) if 'limit' in inp
+                           else self.DEFAULT_PAGE_SIZE))
+        start = board_start = _parameter(inp, 'from', _timestamp) if 'from' in inp else None
+        skip = 0
+        if 'cursor' in inp:
+            (start, skip, board_start) = _parameter(inp, 'cursor', _parse_cursor)
+        degraded_boards = []
+        stream = station.departure_stream(board_start, self.MAX_BOARDS_PER_PAGE, degraded_boards.append)
+        if start is not None:
+            stream = itertools.dropwhile(lambda entry: entry[0].date < start, stream)
+        if skip:
+            stream = itertools.islice(stream, skip, None)
+        if 'until' in inp:
+            until = _parameter(inp, 'until', _timestamp)
+            stream = itertools.takewhile(lambda entry: entry[0].date < until, stream)
+        page = list(itertools.islice(stream, limit + 1))
+        departures = [departure for (departure, _) in page[:limit]]
+        if degraded_boards:
+            departures = Degraded(departures)
+        if len(page) <= limit:
+            return {'departures': departures, 'next': None}
+        (following, following_board_start) = page[limit]
+        skip = sum(1 for departure in departures if departure.date == following.date) + \
+            (skip if start == following.date else 0)
+        return {'departures': departures, 'next': _format_cursor(following.date, skip, following_board_start)}
+
+    def batch_departures(self, ids: str) -> dict:
+        """
+        Fetches the departures of many stations in parallel.
+        Duplicate ids are fetched once and the failure of a station doesn't fail the others.
+        :param ids: A comma separated list of station ids
+        :return: A dictionary with the departures and the errors, both keyed by station id
+        """
+        station_ids = list(OrderedDict.fromkeys(i.strip() for i in ids.split(',') if i.strip()))
+        result = {'departures': {}, 'errors': {}}
+        futures = []
+        for station_id in station_ids[:self.MAX_BATCH_SIZE]:
+            try:
+                parsed_id = int(station_id)
+            except ValueError:
+                result['errors'][station_id] = 'Invalid id'
+                continue
+            futures.append((station_id, self.executor.submit(self.__station_departures, parsed_id)))
+        for station_id in station_ids[self.MAX_BATCH_SIZE:]:
+            result['errors'][station_id] = 'Too many stations'
+        for (station_id, future) in futures:
+            try:
+                result['departures'][station_id] = future.result()
+            except Exception as e:
+                result['errors'][station_id] = e.__class__.__name__
+        return result
+
+    def __station_departures(self, station_id: int) -> list:
+        return self.library.station_from_id(station_id).departures()
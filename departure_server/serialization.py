@@ -0,0 +1,83 @@
+import json
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+from departure_server.station import Station, Position, Departure
+
+__author__ = 'budde'
+
+
+class ModelEncoder(json.JSONEncoder):
+    def default(self, o):
+        """
+        Converts instances of the model to JSON
+        :param o: An object
+        :return: Serializable objects
+        """
+        if isinstance(o, Station):
+            return {'id': o.id, 'name': o.name, 'pos': self.default(o.pos)}
+
+        if isinstance(o, Position):
+            return {'long': o.long, 'lat': o.lat}
+
+        if isinstance(o, Departure):
+            return {
+                'name': o.name,
+                'date': o.date.timestamp(),
+                'departure_type': o.departure_type,
+                'direction': o.direction
+            }
+
+        return super().default(o)
+
+
+@lru_cache(maxsize=65536)
+def _encode_station(station_id: int, name: str, lat: int, long: int) -> bytes:
+    return bytes('{"id": %d, "name": %s, "pos": {"long": %d, "lat": %d}}'
+                 % (station_id, encode_basestring_ascii(name), long, lat), 'ascii')
+
+
+def encode_station(station: Station) -> bytes:
+    """
+    Encodes a station as ModelEncoder does. Stations rarely change, so the encoded bytes are cached.
+    :param station: The station
+    :return: The ASCII encoded JSON
+    """
+    return _encode_station(station.id, station.name, station.pos.lat, station.pos.long)
+
+
+def encode_departure(departure: Departure) -> bytes:
+    """
+    Encodes a departure as ModelEncoder does
+    :param departure: The departure
+    :return: The ASCII encoded JSON
+    """
+    return bytes('{"name": %s, "date": %r, "departure_type": %s, "direction": %s}'
+                 % (encode_basestring_ascii(departure.name), departure.date.timestamp(),
+                    encode_basestring_ascii(departure.departure_type), encode_basestring_ascii(departure.direction)),
+                 'ascii')
+
+
+def encode_result(result) -> bytes:
+    """
+    Encodes the result of an API call as JSON.
+    Lists of stations or departures, also within dictionaries, are encoded by specialised encoders and
+    everything else by the ModelEncoder. The output is identical to json.dumps with the ModelEncoder.
+    :param result: The result
+    :return: The UTF-8 encoded JSON
+    """
+    return _encode(result)
+
+
+def _encode(value) -> bytes:
+    value_type = type(value)
+    if value_type is list and value:
+        item_type = type(value[0])
+        if item_type is Station or item_type is Departure:
+            encode = encode_station if item_type is Station else encode_departure
+            if all(type(o) is item_type for o in value):
+                return b'[' + b', '.join([encode(o) for o in value]) + b']'
+    elif value_type is dict and value and all(type(key) is str for key in value):
+        return b'{' + b', '.join([bytes(encode_basestring_ascii(key), 'ascii') + b': ' + _encode(item)
+                                  for (key, item) in value.items()]) + b'}'
+    return bytes(json.dumps(value, cls=ModelEncoder), 'UTF-8')
@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import QueryStrategy, DelegatingQueryStrategy
+from departure_server.resilience import degraded
+
+__author__ = 'budde'
+
+
+class SharedCacheQueryStrategy(DelegatingQueryStrategy):
+    """
+    Caches the responses of a wrapped strategy in an SQLite database on disk, which is shared by every process
+    opening the same file. Thus the worker processes of the pre-fork mode warm one cache instead of one each.
+    Responses are stored as XML and parsed when read, so an in-process CachingQueryStrategy should be kept in front.
+    Degraded responses are never stored.
+    """
+    def __init__(self, strategy: QueryStrategy, path: str, ttl: float=30, nearby_ttl: float=300,
+                 prune_interval: int=1000, clock=time.time):
+        """
+        :param strategy: The wrapped strategy
+        :param path: The path of the database, created if missing
+        :param ttl: Seconds a departure board is served from the cache
+        :param nearby_ttl: Seconds the stations near a position are served from the cache
+        :param prune_interval: The number of writes between deletions of expired responses
+        :param clock: A function returning the current (wall clock) time in seconds, shared by the processes
+        """
+        super().__init__(strategy)
+        self.path = path
+        self.ttl = ttl
+        self.nearby_ttl = nearby_ttl
+        self.prune_interval = prune_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        connection = self._connection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                               '(key TEXT PRIMARY KEY, body BLOB NOT NULL, expires_at REAL NOT NULL)')
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        return self._cached('find_nearby:%d:%d:%d:%d' % (x, y, max_radius, max_number), self.nearby_ttl,
+                            lambda: self.strategy.find_nearby(x, y, max_radius, max_number))
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        return self._cached('departure_time:%d:%d:%d:%d' % (stop_id, use_bus, use_tog, use_metro), self.ttl,
+                            lambda: self.strategy.departure_time(stop_id, use_bus, use_tog, use_metro))
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary of the counters of this process
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return: The connection of the current thread. Connections are never shared between threads or processes.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def _cached(self, key: str, ttl: float, function) -> ElementTree.Element:
+        body = self._read(key)
+        if body is not None:
+            with self._lock:
+                self.hits += 1
+            return ElementTree.fromstring(body)
+        with self._lock:
+            self.misses += 1
+        element = function()
+        if not degraded(element):
+            self._write(key, ElementTree.tostring(element), ttl)
+        return element
+
+    def _read(self, key: str):
+        try:
+            row = self._connection().execute('SELECT body FROM responses WHERE key = ? AND expires_at > ?',
+                                             (key, self.clock())).fetchone()
+        except sqlite3.Error:
+            self._error()
+            return None
+        return None if row is None else row[0]
+
+    def _write(self, key: str, body: bytes, ttl: float):
+        now = self.clock()
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_interval == 0
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO responses (key, body, expires_at) VALUES (?, ?, ?)',
+                                   (key, body, now + ttl))
+                if prune:
+                    connection.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        except sqlite3.Error:
+            self._error()
+
+    def _error(self):
+        # The shared cache is an optimisation, so a locked or broken database only costs upstream calls
+        with self._lock:
+            self.errors += 1
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+from datetime import datetime
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import QueryStrategy, DelegatingQueryStrategy
+
+__author__ = 'budde'
+
+
+class _Call:
+    """
+    An in-flight call to the wrapped strategy
+    """
+    def __init__(self):
+        self.value = None
+        self.error = None
+        self.done = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        """
+        Calls the callback when the call is done. If the call already is done, the callback is called immediately.
+        :param callback: A function taking no arguments
+        :return:
+        """
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self, value, error):
+        with self._lock:
+            self.value = value
+            self.error = error
+            self.done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+        self._event.set()
+        for callback in callbacks:
+            callback()
+
+    def result(self):
+        self._event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _resolve_future(future: asyncio.Future, call: _Call):
+    if future.cancelled():
+        return
+    if call.error is not None:
+        future.set_exception(call.error)
+    else:
+        future.set_result(call.value)
+
+
+class SingleFlightQueryStrategy(DelegatingQueryStrategy):
+    """
+    Coalesces concurrent identical queries, such that only one query is in flight for each key.
+    Every caller waiting on an in-flight query receives the same element.
+    Threads block until the query is done, while the *_async methods await it without occupying a thread.
+    """
+    def __init__(self, strategy: QueryStrategy, executor=None):
+        """
+        :param strategy: The wrapped strategy
+        :param executor: The executor used for queries started by the *_async methods.
+                         None is the default executor of the event loop.
+        """
+        super().__init__(strategy)
+        self.executor = executor
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def find_nearby(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        return self._call(*self._find_nearby_call(x, y, max_radius, max_number))
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        return self._call(*self._departure_time_call(stop_id, use_bus, use_tog, use_metro))
+
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        return self._call(('departure_time_after', stop_id, after, bool(use_bus), bool(use_tog), bool(use_metro)),
+                          lambda: self.strategy.departure_time_after(stop_id, after, use_bus, use_tog, use_metro))
+
+    async def find_nearby_async(self, x: int, y: int, max_radius: int, max_number: int) -> ElementTree.Element:
+        return await self._call_async(*self._find_nearby_call(x, y, max_radius, max_number))
+
+    async def departure_time_async(self, stop_id: int, use_bus=True, use_tog=True,
+                                   use_metro=True) -> ElementTree.Element:
+        return await self._call_async(*self._departure_time_call(stop_id, use_bus, use_tog, use_metro))
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary with the number of upstream calls and the number of calls coalesced into these
+        """
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
+
+    def _find_nearby_call(self, x: int, y: int, max_radius: int, max_number: int):
+        return (('find_nearby', x, y, max_radius, max_number),
+                lambda: self.strategy.find_nearby(x, y, max_radius, max_number))
+
+    def _departure_time_call(self, stop_id: int, use_bus, use_tog, use_metro):
+        return (('departure_time', stop_id, bool(use_bus), bool(use_tog), bool(use_metro)),
+                lambda: self.strategy.departure_time(stop_id, use_bus, use_tog, use_metro))
+
+    def _join(self, key: tuple):
+        """
+        Joins the in-flight call with the given key or starts a new one
+        :param key: The query key
+        :return: A tuple with the call and whether the caller is responsible for running it
+        :rtype: (_Call, bool)
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            self._in_flight[key] = call = _Call()
+            self.calls += 1
+            return call, True
+
+    def _run(self, key: tuple, call: _Call, function):
+        value = error = None
+        try:
+            value = function()
+        except Exception as e:
+            error = e
+        with self._lock:
+            del self._in_flight[key]
+        call.finish(value, error)
+
+    def _call(self, key: tuple, function):
+        (call, leader) = self._join(key)
+        if leader:
+            self._run(key, call, function)
+        return call.result()
+
+    async def _call_async(self, key: tuple, function):
+        loop = asyncio.get_running_loop()
+        (call, leader) = self._join(key)
+        if leader:
+            loop.run_in_executor(self.executor, self._run, key, call, function)
+        future = loop.create_future()
+        call.add_done_callback(lambda: loop.call_soon_threadsafe(_resolve_future, future, call))
+        return await future
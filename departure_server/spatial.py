@@ -0,0 +1,220 @@
+import math
+import threading
+import time
+
+__author__ = 'budde'
+
+# Meters per micro-degree of latitude
+_METERS_PER_MICRO_DEGREE = 6371000 * math.pi / 180 / 1000000
+
+
+def distance(lat1: int, long1: int, lat2: int, long2: int) -> float:
+    """
+    Approximates the distance between two coordinates given in micro-degrees.
+    The approximation is precise for the short distances used when looking up nearby stations.
+    :return: The distance in meters
+    """
+    y = (lat2 - lat1) * _METERS_PER_MICRO_DEGREE
+    x = (long2 - long1) * _METERS_PER_MICRO_DEGREE * math.cos(math.radians((lat1 + lat2) / 2000000))
+    return math.sqrt(x * x + y * y)
+
+
+def meters_to_micro_degrees(meters: float, lat: int) -> (int, int):
+    """
+    Converts a distance in meters to micro-degrees of latitude and longitude at a given latitude
+    :return: A tuple of latitude and longitude micro-degrees
+    """
+    lat_delta = meters / _METERS_PER_MICRO_DEGREE
+    long_delta = lat_delta / max(math.cos(math.radians(lat / 1000000)), 0.01)
+    return int(math.ceil(lat_delta)), int(math.ceil(long_delta))
+
+
+class SpatialIndex:
+    """
+    A grid over stations keyed on their micro-degree coordinates.
+    The index keeps track of the covered areas, i.e. where all stations are known, and only answers
+    queries that are entirely within a covered circle or within covered cells. Areas stay covered for
+    `coverage_ttl` seconds, after which queries go upstream again and find stations added or removed since.
+    Circles spanning more than `max_cells` cells are neither answered nor marked, so the work of a query is bounded
+    regardless of its radius.
+    Only one station is kept for each position. Since station ids may change over time, a station with a new id at
+    an existing position replaces the old station.
+    """
+    def __init__(self, cell_size: int=1000, circle_cell_size: int=20000, max_cells: int=16384,
+                 coverage_ttl: float=3600, clock=time.monotonic):
+        """
+        :param cell_size: The size of a cell in micro-degrees
+        :param circle_cell_size: The size of the cells used for looking up covered circles in micro-degrees
+        :param max_cells: The maximum number of cells of a circle answered or marked as covered
+        :param coverage_ttl: Seconds an area marked as covered stays covered
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        self.cell_size = cell_size
+        self.circle_cell_size = circle_cell_size
+        self.max_cells = max_cells
+        self.coverage_ttl = coverage_ttl
+        self.clock = clock
+        self.complete = False
+        self._cells = {}
+        self._covered = {}
+        self._circles = {}
+        self._max_circle_radius = 0
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, station):
+        """
+        Adds a station to the index, replacing any station at the same position or with the same id
+        :type station: departure_server.station.Station
+        """
+        with self._lock:
+            self._add(station)
+
+    def add_all(self, stations: list):
+        with self._lock:
+            for station in stations:
+                self._add(station)
+
+    def mark_covered(self, lat: int, long: int, radius: int, stations: list=None):
+        """
+        Marks a circle, and the cells entirely within it, as covered
+        :param lat: The latitude of the center
+        :param long: The longitude of the center
+        :param radius: The radius in meters
+        :param stations: All stations within the circle, if known. Other stations of the index within the circle are
+                         removed, since they no longer exist upstream.
+        :type stations: list[departure_server.station.Station]
+        """
+        cells = self._cells_within(lat, long, radius)
+        if cells is None:
+            return
+        now = self.clock()
+        covered = {}
+        for (y, x) in cells:
+            corners = [((y + i) * self.cell_size, (x + j) * self.cell_size) for i in (0, 1) for j in (0, 1)]
+            if all(distance(lat, long, corner_lat, corner_long) <= radius for (corner_lat, corner_long) in corners):
+                covered[(y, x)] = now
+        with self._lock:
+            if stations is not None:
+                self._remove_missing(cells, lat, long, radius, set(station.id for station in stations))
+            self._covered.update(covered)
+            if self._covering_circle(lat, long, radius, now - self.coverage_ttl):
+                return
+            key = (lat // self.circle_cell_size, long // self.circle_cell_size)
+            self._circles.setdefault(key, []).append((lat, long, radius, now))
+            self._max_circle_radius = max(self._max_circle_radius, radius)
+
+    def mark_complete(self):
+        """
+        Marks the entire index as covered, e.g. after loading all stops
+        """
+        self.complete = True
+
+    def find_nearby(self, lat: int, long: int, radius: int, max_number: int):
+        """
+        Finds the stations within a radius, sorted by distance.
+        :param lat: The latitude of the center
+        :param long: The longitude of the center
+        :param radius: The radius in meters
+        :param max_number: The maximum number of stations returned
+        :return: A list of Stations or None if the area isn't covered by the index, or is too large
+        :rtype: list[departure_server.station.Station]
+        """
+        cells = self._cells_within(lat, long, radius)
+        if cells is None:
+            return None
+        found = []
+        covered_since = self.clock() - self.coverage_ttl
+        with self._lock:
+            if not self.complete and not self._covering_circle(lat, long, radius, covered_since) \
+                    and not all(self._covered.get(cell, covered_since) > covered_since
+                                for cell in self._cells_intersecting(cells, lat, long, radius)):
+                return None
+            for cell in cells:
+                for station in self._cells.get(cell, {}).values():
+                    d = distance(lat, long, station.pos.lat, station.pos.long)
+                    if d <= radius:
+                        found.append((d, station))
+        found.sort(key=lambda v: v[0])
+        return [station for (_, station) in found[:max_number]]
+
+    def _add(self, station):
+        position = (station.pos.lat, station.pos.long)
+        previous = self._positions.get(station.id)
+        if previous is not None and previous != position:
+            self._cell(*previous).pop(previous, None)
+        self._positions[station.id] = position
+        cell = self._cell(*position)
+        replaced = cell.get(position)
+        if replaced is not None and replaced.id != station.id:
+            del self._positions[replaced.id]
+        cell[position] = station
+
+    def _covering_circle(self, lat: int, long: int, radius: int, covered_since: float) -> bool:
+        """
+        Decides whether a circle is contained in a circle covered after a given time.
+        Circles covered before are dropped.
+        """
+        if radius > self._max_circle_radius:
+            return False
+        (lat_delta, long_delta) = meters_to_micro_degrees(self._max_circle_radius - radius, lat)
+        for y in range((lat - lat_delta) // self.circle_cell_size, (lat + lat_delta) // self.circle_cell_size + 1):
+            for x in range((long - long_delta) // self.circle_cell_size,
+                           (long + long_delta) // self.circle_cell_size + 1):
+                circles = self._circles.get((y, x))
+                if not circles:
+                    continue
+                if any(circle[3] <= covered_since for circle in circles):
+                    circles[:] = [circle for circle in circles if circle[3] > covered_since]
+                for (circle_lat, circle_long, circle_radius, _) in circles:
+                    if distance(lat, long, circle_lat, circle_long) + radius <= circle_radius:
+                        return True
+        return False
+
+    def _remove_missing(self, cells: list, lat: int, long: int, radius: int, ids: set):
+        """
+        Removes the stations within a circle which aren't among the given ids
+        """
+        for cell in cells:
+            stations = self._cells.get(cell)
+            if not stations:
+                continue
+            for (position, station) in list(stations.items()):
+                if station.id not in ids and distance(lat, long, position[0], position[1]) <= radius:
+                    del stations[position]
+                    del self._positions[station.id]
+
+    def _cells_intersecting(self, cells: list, lat: int, long: int, radius: int) -> list:
+        """
+        Filters the cells intersecting a circle
+        """
+        intersecting = []
+        for (y, x) in cells:
+            nearest_lat = min(max(lat, y * self.cell_size), (y + 1) * self.cell_size)
+            nearest_long = min(max(long, x * self.cell_size), (x + 1) * self.cell_size)
+            if distance(lat, long, nearest_lat, nearest_long) <= radius:
+                intersecting.append((y, x))
+        return intersecting
+
+    def _cell(self, lat: int, long: int) -> dict:
+        key = (lat // self.cell_size, long // self.cell_size)
+        cell = self._cells.get(key)
+        if cell is None:
+            self._cells[key] = cell = {}
+        return cell
+
+    def _cells_within(self, lat: int, long: int, radius: int):
+        """
+        :return: The cells of the bounding box of a circle, or None if there are more than max_cells
+        """
+        (lat_delta, long_delta) = meters_to_micro_degrees(radius, lat)
+        rows = (lat + lat_delta) // self.cell_size - (lat - lat_delta) // self.cell_size + 1
+        columns = (long + long_delta) // self.cell_size - (long - long_delta) // self.cell_size + 1
+        if rows * columns > self.max_cells:
+            return None
+        return [(y, x)
+                for y in range((lat - lat_delta) // self.cell_size, (lat + lat_delta) // self.cell_size + 1)
+                for x in range((long - long_delta) // self.cell_size, (long + long_delta) // self.cell_size + 1)]
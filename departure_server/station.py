@@ -1,12 +1,25 @@
-from datetime import datetime
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from sys import intern
 from xml.etree import ElementTree
 
+from departure_server.departure_parser import departures_from_element, parse_datetime
+from departure_server.metrics import stage
 from departure_server.query_strategy import QueryStrategy
+from departure_server.registry import StationRegistry
+from departure_server.resilience import degraded
+from departure_server.spatial import SpatialIndex
+from departure_server.tiles import TileCache
 
 __author__ = 'budde'
 
+_model_stage = stage('model')
+
 
 class Position:
+    __slots__ = ('lat', 'long')
+
     def __init__(self, lat: int, long: int):
         self.lat = lat
         self.long = long
@@ -18,17 +31,34 @@ class Position:
         return not self == other
 
 
+class Degraded(list):
+    """
+    A list of stations or departures which is missing results the upstream failed to deliver.
+    It is served like any other list, but shouldn't be cached.
+    """
+    __slots__ = ()
+
+
 class Station:
+    """
+    A model of a station.
+    Stations are kept in large numbers, so instances have no __dict__ and names are interned.
+    """
+    __slots__ = ('library', 'id', 'name', 'pos')
+
     def __init__(self, library, station_id: int, name: str, pos: Position):
         """
         :type library: StationLibrary
         """
         self.library = library
-        self.query_strategy = library.query_strategy
         self.id = station_id
-        self.name = name
+        self.name = intern(name)
         self.pos = pos
 
+    @property
+    def query_strategy(self) -> QueryStrategy:
+        return self.library.query_strategy
+
     def departures(self) -> list:
         """
         Lists the departures
@@ -36,29 +66,61 @@ class Station:
         :rtype: list[Departure]
         """
         element = self.query_strategy.departure_time(self.id)
-        return \
-            list(
-                sorted(
-                    filter(lambda v: v is not None,
-                           map(self.__departure_from_xml, list(element))),
-                    key=lambda d: d.date))
-
-    def __departure_from_xml(self, element: ElementTree.Element):
+        if degraded(element):
+            return Degraded()
+        with _model_stage.time():
+            departures = departures_from_element(self, element)
+            departures.sort(key=lambda d: d.date)
+        return departures
+
+    def departure_stream(self, after: datetime=None, max_boards: int=10, on_degraded=None):
         """
-        Creates a Departure instance from a ElementTree.Element
-        :param element:
-        :return:
-        :rtype: Departure
+        Lazily merges successive departure boards into one sorted stream of departures.
+        A board is only fetched when the departures of the previous boards are used up. The next board starts at the
+        latest scheduled time of the previous board, so departures up to that time are complete and can be yielded.
+        Departures repeated by the overlapping boards are yielded once.
+        Every departure is yielded with the start of the earliest board of a departure not yet yielded, itself
+        included. A stream started there yields the departure and every later one, even if delayed departures were
+        scheduled before it. None is the start of the first board when started now.
+        :param after: The scheduled time of the first board. Defaults to now
+        :param max_boards: The maximum number of boards fetched
+        :param on_degraded: An optional function called with the scheduled time of a board the upstream failed to
+                            deliver, which ends the stream early
+        :return: An iterator of (departure, start) tuples sorted by the date of the departures
         """
-        if 'cancelled' in element.attrib and element.attrib['cancelled'] != 'false':
-            return None
-
-        (hour, minute) = element.attrib['rtTime' if 'rtTime' in element.attrib else 'time'].split(':')
-        (d, m, y) = element.attrib['rtDate' if 'rtDate' in element.attrib else 'date'].split('.')
-        direction = element.attrib['direction'] if 'direction' in element.attrib else ''
-
-        return Departure(self, element.attrib['name'], element.attrib['type'],
-                         datetime(int(y) + 2000, int(m), int(d), int(hour), int(minute)), direction)
+        strategy = self.query_strategy
+        board_start = after
+        element = strategy.departure_time(self.id) if after is None else strategy.departure_time_after(self.id, after)
+        pending = []
+        seen = set()
+        order = itertools.count()
+        for boards in itertools.count(1):
+            if degraded(element) and on_degraded is not None:
+                on_degraded(board_start)
+            if len(element) == 0:
+                break
+            for departure in departures_from_element(self, element):
+                key = (departure.name, departure.departure_type, departure.direction, departure.date)
+                if key not in seen:
+                    seen.add(key)
+                    heapq.heappush(pending, (departure.date, next(order), departure, board_start))
+            horizon = max(parse_datetime(child.get('date'), child.get('time')) for child in element)
+            while pending and pending[0][0] < horizon:
+                yield self._pop_pending(pending)
+            if boards >= max_boards:
+                break
+            # A board full of departures at the same minute would be fetched forever, so it is skipped past
+            after = horizon if after is None or horizon > after else after + timedelta(minutes=1)
+            board_start = after
+            element = strategy.departure_time_after(self.id, after)
+        while pending:
+            yield self._pop_pending(pending)
+
+    @staticmethod
+    def _pop_pending(pending: list) -> tuple:
+        starts = [entry[3] for entry in pending]
+        start = None if None in starts else min(starts)
+        return heapq.heappop(pending)[2], start
 
     def __eq__(self, other):
         return isinstance(other, Station) and self.id == other.id and self.name == other.name and self.pos == other.pos
@@ -68,32 +130,92 @@ class Station:
 
 
 class StationLibrary:
-    def __init__(self, query_strategy: QueryStrategy):
+    def __init__(self, query_strategy: QueryStrategy, index: SpatialIndex=None, registry: StationRegistry=None,
+                 tiles: TileCache=None):
+        """
+        :param query_strategy: The strategy used for querying stations and departures
+        :param index: An optional spatial index used for answering find_nearby locally when possible
+        :param registry: An optional registry of the stations seen, used for creating stations from ids
+        :param tiles: An optional tile cache used for answering find_nearby from tiles shared by nearby queries
+        """
         self.query_strategy = query_strategy
+        self.index = index
+        self.registry = registry
+        self.tiles = tiles
 
     def find_nearby(self, pos: Position, radius: int=100) -> list:
         """
         Finds stations near a given position (within a radius).
-        Maximum 50 stations are returned
+        Maximum 50 stations are returned. The spatial index is tried first, then the tile cache, and then the query
+        strategy is queried for the exact circle.
         :param pos: The position
         :param radius: The radius
         :return: A list of Stations
         :rtype: list[Station]
         """
-        element = self.query_strategy.find_nearby(pos.lat, pos.long, radius, 50)
-        return list(map(self.__station_from_xml, list(element)))
+        if self.index is not None:
+            stations = self.index.find_nearby(pos.lat, pos.long, radius, 50)
+            if stations is not None:
+                return stations
+        if self.tiles is not None:
+            stations = self.tiles.find_nearby(pos.lat, pos.long, radius, 50, self.__query_nearby)
+            if stations is not None:
+                return stations
+        return self.__query_nearby(pos.lat, pos.long, radius, 50)[0]
+
+    def load_stops(self, path: str):
+        """
+        Loads a dump of all stops into the index. The dump is a LocationList of StopLocation elements,
+        i.e. the format returned by stopsNearby.
+        :param path: The path of the dump
+        :return:
+        """
+        if self.index is None:
+            self.index = SpatialIndex()
+        stations = list(map(self.__station_from_xml, list(ElementTree.parse(path).getroot())))
+        self.__record(stations)
+        self.index.add_all(stations)
+        self.index.mark_complete()
 
     def station_from_id(self, station_id: int) -> Station:
         """
         Returns a station from a given id.
         A station instance is returned regardless of the existence of the id
-        The position and name doesn't need to be correct
+        If the station is known by the registry, it has the current id, name, and position of the station.
+        Otherwise the position and name aren't correct
         :param station_id: An integer id
         :return: A Station
         :rtype: Station
         """
+        if self.registry is not None:
+            known = self.registry.get(station_id)
+            if known is not None:
+                return Station(self, known[0], known[1], Position(known[2], known[3]))
         return Station(self, station_id, "", Position(0, 0))
 
+    def __query_nearby(self, lat: int, long: int, radius: int, max_number: int) -> (list, bool):
+        """
+        Queries the stations within a circle and adds them to the index and registry
+        :return: A tuple with the list of stations and whether it has every station within the circle
+        """
+        element = self.query_strategy.find_nearby(lat, long, radius, max_number)
+        if degraded(element):
+            return Degraded(), False
+        with _model_stage.time():
+            stations = list(map(self.__station_from_xml, list(element)))
+        self.__record(stations)
+        complete = len(stations) < max_number
+        if self.index is not None:
+            self.index.add_all(stations)
+            if complete:
+                self.index.mark_covered(lat, long, radius, stations)
+        return stations, complete
+
+    def __record(self, stations: list):
+        if self.registry is not None:
+            self.registry.record([(station.id, station.name, station.pos.lat, station.pos.long)
+                                  for station in stations])
+
     def __station_from_xml(self, element: ElementTree.Element):
         """
         Creates a station given a ElementTree Element.
@@ -108,14 +230,16 @@ class StationLibrary:
 
 class Departure:
     """
-    A model of a departure
+    A model of a departure. Names, types, and directions are interned since they repeat across boards.
     """
+    __slots__ = ('station', 'name', 'departure_type', 'date', 'direction')
+
     def __init__(self, station: Station, name: str, departure_type: str, date: datetime, direction: str=""):
         self.station = station
-        self.name = name
-        self.departure_type = departure_type
+        self.name = intern(name)
+        self.departure_type = intern(departure_type)
         self.date = date
-        self.direction = direction
+        self.direction = intern(direction)
 
     def __eq__(self, other):
         return isinstance(other, Departure) and other.station == self.station and other.name == self.name \
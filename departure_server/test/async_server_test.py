@@ -0,0 +1,156 @@
+import asyncio
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from departure_server.async_server import AsyncServer
+from departure_server.metrics import SamplingProfiler, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker
+from departure_server.rest import RESTHandler
+
+__author__ = 'budde'
+
+
+class TestAsyncServer(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'index.html'), 'w') as file:
+            file.write('<html></html>')
+        os.mkdir(os.path.join(self.directory, 'empty'))
+        self.query_strategy = StubQueryStrategy()
+        self.server = AsyncServer(RESTHandler(self.query_strategy), self.directory)
+        self.loop = asyncio.new_event_loop()
+        self.listener = self.loop.run_until_complete(self.server.start('localhost', 0))
+        self.port = self.listener.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.connection = http.client.HTTPConnection('localhost', self.port, timeout=5)
+
+    def tearDown(self):
+        self.connection.close()
+        # The listener belongs to the loop, which runs in another thread
+        self.loop.call_soon_threadsafe(self.listener.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+        self.server.executor.shutdown()
+        shutil.rmtree(self.directory)
+
+    def get(self, path: str) -> http.client.HTTPResponse:
+        self.connection.request('GET', path)
+        return self.connection.getresponse()
+
+    def test_api_call(self):
+        response = self.get('/api/1.0/Stations/findNearby?lat=1&long=2&radius=100')
+        self.assertEqual(200, response.status)
+        self.assertEqual(8600626, json.loads(response.read().decode('UTF-8'))[0]['id'])
+        self.assertEqual([('find_nearby', [1, 2, 100, 50])], self.query_strategy.called)
+
+    def test_unknown_api_call_is_bad_request(self):
+        response = self.get('/api/2.0/Nothing')
+        response.read()
+        self.assertEqual(400, response.status)
+
+    def test_invalid_parameter_is_bad_request(self):
+        response = self.get('/api/1.0/Stations/departures/1/?cursor=garbage')
+        response.read()
+        self.assertEqual(400, response.status)
+        response = self.get('/api/1.0/Stations/departures/abc')
+        response.read()
+        self.assertEqual(400, response.status)
+
+    def test_metrics(self):
+        self.get('/api/1.0/Stations/departures/1/').read()
+        response = self.get('/metrics')
+        body = response.read()
+        self.assertEqual(200, response.status)
+        self.assertEqual(METRICS_CONTENT_TYPE, response.getheader('Content-Type'))
+        self.assertIn(b'departure_server_request_seconds_count{route="1.0/Stations/departures/*/"}', body)
+        self.assertIn(b'departure_server_stage_seconds_count{stage="encode"}', body)
+        self.assertIn(b'departure_server_stage_seconds_count{stage="model"}', body)
+
+    def test_metrics_are_labelled_by_route(self):
+        self.get('/api/1.0/Stations/findNearby/random-junk?lat=1&long=2&radius=100').read()
+        self.get('/api/1.0/Stations/departures/17').read()
+        body = self.get('/metrics').read()
+        self.assertIn(b'route="1.0/Stations/findNearby"', body)
+        self.assertIn(b'route="1.0/Stations/departures/*/"', body)
+        self.assertNotIn(b'junk', body)
+        self.assertNotIn(b'departures/*"', body)
+
+    def test_profiler_is_off_by_default(self):
+        response = self.get('/debug/profile?seconds=0.01')
+        response.read()
+        self.assertEqual(404, response.status)
+
+    def test_profile(self):
+        self.server.profiler = SamplingProfiler(interval=0.001)
+        response = self.get('/debug/profile?seconds=0.05')
+        self.assertEqual(200, response.status)
+        self.assertIn(b'run_forever', response.read())
+
+    def test_static_files(self):
+        response = self.get('/')
+        self.assertEqual(b'<html></html>', response.read())
+        self.assertEqual('text/html', response.getheader('Content-Type'))
+        response = self.get('/empty/')
+        response.read()
+        self.assertEqual(404, response.status)
+        response = self.get('/../index.html')
+        self.assertEqual(b'<html></html>', response.read())
+
+    def test_conditional_api_call(self):
+        response = self.get('/api/1.0/Stations/findNearby?lat=1&long=2&radius=100')
+        response.read()
+        self.assertEqual('max-age=300', response.getheader('Cache-Control'))
+        self.connection.request('GET', '/api/1.0/Stations/findNearby?lat=1&long=2&radius=100',
+                                headers={'If-None-Match': response.getheader('ETag')})
+        response = self.connection.getresponse()
+        self.assertEqual(b'', response.read())
+        self.assertEqual(304, response.status)
+        self.assertEqual(1, len(self.query_strategy.called))
+
+    def test_degraded_api_call_is_not_cached(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.failure()
+        library = self.server.rest_handler.library
+        library.query_strategy = ResilientQueryStrategy(self.query_strategy, breaker=breaker)
+        try:
+            for _ in range(2):
+                response = self.get('/api/1.0/Stations/findNearby?lat=1&long=2&radius=100')
+                self.assertEqual(b'[]', response.read())
+                self.assertEqual('no-cache', response.getheader('Cache-Control'))
+        finally:
+            library.query_strategy.executor.shutdown()
+
+    def test_static_files_are_cached(self):
+        response = self.get('/')
+        response.read()
+        self.assertTrue(response.getheader('Cache-Control').startswith('public, max-age='))
+        self.connection.request('GET', '/', headers={'If-Modified-Since': response.getheader('Last-Modified')})
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(304, response.status)
+
+    def test_live_departures_are_streamed(self):
+        response = self.get('/api/1.0/Stations/departures/8600626/live')
+        self.assertEqual('text/event-stream', response.getheader('Content-Type'))
+        self.assertEqual(b'event: departures\n', response.fp.readline())
+        data = json.loads(response.fp.readline()[len(b'data: '):].decode('UTF-8'))
+        self.assertEqual(3, len(data['new']))
+
+    def test_connection_is_kept_alive(self):
+        self.get('/').read()
+        socket = self.connection.sock
+        self.get('/api/1.0/Stations/departures/1').read()
+        self.assertIs(socket, self.connection.sock)
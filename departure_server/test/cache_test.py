@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+from departure_server.cache import CachingQueryStrategy
+from departure_server.query_strategy import StubQueryStrategy
+
+__author__ = 'budde'
+
+
+class TestCachingQueryStrategy(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.background = []
+        self.query_strategy = StubQueryStrategy()
+        self.cache = CachingQueryStrategy(self.query_strategy, ttl=10, stale_ttl=20, max_size=2,
+                                          clock=lambda: self.time, run_in_background=self.background.append)
+
+    def test_fresh_board_is_served_from_cache(self):
+        first = self.cache.departure_time(1)
+        self.time = 10
+        self.assertIs(first, self.cache.departure_time(1))
+        self.assertEqual([('departure_time', [1, True, True, True])], self.query_strategy.called)
+        self.assertEqual(1, self.cache.stats()['hits'])
+        self.assertEqual(1, self.cache.stats()['misses'])
+
+    def test_key_includes_transport_types(self):
+        self.cache.departure_time(1)
+        self.cache.departure_time(1, use_bus=False)
+        self.assertEqual(2, len(self.query_strategy.called))
+
+    def test_stale_board_is_served_while_refreshing_once(self):
+        self.cache.departure_time(1)
+        self.time = 15
+        self.cache.departure_time(1)
+        self.cache.departure_time(1)
+        self.assertEqual(1, len(self.query_strategy.called))
+        self.assertEqual(1, len(self.background))
+        self.background[0]()
+        self.assertEqual(2, len(self.query_strategy.called))
+        self.assertEqual(1, self.cache.stats()['refreshes'])
+        self.assertEqual(2, self.cache.stats()['stale_hits'])
+        self.cache.departure_time(1)
+        self.assertEqual(1, self.cache.stats()['hits'])
+
+    def test_expired_board_is_fetched(self):
+        self.cache.departure_time(1)
+        self.time = 31
+        self.cache.departure_time(1)
+        self.assertEqual(2, len(self.query_strategy.called))
+        self.assertEqual([], self.background)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.departure_time(1)
+        self.cache.departure_time(2)
+        self.cache.departure_time(1)
+        self.cache.departure_time(3)
+        self.query_strategy.called = []
+        self.cache.departure_time(1)
+        self.cache.departure_time(2)
+        self.assertEqual([('departure_time', [2, True, True, True])], self.query_strategy.called)
+        self.assertEqual(2, self.cache.stats()['evictions'])
+
+    def test_find_nearby_is_forwarded(self):
+        self.cache.find_nearby(1, 2, 3, 4)
+        self.assertEqual([('find_nearby', [1, 2, 3, 4])], self.query_strategy.called)
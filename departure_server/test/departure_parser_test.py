@@ -0,0 +1,27 @@
+from datetime import datetime
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from departure_server.departure_parser import departures_from_element, parse_datetime
+from departure_server.query_strategy import StubQueryStrategy, _departure
+from departure_server.station import StationLibrary, Departure
+
+__author__ = 'budde'
+
+
+class TestDepartureParser(TestCase):
+    def setUp(self):
+        self.station = StationLibrary(StubQueryStrategy()).station_from_id(8600626)
+        self.data = bytes(_departure, 'UTF-8')
+        self.expected = [
+            Departure(self.station, "Re 2221", "REG", datetime(2015, 7, 8, 10, 20), "Nykøbing F St."),
+            Departure(self.station, "ØR 2037", "TOG", datetime(2015, 7, 7, 10, 12)),
+            Departure(self.station, "ØR 1036", "TOG", datetime(2015, 7, 7, 10, 12), 'Hässleholm C og Kalmar C')
+        ]
+
+    def test_parse_datetime(self):
+        self.assertEqual(datetime(2015, 12, 24, 9, 5), parse_datetime('24.12.15', '09:05'))
+
+    def test_departures_from_element(self):
+        self.assertEqual(self.expected, departures_from_element(self.station, ElementTree.fromstring(self.data)))
+
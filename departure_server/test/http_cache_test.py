@@ -0,0 +1,106 @@
+import http.client
+import threading
+from unittest import TestCase
+
+from departure_server.http_cache import ResponseCache, etag, etag_matches
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.request_handler import setup_handler, ThreadedHTTPServer
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker
+
+__author__ = 'budde'
+
+
+class TestETag(TestCase):
+    def test_etag_is_strong_and_stable(self):
+        self.assertEqual(etag(b'[]'), etag(b'[]'))
+        self.assertNotEqual(etag(b'[]'), etag(b'{}'))
+        self.assertTrue(etag(b'[]').startswith('"'))
+
+    def test_etag_matches(self):
+        tag = etag(b'[]')
+        self.assertTrue(etag_matches(tag, tag))
+        self.assertTrue(etag_matches('"a", W/%s' % tag, tag))
+        self.assertTrue(etag_matches('*', tag))
+        self.assertFalse(etag_matches('"a"', tag))
+        self.assertFalse(etag_matches(None, tag))
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.cache = ResponseCache({'departures': 15, 'findNearby': 300}, max_size=2, clock=lambda: self.time)
+
+    def test_max_age_by_function(self):
+        self.assertEqual(15, self.cache.max_age('/api/1.0/Stations/departures/123'))
+        self.assertEqual(300, self.cache.max_age('/api/1.0/Stations/findNearby?lat=1&long=2&radius=3'))
+        self.assertEqual(0, self.cache.max_age('/api/1.0/Other'))
+
+    def test_fresh_responses_are_remembered(self):
+        response = self.cache.store('/api/1.0/Stations/departures/1', b'[]')
+        self.time = 10
+        self.assertIs(response, self.cache.lookup('/api/1.0/Stations/departures/1'))
+        self.assertEqual([('Cache-Control', 'max-age=5'), ('ETag', etag(b'[]'))], self.cache.headers(response))
+        self.time = 15
+        self.assertIsNone(self.cache.lookup('/api/1.0/Stations/departures/1'))
+
+    def test_uncacheable_responses_are_not_remembered(self):
+        response = self.cache.store('/api/1.0/Other', b'[]')
+        self.assertEqual([('Cache-Control', 'no-cache'), ('ETag', etag(b'[]'))], self.cache.headers(response))
+        self.assertIsNone(self.cache.lookup('/api/1.0/Other'))
+
+    def test_degraded_responses_are_not_remembered(self):
+        response = self.cache.store('/api/1.0/Stations/departures/1', b'[]', degraded=True)
+        self.assertEqual([('Cache-Control', 'no-cache'), ('ETag', etag(b'[]'))], self.cache.headers(response))
+        self.assertIsNone(self.cache.lookup('/api/1.0/Stations/departures/1'))
+
+
+class TestCustomRequestHandlerCaching(TestCase):
+    def setUp(self):
+        self.query_strategy = StubQueryStrategy()
+        handler = setup_handler(self.query_strategy)
+        handler.log_message = lambda *args: None
+        self.server = ThreadedHTTPServer(('localhost', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(5)
+
+    def get(self, path: str, headers: dict=None) -> (http.client.HTTPResponse, bytes):
+        connection = http.client.HTTPConnection('localhost', self.server.server_address[1], timeout=5)
+        connection.request('GET', path, headers=headers or {})
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+        return response, body
+
+    def test_conditional_request_is_not_modified(self):
+        (response, body) = self.get('/api/1.0/Stations/departures/1')
+        self.assertEqual(200, response.status)
+        self.assertEqual('max-age=15', response.getheader('Cache-Control'))
+        self.assertEqual(etag(body), response.getheader('ETag'))
+        (response, body) = self.get('/api/1.0/Stations/departures/1', {'If-None-Match': etag(body)})
+        self.assertEqual(304, response.status)
+        self.assertEqual(b'', body)
+        self.assertEqual(1, len(self.query_strategy.called))
+
+    def test_invalid_parameter_is_bad_request(self):
+        (response, _) = self.get('/api/1.0/Stations/departures/1/?cursor=garbage')
+        self.assertEqual(400, response.status)
+        (response, _) = self.get('/api/1.0/Stations/departures/abc/live')
+        self.assertEqual(400, response.status)
+
+    def test_degraded_result_is_not_cached(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.failure()
+        library = self.server.RequestHandlerClass.__REST_HANDLER__.library
+        library.query_strategy = ResilientQueryStrategy(self.query_strategy, breaker=breaker)
+        try:
+            for _ in range(2):
+                (response, body) = self.get('/api/1.0/Stations/departures/1')
+                self.assertEqual((200, b'[]'), (response.status, body))
+                self.assertEqual('no-cache', response.getheader('Cache-Control'))
+        finally:
+            library.query_strategy.executor.shutdown()
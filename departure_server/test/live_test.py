@@ -0,0 +1,109 @@
+import http.client
+import http.server
+import json
+import threading
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from departure_server.live import board_from_element, board_diff, DepartureHub
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.request_handler import setup_handler
+from departure_server.station import StationLibrary
+
+__author__ = 'budde'
+
+
+def board(*departures: str) -> ElementTree.Element:
+    return ElementTree.fromstring('<DepartureBoard>%s</DepartureBoard>' % ''.join(
+        '<Departure name="%s" type="BUS" time="10:00" date="07.07.15" %s/>' % departure for departure in departures))
+
+
+class TestBoardDiff(TestCase):
+    def setUp(self):
+        self.station = StationLibrary(StubQueryStrategy()).station_from_id(1)
+
+    def diff(self, previous: ElementTree.Element, current: ElementTree.Element) -> dict:
+        diff = board_diff(board_from_element(self.station, previous), board_from_element(self.station, current))
+        return {kind: [d.name for d in departures] for (kind, departures) in diff.items()}
+
+    def test_diff(self):
+        previous = board(('A', ''), ('B', ''), ('C', ''), ('D', ''))
+        current = board(('A', ''), ('B', 'rtTime="10:05" rtDate="07.07.15"'), ('C', 'cancelled="true"'), ('E', ''))
+        self.assertEqual({'new': ['E'], 'changed': ['B'], 'cancelled': ['C'], 'removed': ['D']},
+                         self.diff(previous, current))
+
+    def test_cancelled_departures_are_not_new(self):
+        self.assertEqual({'new': ['A'], 'changed': [], 'cancelled': [], 'removed': []},
+                         self.diff(board(), board(('A', ''), ('B', 'cancelled="true"'))))
+
+
+class TestDepartureHub(TestCase):
+    def setUp(self):
+        self.query_strategy = StubQueryStrategy()
+        self.hub = DepartureHub(StationLibrary(self.query_strategy), interval=0.01)
+        self.events = []
+        self.received = threading.Semaphore(0)
+
+    def callback(self, data: bytes):
+        self.events.append(json.loads(data.decode('UTF-8')))
+        self.received.release()
+
+    def test_subscribers_share_one_poller(self):
+        unsubscribe = [self.hub.subscribe(8600626, self.callback) for i in range(3)]
+        for i in range(3):
+            self.assertTrue(self.received.acquire(timeout=5))
+        self.assertEqual({8600626: 3}, self.hub.watched())
+        self.query_strategy.departure = board()
+        for i in range(3):
+            self.assertTrue(self.received.acquire(timeout=5))
+        for u in unsubscribe:
+            u()
+        self.assertEqual({}, self.hub.watched())
+        self.assertEqual(3, len(self.events[0]['new']))
+        self.assertEqual(3, len(self.events[-1]['removed']))
+        polls = len(self.query_strategy.called)
+        self.assertLess(polls, len(self.events) * 3)
+
+    def test_late_subscriber_receives_board(self):
+        unsubscribe = self.hub.subscribe(8600626, lambda data: self.received.release())
+        self.assertTrue(self.received.acquire(timeout=5))
+        self.hub.subscribe(8600626, self.callback)()
+        unsubscribe()
+        self.assertEqual(3, len(self.events[0]['new']))
+
+
+    def test_failing_subscriber_is_unsubscribed(self):
+        def fail(data: bytes):
+            self.received.release()
+            raise BrokenPipeError()
+
+        self.hub.subscribe(8600626, fail)
+        unsubscribe = self.hub.subscribe(8600626, self.callback)
+        for i in range(2):
+            self.assertTrue(self.received.acquire(timeout=5))
+        self.assertEqual({8600626: 1}, self.hub.watched())
+        self.query_strategy.departure = board()
+        self.assertTrue(self.received.acquire(timeout=5))
+        unsubscribe()
+        self.assertEqual({}, self.hub.watched())
+        self.assertEqual(3, len(self.events[-1]['removed']))
+
+
+class TestLiveInSyncServer(TestCase):
+    def test_live_is_refused(self):
+        class QuietHandler(setup_handler(StubQueryStrategy())):
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('localhost', 0), QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.start()
+        try:
+            connection = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+            connection.request('GET', '/api/1.0/Stations/departures/1/live')
+            self.assertEqual(501, connection.getresponse().status)
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join(5)
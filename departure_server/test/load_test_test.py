@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from departure_server.benchmark.load_test import percentile, summarize, replay_targets
+from departure_server.query_strategy import RejseplanenQueryStrategy
+from departure_server.recording import RecordingPool
+
+__author__ = 'budde'
+
+
+class EmptyPool:
+    def __init__(self):
+        self.connections_opened = 0
+        self.requests = 0
+
+    def get(self, address: str) -> bytes:
+        return b'<Empty/>'
+
+    def close(self):
+        pass
+
+
+class TestPercentile(TestCase):
+    def test_nearest_rank(self):
+        values = [1, 2, 3, 4, 5]
+        self.assertEqual(1, percentile(values, 0))
+        self.assertEqual(1, percentile(values, 20))
+        self.assertEqual(2, percentile(values, 21))
+        self.assertEqual(3, percentile(values, 50))
+        self.assertEqual(5, percentile(values, 95))
+        self.assertEqual(5, percentile(values, 100))
+
+    def test_exact_ranks_are_not_rounded_up(self):
+        values = list(range(1, 101))
+        self.assertEqual(95, percentile(values, 95))
+        self.assertEqual(99, percentile(values, 99))
+
+    def test_no_values(self):
+        self.assertIsNone(percentile([], 50))
+
+
+class TestSummarize(TestCase):
+    def test_summary(self):
+        results = [('departures', 0.004, 200), ('departures', 0.001, 200), ('findNearby', 0.003, 400),
+                   ('static', 0.002, None), ('departures', 0.005, 304)]
+        self.assertEqual({'requests': 5, 'errors': 2, 'rps': 2.5, 'p50_ms': 3.0, 'p95_ms': 5.0, 'p99_ms': 5.0,
+                          'max_ms': 5.0}, summarize(results, 2))
+
+    def test_no_results(self):
+        self.assertEqual({'requests': 0, 'errors': 0, 'rps': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+                          'max_ms': None}, summarize([], 1))
+
+
+class TestReplayTargets(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_targets_of_recorded_queries(self):
+        pool = RecordingPool(EmptyPool(), self.path)
+        strategy = RejseplanenQueryStrategy(None, pool=pool)
+        strategy.find_nearby(55673063, 12565796, 1000, 50)
+        strategy.departure_time(8600626)
+        strategy.departure_time_after(8600626, datetime(2015, 7, 1, 12, 30))
+        pool.close()
+        self.assertEqual([('findNearby', '/api/1.0/Stations/findNearby?lat=55673063&long=12565796&radius=1000'),
+                          ('departures', '/api/1.0/Stations/departures/8600626/')], replay_targets(self.path))
@@ -0,0 +1,75 @@
+import threading
+import time
+from unittest import TestCase
+
+from departure_server.metrics import Histogram, Registry, SamplingProfiler
+
+__author__ = 'budde'
+
+
+class TestHistogram(TestCase):
+    def test_snapshot_is_cumulative(self):
+        histogram = Histogram((0.1, 1))
+        for value in [0.05, 0.5, 0.7, 3]:
+            histogram.observe(value)
+        (buckets, count, total) = histogram.snapshot()
+        self.assertEqual([(0.1, 1), (1, 3), (float('inf'), 4)], buckets)
+        self.assertEqual(4, count)
+        self.assertAlmostEqual(4.25, total)
+
+    def test_time_observes_duration(self):
+        histogram = Histogram()
+        with histogram.time():
+            pass
+        self.assertEqual(1, histogram.count)
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = Registry('test')
+
+    def test_histograms_are_exposed(self):
+        family = self.registry.histogram('seconds', 'Seconds', 'stage', (0.5,))
+        family.labels('parse').observe(0.25)
+        self.assertEqual(b'# HELP test_seconds Seconds\n'
+                         b'# TYPE test_seconds histogram\n'
+                         b'test_seconds_bucket{stage="parse",le="0.5"} 1\n'
+                         b'test_seconds_bucket{stage="parse",le="+Inf"} 1\n'
+                         b'test_seconds_sum{stage="parse"} 0.25\n'
+                         b'test_seconds_count{stage="parse"} 1\n', self.registry.expose())
+
+    def test_numeric_values_of_collectors_are_gauges(self):
+        self.registry.add_collector('cache', lambda: {'hits': 3, 'state': 'open', 'ratio': 0.5})
+        self.assertEqual(b'# TYPE test_cache_hits gauge\ntest_cache_hits 3\n'
+                         b'# TYPE test_cache_ratio gauge\ntest_cache_ratio 0.5\n', self.registry.expose())
+
+    def test_label_values_are_escaped(self):
+        self.registry.histogram('seconds', 'Seconds', 'route', (1,)).labels('a"b').observe(0)
+        self.assertIn(b'route="a\\"b"', self.registry.expose())
+
+
+class TestSamplingProfiler(TestCase):
+    def test_stacks_of_other_threads_are_counted(self):
+        stopped = threading.Event()
+
+        def busy_waiting():
+            while not stopped.is_set():
+                time.sleep(0.001)
+
+        thread = threading.Thread(target=busy_waiting)
+        thread.start()
+        try:
+            profile = SamplingProfiler(interval=0.001).profile(0.05)
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertIn(b'busy_waiting', profile)
+
+    def test_one_profile_at_a_time(self):
+        profiler = SamplingProfiler(interval=0.001)
+        thread = threading.Thread(target=profiler.profile, args=(0.2,))
+        thread.start()
+        time.sleep(0.05)
+        with self.assertRaises(RuntimeError):
+            profiler.profile(0.01)
+        thread.join()
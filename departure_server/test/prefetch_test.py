@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from departure_server.cache import CachingQueryStrategy
+from departure_server.prefetch import PrefetchScheduler
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.rate_limit import TokenBucket
+
+__author__ = 'budde'
+
+
+class FailingQueryStrategy(StubQueryStrategy):
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True):
+        raise ConnectionError()
+
+
+class TestPrefetchScheduler(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.query_strategy = StubQueryStrategy()
+        self.cache = CachingQueryStrategy(self.query_strategy, ttl=10, stale_ttl=20, clock=lambda: self.time,
+                                          run_in_background=lambda function: None)
+        self.scheduler = PrefetchScheduler(self.cache, top=2, half_life=60, min_interval=8, max_interval=10,
+                                           clock=lambda: self.time)
+
+    def request(self, stop_id: int, times: int=1):
+        for _ in range(times):
+            self.scheduler.departure_time(stop_id)
+
+    def test_cold_boards_are_fetched_lazily(self):
+        self.request(1)
+        self.time = 10
+        self.scheduler.tick()
+        self.assertEqual(1, len(self.query_strategy.called))
+        self.assertEqual(0, self.scheduler.stats()['prefetches'])
+
+    def test_hottest_orders_by_rate(self):
+        self.request(1, 3)
+        self.request(2, 5)
+        self.request(3, 4)
+        self.assertEqual([2, 3], [key[0] for (key, rate) in self.scheduler.hottest()])
+
+    def test_hot_boards_are_prefetched_when_due(self):
+        self.request(1, 5)
+        self.time = 5
+        self.scheduler.tick()
+        self.assertEqual(1, len(self.query_strategy.called))
+        self.time = 10
+        self.scheduler.tick()
+        self.assertEqual(2, len(self.query_strategy.called))
+        self.assertEqual(1, self.scheduler.stats()['prefetches'])
+
+    def test_prefetched_boards_are_counted_as_hits(self):
+        self.request(1, 5)
+        self.time = 10
+        self.scheduler.tick()
+        self.request(1, 2)
+        stats = self.scheduler.stats()
+        self.assertEqual(2, stats['prefetch_hits'])
+        self.assertEqual(1, stats['upstream_calls_saved'])
+        self.assertEqual(2 / 7, stats['prefetch_hit_ratio'])
+        self.assertEqual(2, len(self.query_strategy.called))
+
+    def test_unused_prefetches_are_wasted(self):
+        self.request(1, 5)
+        self.time = 10
+        self.scheduler.tick()
+        self.time = 20
+        self.scheduler.tick()
+        self.assertEqual(1, self.scheduler.stats()['prefetches_wasted'])
+
+    def test_interval_shrinks_with_rate_within_bounds(self):
+        self.assertEqual(10, self.scheduler.interval(0.01))
+        self.assertEqual(9, self.scheduler.interval(1 / 9))
+        self.assertEqual(8, self.scheduler.interval(10))
+
+    def test_default_interval_spans_quarter_ttl_to_stale_period(self):
+        scheduler = PrefetchScheduler(self.cache)
+        self.assertEqual(30, scheduler.interval(0))
+        self.assertEqual(20, scheduler.interval(1 / 20))
+        self.assertEqual(2.5, scheduler.interval(10))
+
+    def test_budget_limits_prefetches(self):
+        self.scheduler.budget = TokenBucket(0.1, 1, clock=lambda: self.time)
+        self.request(1, 5)
+        self.request(2, 5)
+        self.time = 10
+        self.scheduler.tick()
+        stats = self.scheduler.stats()
+        self.assertEqual(1, stats['prefetches'])
+        self.assertEqual(1, stats['budget_skipped'])
+
+    def test_prefetch_errors_are_counted(self):
+        self.request(1, 5)
+        self.cache.strategy = FailingQueryStrategy()
+        self.time = 10
+        self.scheduler.tick()
+        self.assertEqual(1, self.scheduler.stats()['prefetch_errors'])
+
+    def test_forgotten_boards_are_pruned(self):
+        self.request(1, 5)
+        self.time = 3600
+        self.scheduler.tick()
+        self.assertEqual(0, self.scheduler.stats()['tracked'])
+
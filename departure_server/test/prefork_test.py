@@ -0,0 +1,80 @@
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from unittest import TestCase
+
+from departure_server.prefork import Supervisor
+
+__author__ = 'budde'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class TestSupervisor(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.port = _free_port()
+        self.supervisor = os.fork()
+        if self.supervisor == 0:
+            try:
+                Supervisor(2, self.serve, grace_period=1, restart_delay=0.1).run('localhost', self.port)
+            finally:
+                os._exit(0)
+
+    def tearDown(self):
+        try:
+            os.kill(self.supervisor, signal.SIGTERM)
+            os.waitpid(self.supervisor, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        shutil.rmtree(self.directory)
+
+    def serve(self, listener: socket.socket):
+        open(os.path.join(self.directory, str(os.getpid())), 'w').close()
+        while True:
+            (connection, _) = listener.accept()
+            connection.sendall(bytes(str(os.getpid()), 'ascii'))
+            connection.close()
+
+    def workers(self, count: int) -> list:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            pids = [int(name) for name in os.listdir(self.directory)]
+            if len(pids) >= count:
+                return pids
+            time.sleep(0.02)
+        self.fail("%d workers weren't started" % count)
+
+    def request(self) -> int:
+        with socket.create_connection(('localhost', self.port), timeout=5) as connection:
+            return int(connection.recv(16))
+
+    def test_workers_accept_on_shared_socket(self):
+        pids = self.workers(2)
+        self.assertIn(self.request(), pids)
+
+    def test_crashed_worker_is_restarted(self):
+        pids = self.workers(2)
+        os.kill(pids[0], signal.SIGKILL)
+        restarted = set(self.workers(3)) - set(pids)
+        self.assertEqual(1, len(restarted))
+        for _ in range(5):
+            self.assertIn(self.request(), [pids[1]] + list(restarted))
+
+    def test_terminate_stops_workers(self):
+        pids = self.workers(2)
+        os.kill(self.supervisor, signal.SIGTERM)
+        (_, status) = os.waitpid(self.supervisor, 0)
+        self.assertEqual(0, status)
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+        with self.assertRaises(ConnectionRefusedError):
+            self.request()
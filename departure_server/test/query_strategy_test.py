@@ -0,0 +1,51 @@
+import threading
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from departure_server.connection_pool import UpstreamError
+from departure_server.query_strategy import RejseplanenQueryStrategy, _departure
+from departure_server.test.stub_upstream import StubUpstream
+
+__author__ = 'budde'
+
+
+class TestRejseplanenQueryStrategy(TestCase):
+    def setUp(self):
+        self.upstream = StubUpstream().__enter__()
+        self.query_strategy = RejseplanenQueryStrategy(self.upstream.base_url, pool_size=2, timeout=5)
+
+    def tearDown(self):
+        self.query_strategy.pool.close()
+        self.upstream.__exit__()
+
+    def test_response_is_decompressed_and_parsed(self):
+        element = self.query_strategy.departure_time(1)
+        self.assertEqual(ElementTree.tostring(ElementTree.fromstring(_departure)), ElementTree.tostring(element))
+        self.assertEqual(['/bin/rest.exe/departureBoard?useBus=1&useTog=1&useMetro=1&id=1'], self.upstream.paths)
+
+    def test_connection_is_reused(self):
+        for i in range(5):
+            self.query_strategy.departure_time(i)
+            self.query_strategy.find_nearby(1, 2, 3, 4)
+        self.assertEqual(1, self.upstream.connections)
+        self.assertEqual(10, self.query_strategy.pool.requests)
+
+    def test_pool_size_bounds_connections(self):
+        threads = [threading.Thread(target=self.query_strategy.departure_time, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(10, len(self.upstream.paths))
+        self.assertLessEqual(self.upstream.connections, 2)
+
+    def test_error_status_raises(self):
+        self.upstream.status = 500
+        with self.assertRaises(UpstreamError):
+            self.query_strategy.departure_time(1)
+
+    def test_timeout(self):
+        self.upstream.delay = 0.2
+        self.query_strategy.pool.timeout = 0.05
+        with self.assertRaises(TimeoutError):
+            self.query_strategy.pool.get('departureBoard?id=1')
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from departure_server.rate_limit import TokenBucket
+
+__author__ = 'budde'
+
+
+class TestTokenBucket(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.slept = []
+        self.bucket = TokenBucket(2, 2, clock=lambda: self.time, sleep=self.sleep)
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.time += seconds
+
+    def test_tokens_are_refilled_at_rate(self):
+        self.assertTrue(self.bucket.try_acquire())
+        self.assertTrue(self.bucket.try_acquire())
+        self.assertFalse(self.bucket.try_acquire())
+        self.time = 0.5
+        self.assertTrue(self.bucket.try_acquire())
+
+    def test_acquire_waits_for_tokens(self):
+        self.bucket.try_acquire(2)
+        self.assertTrue(self.bucket.acquire())
+        self.assertEqual([0.5], self.slept)
+
+    def test_acquire_gives_up_at_timeout(self):
+        self.bucket.try_acquire(2)
+        self.assertFalse(self.bucket.acquire(timeout=0.1))
+        self.assertEqual([], self.slept)
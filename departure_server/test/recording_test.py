@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from departure_server.recording import RecordingPool, ReplayPool, RecordingQueryStrategy, ReplayQueryStrategy, \
+    NotRecorded, read_archive
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker, degraded, CLOSED
+from departure_server.test.stub_upstream import StubUpstream
+
+__author__ = 'budde'
+
+
+class FakePool:
+    def __init__(self, clock):
+        self.clock = clock
+        self.bodies = {}
+        self.duration = 0
+        self.connections_opened = 0
+        self.requests = 0
+        self.closed = False
+
+    def get(self, address: str) -> bytes:
+        self.requests += 1
+        self.clock.time += self.duration
+        return self.bodies[address]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.time
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+
+
+class TestRecordingPool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.jsonl.gz')
+        self.clock = FakeClock()
+        self.pool = FakePool(self.clock)
+        self.recording = RecordingPool(self.pool, self.path, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, address: str, body: bytes, at: float, duration: float):
+        self.clock.time = at
+        self.pool.bodies[address] = body
+        self.pool.duration = duration
+        self.assertEqual(body, self.recording.get(address))
+
+    def test_responses_are_recorded_with_timing(self):
+        self.record('departureBoard?id=1', bytes('<Board name="Østerport"/>', 'UTF-8'), 1, 0.5)
+        self.record('stopsNearby?coordX=1', b'<LocationList/>', 3, 0.25)
+        self.recording.close()
+        self.assertEqual([(1, 0.5, 'departureBoard?id=1', bytes('<Board name="Østerport"/>', 'UTF-8')),
+                          (3, 0.25, 'stopsNearby?coordX=1', b'<LocationList/>')], read_archive(self.path))
+        self.assertTrue(self.pool.closed)
+
+    def test_bodies_which_are_not_utf8_are_recorded(self):
+        body = '<Board name="Østerport"/>'.encode('latin-1')
+        self.record('departureBoard?id=1', body, 1, 0.5)
+        self.recording.close()
+        self.assertEqual([(1, 0.5, 'departureBoard?id=1', body)], read_archive(self.path))
+        self.assertEqual(1, self.recording.recorded)
+
+    def test_archive_is_readable_before_closed(self):
+        self.recording.flush_interval = 0
+        self.record('departureBoard?id=1', b'<Board/>', 1, 0.5)
+        self.assertEqual([(1, 0.5, 'departureBoard?id=1', b'<Board/>')], read_archive(self.path))
+        self.recording.close()
+
+    def test_replay_serves_responses_of_the_time_of_the_replay(self):
+        self.record('departureBoard?id=1', b'<Board time="1"/>', 1, 0.5)
+        self.record('departureBoard?id=1', b'<Board time="10"/>', 10, 1)
+        self.recording.close()
+        clock = FakeClock()
+        replay = ReplayPool(self.path, speed=2, clock=clock, sleep=clock.sleep)
+        self.assertEqual(b'<Board time="1"/>', replay.get('departureBoard?id=1'))
+        clock.time = 4.9
+        self.assertEqual(b'<Board time="1"/>', replay.get('departureBoard?id=1'))
+        clock.time = 5
+        self.assertEqual(b'<Board time="10"/>', replay.get('departureBoard?id=1'))
+        self.assertEqual([0.25, 0.25, 0.5], clock.slept)
+
+    def test_replay_of_unrecorded_address_fails(self):
+        self.recording.close()
+        replay = ReplayPool(self.path)
+        self.assertRaises(NotRecorded, replay.get, 'departureBoard?id=1')
+        self.assertEqual(1, replay.missing)
+
+
+class TestRecordingQueryStrategy(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay_needs_no_upstream(self):
+        with StubUpstream() as upstream:
+            recording = RecordingQueryStrategy(upstream.base_url, self.path)
+            board = recording.departure_time(1)
+            nearby = recording.find_nearby(1, 2, 3, 4)
+            recording.close()
+        replay = ReplayQueryStrategy(self.path, speed=1000)
+        self.assertEqual(ElementTree.tostring(board), ElementTree.tostring(replay.departure_time(1)))
+        self.assertEqual(ElementTree.tostring(nearby), ElementTree.tostring(replay.find_nearby(1, 2, 3, 4)))
+        self.assertTrue(degraded(replay.departure_time(2)))
+        self.assertTrue(degraded(replay.departure_time_after(1, datetime(2015, 7, 7, 10, 0))))
+        self.assertEqual(2, replay.pool.missing)
+
+    def test_unrecorded_queries_do_not_open_circuit(self):
+        with StubUpstream() as upstream:
+            recording = RecordingQueryStrategy(upstream.base_url, self.path)
+            recording.departure_time(1)
+            recording.close()
+        strategy = ResilientQueryStrategy(ReplayQueryStrategy(self.path, speed=1000),
+                                          breaker=CircuitBreaker(failure_threshold=2))
+        try:
+            for i in range(3):
+                self.assertTrue(degraded(strategy.departure_time_after(1, datetime(2015, 7, 7, 10, i))))
+            self.assertFalse(degraded(strategy.departure_time(1)))
+            self.assertEqual(CLOSED, strategy.breaker.state)
+        finally:
+            strategy.executor.shutdown()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.registry import StationRegistry
+from departure_server.station import StationLibrary, Position, Station
+
+__author__ = 'budde'
+
+
+class TestStationRegistry(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stations.sqlite')
+        self.registry = self.restart()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def restart(self) -> StationRegistry:
+        """
+        :return: A registry on the same file, as opened after a restart
+        """
+        return StationRegistry(self.path, clock=lambda: self.time)
+
+    def test_unknown_id_is_none(self):
+        self.assertIsNone(self.registry.get(1))
+
+    def test_stations_are_persisted(self):
+        self.registry.record([(1, 'Nørreport', 10, 20), (2, 'Østerport', 30, 40)])
+        registry = self.restart()
+        self.assertEqual((1, 'Nørreport', 10, 20), registry.get(1))
+        self.assertEqual((2, 'Østerport', 30, 40), registry.get(2))
+        self.assertEqual(2, registry.stats()['stations'])
+
+    def test_changed_id_is_reconciled(self):
+        self.registry.record([(1, 'Nørreport', 10, 20)])
+        self.time = 1
+        self.registry.record([(7, 'Nørreport', 10, 20)])
+        for registry in (self.registry, self.restart()):
+            self.assertEqual((7, 'Nørreport', 10, 20), registry.get(7))
+            self.assertEqual((7, 'Nørreport', 10, 20), registry.get(1))
+            self.assertEqual({'stations': 1, 'ids': 2}, {key: registry.stats()[key] for key in ('stations', 'ids')})
+        self.assertEqual(1, self.registry.stats()['reconciled'])
+
+    def test_reused_id_is_moved(self):
+        self.registry.record([(1, 'Nørreport', 10, 20)])
+        self.time = 1
+        self.registry.record([(1, 'Østerport', 30, 40)])
+        for registry in (self.registry, self.restart()):
+            self.assertEqual((1, 'Østerport', 30, 40), registry.get(1))
+            self.assertEqual(1, registry.stats()['stations'])
+
+    def test_only_changes_are_written(self):
+        self.registry.record([(1, 'Nørreport', 10, 20)])
+        self.registry.record([(1, 'Nørreport', 10, 20), (2, 'Østerport', 30, 40)])
+        self.assertEqual(2, self.registry.stats()['writes'])
+
+
+class TestStationLibraryRegistry(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = StationRegistry(os.path.join(self.directory, 'stations.sqlite'))
+        self.query_strategy = StubQueryStrategy()
+        self.lib = StationLibrary(self.query_strategy, registry=self.registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_station_from_id_is_populated_without_upstream_call(self):
+        self.lib.find_nearby(Position(0, 0))
+        self.query_strategy.called = []
+        self.assertEqual(Station(self.lib, 8600626, "København H", Position(55673063, 12565796)),
+                         self.lib.station_from_id(8600626))
+        self.assertEqual([], self.query_strategy.called)
+
+    def test_station_from_past_id_has_current_id(self):
+        self.registry.record([(1, "København H", 55673063, 12565796)])
+        self.lib.find_nearby(Position(0, 0))
+        self.assertEqual(8600626, self.lib.station_from_id(1).id)
+
+    def test_unknown_station_is_empty(self):
+        self.assertEqual(Station(self.lib, 123, '', Position(0, 0)), self.lib.station_from_id(123))
@@ -0,0 +1,159 @@
+import time
+from unittest import TestCase
+
+from departure_server.cache import CachingQueryStrategy
+from departure_server.query_strategy import RejseplanenQueryStrategy, StubQueryStrategy
+from departure_server.rate_limit import TokenBucket
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker, degraded, CLOSED, OPEN, HALF_OPEN
+from departure_server.rest import RESTHandler, degraded_result
+from departure_server.spatial import SpatialIndex
+from departure_server.station import StationLibrary, Position
+from departure_server.test.stub_upstream import StubUpstream
+
+__author__ = 'budde'
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: self.time)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.breaker.failure()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+
+    def test_allows_one_trial_after_reset_timeout(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.time = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_failed_trial_opens_again(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.time = 10
+        self.breaker.allow()
+        self.breaker.failure()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertEqual(2, self.breaker.opened)
+        self.time = 15
+        self.assertFalse(self.breaker.allow())
+
+    def test_abandoned_trial_is_allowed_again(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.time = 10
+        self.breaker.allow()
+        self.breaker.abandon()
+        self.assertTrue(self.breaker.allow())
+
+
+class TestResilientQueryStrategy(TestCase):
+    def setUp(self):
+        self.upstream = StubUpstream().__enter__()
+        self.upstream_strategy = RejseplanenQueryStrategy(self.upstream.base_url, pool_size=4, timeout=5)
+        self.query_strategy = ResilientQueryStrategy(self.upstream_strategy, deadline=0.2,
+                                                     breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    def tearDown(self):
+        self.upstream.__exit__()
+        self.query_strategy.executor.shutdown()
+        self.upstream_strategy.pool.close()
+
+    def test_results_are_passed_through(self):
+        element = self.query_strategy.departure_time(1)
+        self.assertFalse(degraded(element))
+        self.assertEqual(4, len(element))
+
+    def test_errors_serve_last_result(self):
+        element = self.query_strategy.departure_time(1)
+        self.upstream.status = 500
+        self.assertIs(element, self.query_strategy.departure_time(1))
+        self.assertEqual(1, self.query_strategy.stats()['failures'])
+
+    def test_errors_without_result_serve_empty_element(self):
+        self.upstream.status = 500
+        element = self.query_strategy.find_nearby(1, 2, 3, 4)
+        self.assertTrue(degraded(element))
+        self.assertEqual('LocationList', element.tag)
+        self.assertEqual(0, len(element))
+
+    def test_slow_calls_are_abandoned_at_deadline(self):
+        self.upstream.delay = 1
+        started_at = time.monotonic()
+        element = self.query_strategy.departure_time(1)
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        self.assertEqual('DepartureBoard', element.tag)
+        self.assertTrue(degraded(element))
+        self.assertEqual(1, self.query_strategy.stats()['timeouts'])
+
+    def test_open_circuit_rejects_calls_without_calling_upstream(self):
+        self.upstream.status = 500
+        self.query_strategy.departure_time(1)
+        self.query_strategy.departure_time(1)
+        self.assertEqual(OPEN, self.query_strategy.stats()['state'])
+        self.upstream.status = 200
+        self.assertTrue(degraded(self.query_strategy.departure_time(1)))
+        self.assertEqual(2, len(self.upstream.paths))
+        self.assertEqual(1, self.query_strategy.stats()['rejected'])
+
+    def test_slow_calls_open_circuit(self):
+        self.query_strategy.latency_threshold = 0.05
+        self.upstream.delay = 0.1
+        self.assertFalse(degraded(self.query_strategy.departure_time(1)))
+        self.query_strategy.departure_time(1)
+        self.assertEqual(OPEN, self.query_strategy.stats()['state'])
+
+    def test_rate_limited_calls_serve_fallback(self):
+        self.query_strategy.rate_limit = TokenBucket(1, 1)
+        self.assertFalse(degraded(self.query_strategy.departure_time(1)))
+        self.assertTrue(degraded(self.query_strategy.departure_time(2)))
+        self.assertEqual(1, self.query_strategy.stats()['rate_limited'])
+        self.assertEqual(CLOSED, self.query_strategy.stats()['state'])
+
+
+class TestDegradedResults(TestCase):
+    def setUp(self):
+        self.query_strategy = ResilientQueryStrategy(StubQueryStrategy(), breaker=CircuitBreaker(failure_threshold=1))
+        self.query_strategy.breaker.failure()
+
+    def tearDown(self):
+        self.query_strategy.executor.shutdown()
+
+    def test_degraded_boards_are_not_cached(self):
+        cache = CachingQueryStrategy(self.query_strategy)
+        cache.departure_time(1)
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_degraded_locations_do_not_cover_index(self):
+        library = StationLibrary(self.query_strategy, SpatialIndex())
+        self.assertEqual([], library.find_nearby(Position(55673063, 12565796), 100))
+        self.assertIsNone(library.index.find_nearby(55673063, 12565796, 100, 50))
+
+    def test_degraded_results_are_marked(self):
+        handler = RESTHandler(self.query_strategy)
+        try:
+            self.assertTrue(degraded_result(handler.handle(['1.0', 'Stations', 'departures', '1', ''])))
+            self.assertTrue(degraded_result(handler.handle(['1.0', 'Stations', 'departures', '1', ''],
+                                                           {'limit': '5'})))
+            self.assertTrue(degraded_result(handler.handle(['1.0', 'Stations', 'departures', ''], {'ids': '1,2'})))
+            self.assertTrue(degraded_result(handler.handle(['1.0', 'Stations', 'findNearby'],
+                                                           {'lat': '1', 'long': '2', 'radius': '100'})))
+        finally:
+            handler.executor.shutdown()
+
+    def test_results_are_not_marked_degraded(self):
+        handler = RESTHandler(StubQueryStrategy())
+        try:
+            self.assertFalse(degraded_result(handler.handle(['1.0', 'Stations', 'departures', ''], {'ids': '1,2'})))
+        finally:
+            handler.executor.shutdown()
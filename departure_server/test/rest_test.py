@@ -1,6 +1,9 @@
+from datetime import timedelta
+
 from departure_server.query_strategy import StubQueryStrategy
 from departure_server.station import StationLibrary, Position
-from departure_server.rest import Handler, NoSuchFunctionException, RESTHandler
+from departure_server.rest import Handler, NoSuchFunctionException, BadRequestException, RESTHandler
+from departure_server.test.timetable import TimetableQueryStrategy
 
 __author__ = 'budde'
 import unittest
@@ -43,16 +46,41 @@ class TestHandler(unittest.TestCase):
         with self.assertRaises(NoSuchFunctionException):
             self.handler.handle(['a'])
 
+    def test_empty_name_calls_empty_function(self):
+        self.handler.add_handler('a').add_function('', self.caller)
+        self.assertEqual(self.return_value, self.handler.handle(['a']))
+        self.assertEqual([([], {})], self.call_stack)
+
     def test_add_handler_twice_reuses_instance(self):
         self.handler.add_handler('a').add_function('f', self.caller)
         self.handler.add_handler('a').add_function('g', self.caller)
         self.assertEqual(self.return_value, self.handler.handle(['a', 'f']))
         self.assertEqual(self.return_value, self.handler.handle(['a', 'g']))
 
-    def test_handler_updates_name_on_wildcard(self):
+    def test_wildcard_handler_captures_name(self):
         handler = self.handler.add_handler("*")
-        handler.add_function('f', lambda name, inp: self.assertEqual('T', handler.name))
-        self.handler.handle(['T', 'f'])
+        handler.add_function('f', self.caller)
+        self.handler.handle(['T', 'f'], {'a': 'b'})
+        self.assertEqual([(['f'], {'a': 'b', '*': ['T']})], self.call_stack)
+        self.assertEqual('*', handler.name)
+
+    def test_route_names_the_matched_function(self):
+        station_handler = self.handler.add_handler("departures").add_handler("*")
+        station_handler.add_function("", lambda name, inp: None)
+        station_handler.add_function("live", lambda name, inp: None)
+        self.handler.add_function("findNearby", lambda name, inp: None)
+        self.assertEqual("departures/*/", self.handler.route(["departures", "8600626", ""]))
+        self.assertEqual("departures/*/", self.handler.route(["departures", "' OR 1=1"]))
+        self.assertEqual("departures/*/live", self.handler.route(["departures", "1", "live"]))
+        self.assertEqual("findNearby", self.handler.route(["findNearby", "junk", "more"]))
+        self.assertRaises(NoSuchFunctionException, self.handler.route, ["unknown"])
+
+    def test_functions_added_after_handling_are_resolved(self):
+        handler = self.handler.add_handler('a')
+        handler.add_function('f', self.caller)
+        self.handler.handle(['a', 'f'])
+        handler.add_function('g', self.caller)
+        self.assertEqual(self.return_value, self.handler.handle(['a', 'g']))
 
     def caller(self, name, inp):
         self.call_stack.append((name, inp))
@@ -71,7 +99,102 @@ class TestRESTHandler(unittest.TestCase):
                          self.handler.handle(['1.0', 'Stations', 'findNearby'],
                                              {'long': '0', 'lat': 0, 'radius': 1000}))
 
+    def test_missing_parameter_is_bad_request(self):
+        with self.assertRaises(BadRequestException) as context:
+            self.handler.handle(['1.0', 'Stations', 'findNearby'], {'lat': '1', 'long': '2'})
+        self.assertEqual('radius', context.exception.parameter)
+
+    def test_invalid_station_id_is_bad_request(self):
+        for name in [['1.0', 'Stations', 'departures', 'abc', ''], ['1.0', 'Stations', 'departures', 'abc', 'live']]:
+            with self.assertRaises(BadRequestException) as context:
+                self.handler.handle(name)
+            self.assertEqual('id', context.exception.parameter)
+
     def test_get_station_from_name(self):
         s1 = self.lib.station_from_id(603330500).departures()
         s2 = self.handler.handle(['1.0', 'Stations', 'departures', '603330500'])
         self.assertEqual(s1, s2)
+
+    def test_trailing_slash_lists_departures(self):
+        self.assertEqual(self.lib.station_from_id(1).departures(),
+                         self.handler.handle(['1.0', 'Stations', 'departures', '1', '']))
+
+    def test_batch_departures(self):
+        departures = {str(i): self.lib.station_from_id(i).departures() for i in [1, 2]}
+        self.query_strategy.called = []
+        result = self.handler.handle(['1.0', 'Stations', 'departures'], {'ids': '1,2,1,x,²'})
+        self.assertEqual({'departures': departures, 'errors': {'x': 'Invalid id', '²': 'Invalid id'}}, result)
+        self.assertEqual(2, len([c for c in self.query_strategy.called if c[0] == 'departure_time']))
+
+    def test_batch_departures_failure_is_isolated(self):
+        class FailingStubQueryStrategy(StubQueryStrategy):
+            def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True):
+                if stop_id == 13:
+                    raise IOError()
+                return super().departure_time(stop_id, use_bus, use_tog, use_metro)
+
+        handler = RESTHandler(FailingStubQueryStrategy())
+        result = handler.handle(['1.0', 'Stations', 'departures'], {'ids': '13,1'})
+        self.assertEqual(['1'], list(result['departures']))
+        self.assertEqual({'13': 'OSError'}, result['errors'])
+
+
+class TestDeparturePages(unittest.TestCase):
+    def setUp(self):
+        self.query_strategy = TimetableQueryStrategy()
+        self.handler = RESTHandler(self.query_strategy)
+
+    def page(self, **inp) -> dict:
+        return self.handler.handle(['1.0', 'Stations', 'departures', '1'], inp)
+
+    def test_pages_follow_cursor(self):
+        first = self.page(limit='3')
+        self.assertEqual(['Bus 0', 'Bus 2', 'Bus 1'], [d.name for d in first['departures']])
+        second = self.page(limit='3', cursor=first['next'])
+        self.assertEqual(['Bus 3', 'Bus 4', 'Bus 5'], [d.name for d in second['departures']])
+
+    def test_pages_cover_all_departures(self):
+        names = []
+        page = {'next': None}
+        while True:
+            page = self.page(limit='2', **({'cursor': page['next']} if page['next'] else {}))
+            names += [d.name for d in page['departures']]
+            if page['next'] is None:
+                break
+        self.assertEqual(['Bus 0', 'Bus 2', 'Bus 1'] + ['Bus %d' % i for i in range(3, 20)], names)
+
+    def test_cursor_skips_departures_at_same_time(self):
+        self.query_strategy.count = 3
+        self.query_strategy.interval = 0
+        first = self.page(limit='1')
+        self.assertEqual(['Bus 0'], [d.name for d in first['departures']])
+        second = self.page(limit='1', cursor=first['next'])
+        self.assertEqual(['Bus 2'], [d.name for d in second['departures']])
+        self.assertEqual(['Bus 1'], [d.name for d in self.page(limit='1', cursor=second['next'])['departures']])
+
+    def test_last_page_has_no_cursor(self):
+        self.query_strategy.count = 3
+        page = self.page(limit='10')
+        self.assertEqual(3, len(page['departures']))
+        self.assertIsNone(page['next'])
+
+    def test_time_window(self):
+        start = TimetableQueryStrategy.start
+        page = self.page(**{'from': str((start + timedelta(minutes=10)).timestamp()),
+                            'until': str((start + timedelta(minutes=16)).timestamp())})
+        self.assertEqual(['Bus 5', 'Bus 6', 'Bus 7'], [d.name for d in page['departures']])
+        self.assertIsNone(page['next'])
+
+    def test_invalid_parameters_are_bad_requests(self):
+        for inp in [{'cursor': 'garbage'}, {'cursor': '1:-1:'}, {'cursor': '1:2:x'}, {'limit': 'x'},
+                    {'from': 'nan'}, {'until': '1e300'}]:
+            with self.assertRaises(BadRequestException):
+                self.page(**inp)
+        self.assertEqual([], self.query_strategy.called)
+
+    def test_only_needed_boards_are_fetched(self):
+        self.page(limit='2')
+        self.assertEqual(1, len(self.query_strategy.called))
+
+    def test_without_parameters_the_board_is_listed(self):
+        self.assertEqual(4, len(self.page()))
@@ -0,0 +1,32 @@
+import json
+from datetime import datetime
+from unittest import TestCase
+
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.serialization import ModelEncoder, encode_result
+from departure_server.station import StationLibrary, Position, Departure
+
+__author__ = 'budde'
+
+
+class TestEncodeResult(TestCase):
+    def setUp(self):
+        self.lib = StationLibrary(StubQueryStrategy())
+        self.stations = self.lib.find_nearby(Position(0, 0))
+        self.departures = self.stations[0].departures() + [
+            Departure(self.stations[0], 'Bus "1A"', 'BUS', datetime(2015, 7, 7, 23, 59), 'Ørestad \\ Syd')]
+
+    def assertEncodedAsModelEncoder(self, result):
+        self.assertEqual(bytes(json.dumps(result, cls=ModelEncoder), 'UTF-8'), encode_result(result))
+
+    def test_stations(self):
+        self.assertEncodedAsModelEncoder(self.stations)
+        self.assertEncodedAsModelEncoder(self.stations)
+
+    def test_departures(self):
+        self.assertEncodedAsModelEncoder(self.departures)
+
+    def test_other_results(self):
+        self.assertEncodedAsModelEncoder([])
+        self.assertEncodedAsModelEncoder(self.stations + self.departures)
+        self.assertEncodedAsModelEncoder({'stations': self.stations, 'ø': 1.5})
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.resilience import ResilientQueryStrategy, CircuitBreaker
+from departure_server.shared_cache import SharedCacheQueryStrategy
+
+__author__ = 'budde'
+
+
+class TestSharedCacheQueryStrategy(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+        self.query_strategy = StubQueryStrategy()
+        self.cache = self.process()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def process(self, query_strategy=None) -> SharedCacheQueryStrategy:
+        """
+        :return: A cache on the same file, as opened by another process
+        """
+        return SharedCacheQueryStrategy(query_strategy if query_strategy is not None else self.query_strategy,
+                                        self.path, ttl=10, nearby_ttl=100, clock=lambda: self.time)
+
+    def test_responses_are_shared(self):
+        element = self.cache.departure_time(1)
+        other = self.process(StubQueryStrategy())
+        self.assertEqual(ElementTree.tostring(element), ElementTree.tostring(other.departure_time(1)))
+        self.assertEqual([], other.strategy.called)
+        self.assertEqual({'hits': 1, 'misses': 0, 'errors': 0}, other.stats())
+
+    def test_responses_expire(self):
+        self.cache.departure_time(1)
+        self.cache.find_nearby(1, 2, 3, 4)
+        self.time = 10
+        self.cache.departure_time(1)
+        self.cache.find_nearby(1, 2, 3, 4)
+        self.assertEqual(['departure_time', 'find_nearby', 'departure_time'],
+                         [name for (name, _) in self.query_strategy.called])
+
+    def test_keys_include_parameters(self):
+        self.cache.departure_time(1)
+        self.cache.departure_time(1, use_bus=False)
+        self.cache.departure_time(2)
+        self.assertEqual(3, len(self.query_strategy.called))
+
+    def test_degraded_responses_are_not_stored(self):
+        resilient = ResilientQueryStrategy(self.query_strategy, breaker=CircuitBreaker(failure_threshold=1))
+        resilient.breaker.failure()
+        try:
+            self.process(resilient).departure_time(1)
+        finally:
+            resilient.executor.shutdown()
+        self.cache.departure_time(1)
+        self.assertEqual(1, len(self.query_strategy.called))
+
+    def test_expired_responses_are_pruned(self):
+        self.cache.prune_interval = 2
+        self.cache.departure_time(1)
+        self.time = 20
+        self.cache.departure_time(2)
+        count = self.cache._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        self.assertEqual(1, count)
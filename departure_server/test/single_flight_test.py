@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.single_flight import SingleFlightQueryStrategy
+
+__author__ = 'budde'
+
+
+class BlockingStubQueryStrategy(StubQueryStrategy):
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True):
+        self.started.set()
+        self.release.wait(5)
+        if stop_id < 0:
+            raise ValueError(stop_id)
+        return super().departure_time(stop_id, use_bus, use_tog, use_metro)
+
+
+class TestSingleFlightQueryStrategy(TestCase):
+    def setUp(self):
+        self.query_strategy = BlockingStubQueryStrategy()
+        self.single_flight = SingleFlightQueryStrategy(self.query_strategy)
+
+    def run_concurrently(self, stop_ids: list):
+        results = [None] * len(stop_ids)
+
+        def run(index):
+            try:
+                results[index] = self.single_flight.departure_time(stop_ids[index])
+            except ValueError as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(stop_ids))]
+        threads[0].start()
+        self.query_strategy.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while self.single_flight.stats()['coalesced'] < len(stop_ids) - 1:
+            pass
+        self.query_strategy.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_identical_calls_are_coalesced(self):
+        results = self.run_concurrently([1, 1, 1])
+        self.assertEqual([('departure_time', [1, True, True, True])], self.query_strategy.called)
+        self.assertTrue(all(r is self.query_strategy.departure for r in results))
+        self.assertEqual({'calls': 1, 'coalesced': 2, 'in_flight': 0}, self.single_flight.stats())
+
+    def test_errors_are_shared(self):
+        results = self.run_concurrently([-1, -1])
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    def test_sequential_calls_are_not_coalesced(self):
+        self.query_strategy.release.set()
+        self.single_flight.departure_time(1)
+        self.single_flight.departure_time(1)
+        self.assertEqual(2, len(self.query_strategy.called))
+        self.assertEqual(0, self.single_flight.stats()['coalesced'])
+
+    def test_async_calls_join_threaded_call(self):
+        thread = threading.Thread(target=self.single_flight.departure_time, args=(1,))
+        thread.start()
+        self.query_strategy.started.wait(5)
+
+        async def wait_for_board():
+            future = asyncio.ensure_future(self.single_flight.departure_time_async(1))
+            await asyncio.sleep(0)
+            self.query_strategy.release.set()
+            return await future
+
+        self.assertIs(self.query_strategy.departure, asyncio.run(wait_for_board()))
+        thread.join(5)
+        self.assertEqual(1, len(self.query_strategy.called))
+        self.assertEqual(1, self.single_flight.stats()['coalesced'])
@@ -0,0 +1,86 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from departure_server.query_strategy import StubQueryStrategy, _nearby
+from departure_server.spatial import SpatialIndex, distance
+from departure_server.station import StationLibrary, Station, Position
+
+__author__ = 'budde'
+
+
+class TestDistance(TestCase):
+    def test_distance_matches_stops_nearby(self):
+        self.assertAlmostEqual(34, distance(55673063, 12565796, 55672838, 12566191), delta=2)
+        self.assertAlmostEqual(103, distance(55673063, 12565796, 55673899, 12565112), delta=2)
+
+
+class TestSpatialIndex(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.lib = StationLibrary(StubQueryStrategy())
+        self.index = SpatialIndex(clock=lambda: self.time)
+        self.kbh = Station(self.lib, 8600626, "København H", Position(55673063, 12565796))
+        self.tivoli = Station(self.lib, 10844, "Hovedbanegården, Tivoli", Position(55672838, 12566191))
+        self.index.add_all([self.kbh, self.tivoli])
+
+    def test_uncovered_area_is_not_answered(self):
+        self.assertIsNone(self.index.find_nearby(55673063, 12565796, 100, 50))
+
+    def test_covered_area_is_answered_sorted(self):
+        self.index.mark_covered(55673063, 12565796, 1000)
+        self.assertEqual([self.kbh, self.tivoli], self.index.find_nearby(55673063, 12565796, 100, 50))
+        self.assertEqual([self.tivoli, self.kbh], self.index.find_nearby(55672838, 12566191, 100, 50))
+        self.assertEqual([self.kbh], self.index.find_nearby(55673063, 12565796, 10, 50))
+        self.assertEqual([self.kbh], self.index.find_nearby(55673063, 12565796, 100, 1))
+
+    def test_coverage_expires(self):
+        self.index.mark_covered(55673063, 12565796, 1000)
+        self.time = 3601
+        self.assertIsNone(self.index.find_nearby(55673063, 12565796, 100, 50))
+
+    def test_stations_missing_from_covered_circle_are_removed(self):
+        self.index.mark_covered(55673063, 12565796, 1000, [self.kbh])
+        self.assertEqual([self.kbh], self.index.find_nearby(55673063, 12565796, 100, 50))
+        self.assertEqual(1, len(self.index))
+
+    def test_large_circle_is_neither_answered_nor_covered(self):
+        self.index.mark_complete()
+        self.assertIsNone(self.index.find_nearby(55673063, 12565796, 1000000, 50))
+        self.index.complete = False
+        self.index.mark_covered(55673063, 12565796, 1000000)
+        self.assertIsNone(self.index.find_nearby(55673063, 12565796, 100, 50))
+
+    def test_new_id_at_same_position_replaces_station(self):
+        self.index.mark_complete()
+        renamed = Station(self.lib, 1, "København H", Position(55673063, 12565796))
+        self.index.add(renamed)
+        self.assertEqual(2, len(self.index))
+        self.assertEqual([renamed], self.index.find_nearby(55673063, 12565796, 10, 50))
+
+    def test_moved_station_is_removed_from_old_position(self):
+        self.index.mark_complete()
+        self.index.add(Station(self.lib, 10844, "Hovedbanegården, Tivoli", Position(56150156, 10204060)))
+        self.assertEqual([self.kbh], self.index.find_nearby(55673063, 12565796, 100, 50))
+
+
+class TestStationLibraryWithIndex(TestCase):
+    def setUp(self):
+        self.query_strategy = StubQueryStrategy()
+        self.lib = StationLibrary(self.query_strategy, SpatialIndex())
+
+    def test_covered_queries_are_answered_locally(self):
+        stations = self.lib.find_nearby(Position(55673063, 12565796), 1000)
+        self.assertEqual(stations, self.lib.find_nearby(Position(55673063, 12565796), 1000))
+        self.assertEqual(1, len(self.query_strategy.called))
+
+    def test_load_stops(self):
+        (handle, path) = tempfile.mkstemp()
+        with os.fdopen(handle, 'w', encoding='UTF-8') as file:
+            file.write(_nearby)
+        try:
+            self.lib.load_stops(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(8600626, self.lib.find_nearby(Position(55673063, 12565796))[0].id)
+        self.assertEqual([], self.query_strategy.called)
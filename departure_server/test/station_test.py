@@ -3,6 +3,7 @@ from unittest import TestCase
 
 from departure_server.query_strategy import StubQueryStrategy
 from departure_server.station import StationLibrary, Position, Station, Departure
+from departure_server.test.timetable import TimetableQueryStrategy
 
 __author__ = 'budde'
 
@@ -49,3 +50,40 @@ class TestStation(TestCase):
     def test_strategy_called_right(self):
         self.station.departures()
         self.assertEqual([('departure_time', [8600626, True, True, True])], self.query_strategy.called)
+
+
+class TestDepartureStream(TestCase):
+    def setUp(self):
+        self.query_strategy = TimetableQueryStrategy()
+        self.station = StationLibrary(self.query_strategy).station_from_id(1)
+
+    def test_successive_boards_are_merged_in_order(self):
+        names = [d.name for (d, start) in self.station.departure_stream()]
+        self.assertEqual(['Bus 0', 'Bus 2', 'Bus 1'] + ['Bus %d' % i for i in range(3, 20)], names)
+
+    def test_boards_are_fetched_lazily(self):
+        stream = self.station.departure_stream()
+        [next(stream) for _ in range(3)]
+        self.assertEqual(1, len(self.query_strategy.called))
+        next(stream)
+        self.assertEqual(('departure_time_after', [1, datetime(2015, 7, 7, 10, 6), True, True, True]),
+                         self.query_strategy.called[1])
+
+    def test_stream_starts_after_time(self):
+        stream = self.station.departure_stream(datetime(2015, 7, 7, 10, 10))
+        self.assertEqual('Bus 5', next(stream)[0].name)
+
+    def test_boards_are_limited(self):
+        self.assertEqual(7, len(list(self.station.departure_stream(max_boards=2))))
+        self.assertEqual(2, len(self.query_strategy.called))
+
+    def test_board_of_a_single_minute_is_skipped_past(self):
+        self.query_strategy.board_size = 1
+        self.assertEqual(['Bus 0', 'Bus 1'], [d.name for (d, start) in self.station.departure_stream(max_boards=3)])
+        self.assertEqual(datetime(2015, 7, 7, 10, 1), self.query_strategy.called[2][1][1])
+
+    def test_start_includes_boards_of_delayed_departures(self):
+        starts = [(d.name, start) for (d, start) in self.station.departure_stream(datetime(2015, 7, 7, 10, 0))]
+        self.assertEqual(('Bus 1', datetime(2015, 7, 7, 10, 0)), starts[2])
+        self.assertEqual(('Bus 3', datetime(2015, 7, 7, 10, 0)), starts[3])
+        self.assertEqual(('Bus 4', datetime(2015, 7, 7, 10, 6)), starts[4])
@@ -0,0 +1,58 @@
+import gzip
+import http.server
+import threading
+import time
+
+from departure_server.query_strategy import _nearby, _departure
+from departure_server.request_handler import ThreadedHTTPServer
+
+__author__ = 'budde'
+
+
+class StubUpstream:
+    """
+    A local stand-in for the Rejseplanen API.
+    It counts the connections accepted and can inject delays and errors.
+    """
+    def __init__(self):
+        self.connections = 0
+        self.paths = []
+        self.delay = 0
+        self.status = 200
+        upstream = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                upstream.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                upstream.paths.append(self.path)
+                time.sleep(upstream.delay)
+                body = bytes(_nearby if 'stopsNearby' in self.path else _departure, 'UTF-8')
+                self.send_response(upstream.status)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadedHTTPServer(('localhost', 0), Handler)
+        self.server.handle_error = lambda request, client_address: None
+        self.base_url = "http://localhost:%d/bin/rest.exe" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(5)
@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from departure_server.query_strategy import StubQueryStrategy
+from departure_server.spatial import distance
+from departure_server.station import StationLibrary, Station, Position
+from departure_server.tiles import TileCache
+
+__author__ = 'budde'
+
+
+class TestTileCache(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.tiles = TileCache(tile_size=1000, levels=4, max_number=3, ttl=10, clock=lambda: self.time)
+        self.stations = [Station(None, 1, 'A', Position(55000100, 12000100)),
+                         Station(None, 2, 'B', Position(55000300, 12000300)),
+                         Station(None, 3, 'C', Position(55005000, 12005000))]
+        self.fetched = []
+        self.complete = True
+
+    def fetch(self, lat: int, long: int, radius: int, max_number: int) -> (list, bool):
+        self.fetched.append((lat, long, radius, max_number))
+        stations = [station for station in self.stations
+                    if distance(lat, long, station.pos.lat, station.pos.long) <= radius]
+        return stations[:max_number], self.complete
+
+    def test_queries_touch_at_most_four_tiles(self):
+        for radius in (10, 50, 100, 200):
+            tiles = self.tiles.tiles(55000500, 12000500, radius)
+            self.assertLessEqual(len(tiles), 4)
+            self.assertEqual(1, len(set(level for (level, _, _) in tiles)))
+
+    def test_levels_grow_with_radius(self):
+        self.assertEqual(0, self.tiles.tiles(55000500, 12000500, 10)[0][0])
+        self.assertEqual(2, self.tiles.tiles(55000500, 12000500, 100)[0][0])
+
+    def test_too_large_query_isnt_answered(self):
+        self.assertIsNone(self.tiles.tiles(55000500, 12000500, 10000))
+        self.assertIsNone(self.tiles.find_nearby(55000500, 12000500, 10000, 50, self.fetch))
+        self.assertEqual([], self.fetched)
+
+    def test_circle_contains_tile(self):
+        (lat, long, radius) = self.tiles.circle((1, 27500, 6000))
+        for corner in ((55000000, 12000000), (55002000, 12000000), (55000000, 12002000), (55002000, 12002000)):
+            self.assertLessEqual(distance(lat, long, *corner), radius)
+
+    def test_nearby_queries_share_tiles(self):
+        self.assertEqual([self.stations[0], self.stations[1]],
+                         self.tiles.find_nearby(55000150, 12000150, 40, 50, self.fetch))
+        fetched = len(self.fetched)
+        self.assertEqual([self.stations[0]], self.tiles.find_nearby(55000140, 12000100, 10, 50, self.fetch))
+        self.assertEqual(fetched, len(self.fetched))
+        self.assertEqual({'hits': 1, 'misses': 1, 'fallbacks': 0},
+                         {key: self.tiles.stats()[key] for key in ('hits', 'misses', 'fallbacks')})
+
+    def test_tiles_expire(self):
+        self.tiles.find_nearby(55000150, 12000150, 10, 50, self.fetch)
+        fetched = len(self.fetched)
+        self.time = 11
+        self.tiles.find_nearby(55000150, 12000150, 10, 50, self.fetch)
+        self.assertEqual(2 * fetched, len(self.fetched))
+
+    def test_dense_tile_is_remembered(self):
+        self.tiles.max_number = 2
+        self.assertIsNone(self.tiles.find_nearby(55000150, 12000150, 40, 50, self.fetch))
+        fetched = len(self.fetched)
+        self.assertIsNone(self.tiles.find_nearby(55000150, 12000150, 40, 50, self.fetch))
+        self.assertEqual(fetched, len(self.fetched))
+        self.assertEqual(1, self.tiles.stats()['dense'])
+
+    def test_incomplete_tile_isnt_kept(self):
+        self.complete = False
+        self.assertIsNone(self.tiles.find_nearby(55000150, 12000150, 10, 50, self.fetch))
+        self.assertEqual(0, self.tiles.stats()['tiles'])
+
+
+class TestStationLibraryTiles(TestCase):
+    def setUp(self):
+        self.query_strategy = StubQueryStrategy()
+        self.lib = StationLibrary(self.query_strategy, tiles=TileCache())
+
+    def test_find_nearby_filters_tile(self):
+        stations = self.lib.find_nearby(Position(55673063, 12565796), 50)
+        self.assertEqual([Station(self.lib, 8600626, "København H", Position(55673063, 12565796)),
+                          Station(self.lib, 10844, "Hovedbanegården, Tivoli", Position(55672838, 12566191))],
+                         stations)
+        self.assertNotIn(('find_nearby', [55673063, 12565796, 50, 50]), self.query_strategy.called)
+
+    def test_nearby_query_is_answered_from_tiles(self):
+        self.lib.find_nearby(Position(55673063, 12565796), 50)
+        self.query_strategy.called = []
+        self.lib.find_nearby(Position(55673070, 12565800), 50)
+        self.assertEqual([], self.query_strategy.called)
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+from departure_server.query_strategy import StubQueryStrategy
+
+__author__ = 'budde'
+
+
+class TimetableQueryStrategy(StubQueryStrategy):
+    """
+    Serves boards of a timetable with a departure every `interval` minutes from 10:00 on 07.07.15.
+    A board contains the next `board_size` departures scheduled at or after the requested time.
+    Departure 1 is delayed by three minutes.
+    """
+    start = datetime(2015, 7, 7, 10, 0)
+
+    def __init__(self, board_size: int=4, count: int=20, interval: int=2):
+        super().__init__()
+        self.board_size = board_size
+        self.count = count
+        self.interval = interval
+
+    def departure_time(self, stop_id: int, use_bus=True, use_tog=True, use_metro=True) -> ElementTree.Element:
+        super().departure_time(stop_id, use_bus, use_tog, use_metro)
+        return self.board(self.start)
+
+    def departure_time_after(self, stop_id: int, after: datetime, use_bus=True, use_tog=True,
+                             use_metro=True) -> ElementTree.Element:
+        super().departure_time_after(stop_id, after, use_bus, use_tog, use_metro)
+        return self.board(after)
+
+    def board(self, after: datetime) -> ElementTree.Element:
+        board = ElementTree.Element('DepartureBoard')
+        for i in range(self.count):
+            scheduled = self.start + timedelta(minutes=self.interval * i)
+            if scheduled < after or len(board) == self.board_size:
+                continue
+            attributes = {'name': 'Bus %d' % i, 'type': 'BUS', 'direction': 'Aarhus',
+                          'date': scheduled.strftime('%d.%m.%y'), 'time': scheduled.strftime('%H:%M')}
+            if i == 1:
+                attributes['rtTime'] = (scheduled + timedelta(minutes=3)).strftime('%H:%M')
+            ElementTree.SubElement(board, 'Departure', attributes)
+        return board
@@ -0,0 +1,175 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from departure_server.spatial import distance, meters_to_micro_degrees
+
+__author__ = 'budde'
+
+
+class TileCache:
+    """
+    Answers find_nearby queries from the stations of whole tiles of a fixed grid, shared by every query near them.
+    Tiles are squares in micro-degrees. The grid has levels of doubling tile sizes, and a query uses the smallest
+    level whose tiles are at least as large as the query, so it touches at most 2x2 tiles. The stations of a tile
+    are fetched once with the circle around the tile, and every query within the tiles is answered by filtering and
+    sorting the stations locally. Tiles kept at larger levels are used before any tile is fetched.
+    A tile with at least `max_number` stations may be missing some, so it is remembered as dense and queries touching
+    it aren't answered. Neither are queries too large for the grid. Tiles are kept for `ttl` seconds in a bounded LRU.
+    """
+    def __init__(self, tile_size: int=1000, levels: int=7, max_number: int=200, ttl: float=3600,
+                 max_size: int=4096, clock=time.monotonic):
+        """
+        :param tile_size: The size of the smallest tiles in micro-degrees
+        :param levels: The number of levels of the grid
+        :param max_number: The maximum number of stations fetched for a tile
+        :param ttl: Seconds the stations of a tile are kept
+        :param max_size: The maximum number of tiles kept
+        :param clock: A function returning the current (monotonic) time in seconds
+        """
+        self.tile_size = tile_size
+        self.levels = levels
+        self.max_number = max_number
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.fetches = 0
+        self.dense = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tiles(self, lat: int, long: int, radius: int) -> list:
+        """
+        :param lat: The latitude of the center
+        :param long: The longitude of the center
+        :param radius: The radius in meters
+        :return: The (level, y, x) keys of the tiles covering a circle, or None if it is too large for the grid
+        """
+        (lat_delta, long_delta) = meters_to_micro_degrees(radius, lat)
+        level = max(0, math.ceil(math.log2(2 * max(lat_delta, long_delta, 1) / self.tile_size)))
+        if level >= self.levels:
+            return None
+        return self._tiles_at(level, lat, long, lat_delta, long_delta)
+
+    def circle(self, tile: tuple) -> (int, int, int):
+        """
+        :param tile: The (level, y, x) key of a tile
+        :return: A tuple with the latitude, longitude, and radius in meters of a circle containing the tile
+        """
+        (level, y, x) = tile
+        size = self.tile_size << level
+        (lat, long) = (y * size + size // 2, x * size + size // 2)
+        radius = max(distance(lat, long, corner_lat, corner_long)
+                     for corner_lat in (y * size, (y + 1) * size) for corner_long in (x * size, (x + 1) * size))
+        return lat, long, int(math.ceil(radius)) + 1
+
+    def find_nearby(self, lat: int, long: int, radius: int, max_number: int, fetch):
+        """
+        Finds the stations within a radius, sorted by distance, fetching the tiles missing
+        :param lat: The latitude of the center
+        :param long: The longitude of the center
+        :param radius: The radius in meters
+        :param max_number: The maximum number of stations returned
+        :param fetch: A function taking the latitude, longitude, radius, and maximum number of stations of a circle,
+                      and returning a tuple with the list of stations within it and whether the list is complete.
+                      Incomplete lists with fewer than the maximum number of stations, e.g. when the upstream is
+                      degraded, aren't kept.
+        :return: A list of Stations or None if the query can't be answered from tiles
+        :rtype: list[departure_server.station.Station]
+        """
+        tiles = self.tiles(lat, long, radius)
+        if tiles is None:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        (found, missing) = self._lookup(tiles)
+        if found is None:
+            return None
+        if missing:
+            (lat_delta, long_delta) = meters_to_micro_degrees(radius, lat)
+            for level in range(tiles[0][0] + 1, self.levels):
+                (coarse, coarse_missing) = self._lookup(self._tiles_at(level, lat, long, lat_delta, long_delta),
+                                                        count_dense=False)
+                if coarse is not None and not coarse_missing:
+                    (found, missing) = (coarse, [])
+                    break
+        for tile in missing:
+            stations = self._fetch(tile, fetch)
+            if stations is None:
+                with self._lock:
+                    self.fallbacks += 1
+                return None
+            found.extend(stations)
+        with self._lock:
+            if missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+        nearby = {}
+        for station in found:
+            d = distance(lat, long, station.pos.lat, station.pos.long)
+            if d <= radius:
+                nearby[station.id] = (d, station)
+        return [station for (_, station) in sorted(nearby.values(), key=lambda v: v[0])[:max_number]]
+
+    def stats(self) -> dict:
+        """
+        :return: A dictionary with the counters of queries and tiles, and the ratio of queries answered without fetching
+        """
+        with self._lock:
+            queries = self.hits + self.misses + self.fallbacks
+            return {'hits': self.hits, 'misses': self.misses, 'fallbacks': self.fallbacks, 'fetches': self.fetches,
+                    'dense': self.dense, 'evictions': self.evictions, 'tiles': len(self._tiles),
+                    'hit_ratio': self.hits / queries if queries else 0.0}
+
+    def _tiles_at(self, level: int, lat: int, long: int, lat_delta: int, long_delta: int) -> list:
+        size = self.tile_size << level
+        return [(level, y, x)
+                for y in range((lat - lat_delta) // size, (lat + lat_delta) // size + 1)
+                for x in range((long - long_delta) // size, (long + long_delta) // size + 1)]
+
+    def _lookup(self, tiles: list, count_dense: bool=True) -> (list, list):
+        """
+        :param count_dense: Whether a dense tile counts as a fallback
+        :return: A tuple with the stations of the tiles kept and the tiles missing, or (None, None) if a tile is dense
+        """
+        found = []
+        missing = []
+        now = self.clock()
+        with self._lock:
+            for tile in tiles:
+                entry = self._tiles.get(tile)
+                if entry is None or now - entry[0] > self.ttl:
+                    missing.append(tile)
+                    continue
+                self._tiles.move_to_end(tile)
+                if entry[1] is None:
+                    self.fallbacks += count_dense
+                    return None, None
+                found.extend(entry[1])
+        return found, missing
+
+    def _fetch(self, tile: tuple, fetch):
+        """
+        :return: The stations of the tile, or None if the tile is dense or couldn't be fetched completely
+        """
+        (lat, long, radius) = self.circle(tile)
+        (stations, complete) = fetch(lat, long, radius, self.max_number)
+        dense = len(stations) >= self.max_number
+        with self._lock:
+            self.fetches += 1
+            if not complete and not dense:
+                return None
+            if dense:
+                self.dense += 1
+            self._tiles[tile] = (self.clock(), None if dense else stations)
+            self._tiles.move_to_end(tile)
+            while len(self._tiles) > self.max_size:
+                self._tiles.popitem(last=False)
+                self.evictions += 1
+        return None if dense else stations